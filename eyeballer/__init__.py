@@ -1,3 +1,17 @@
-from . import cutouts
-from . import jpegs
-from . import files
+__version__="0.1.3"
+
+# submodules are imported on first use, e.g. eyeballer.cutouts, so that
+# importing the package loads none of their dependencies
+_submodules=['cutouts','jpegs','files','rebin','batch','timing',
+             'focalplane','pathindex','schedule','previews','products',
+             'qa','assign','synthetic','masks','provenance','pipeline',
+             'render','store','skystats','bench']
+
+def __getattr__(name):
+    if name in _submodules:
+        import importlib
+        return importlib.import_module('.'+name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules)
@@ -0,0 +1,256 @@
+"""
+Hand out ccds to reviewers
+
+The queue table has one row per file with the number of reviews it has
+and an optional lease.  The review counts are kept up to date by
+triggers on the qa table.  A partial index on (nreview, fileid) holds
+only the files nobody has leased, so the least reviewed free file is an
+index lookup that never walks past leased files.  Expired leases are
+cleared through a partial index on the leased files.  Within the least
+reviewed level the search starts at a random fileid, and files the
+reviewer has already scored are skipped with one probe each of the qa
+(userid, fileid) index, so the expected cost depends on the fraction of
+the level they have reviewed rather than on how many reviews they have.
+
+    conn=qa.connect(dbfile)
+    fileid=get_next(conn, userid)
+    ...
+    qa.upsert_scores(conn, [{'userid':userid,'fileid':fileid,'score':1}])
+
+A lease reserves a file for one reviewer for lease_time seconds, so two
+reviewers asking at the same time get different files.  Writing a score
+releases the reviewer's lease.
+"""
+from __future__ import print_function
+import time
+import random
+
+from .qa import QA_TABLE
+
+QUEUE_TABLE='queue'
+
+# seconds a reviewer holds a file before it can be handed to someone else
+DEFAULT_LEASE_TIME=600.0
+
+def make_queue_table(conn):
+    """
+    create the queue table, its indexes and the triggers that keep the
+    review counts up to date.  The qa table must already exist
+    """
+    curs=conn.cursor()
+
+    q="""
+create table if not exists {tablename} (
+    fileid integer primary key,
+    nreview integer default 0,
+    lease_userid integer default -1,
+    lease_expires real default 0
+)
+    """.format(tablename=QUEUE_TABLE)
+    print(q)
+    curs.execute(q)
+
+    # replaced by the partial indexes
+    curs.execute("DROP INDEX IF EXISTS {tablename}_nreview_lease_idx".format(tablename=QUEUE_TABLE))
+
+    # the partial index conditions must match the queries in get_next
+    # exactly for sqlite to use them
+    for name, fields, where in [
+            ('free', 'nreview, fileid', 'WHERE lease_userid=-1'),
+            ('leased', 'lease_expires', 'WHERE lease_userid!=-1'),
+            ('lease_userid', 'lease_userid, lease_expires', '')]:
+        q="CREATE INDEX IF NOT EXISTS {tablename}_{name}_idx ON {tablename} ({fields}) {where}"
+        q=q.format(tablename=QUEUE_TABLE, name=name, fields=fields, where=where)
+        print(q)
+        curs.execute(q)
+
+    # the count is redone from the qa fileid index rather than incremented,
+    # so replacing a score does not count it twice
+    recount="""
+    UPDATE {queue} SET nreview=(SELECT count(*) FROM {qa} WHERE fileid={row}.fileid)
+        WHERE fileid={row}.fileid;
+    """
+    release="""
+    UPDATE {queue} SET lease_userid=-1, lease_expires=0
+        WHERE fileid=NEW.fileid AND lease_userid=NEW.userid;
+    """
+
+    triggers=[
+        ('insert', recount.format(queue=QUEUE_TABLE, qa=QA_TABLE, row='NEW')
+                   + release.format(queue=QUEUE_TABLE)),
+        ('update', recount.format(queue=QUEUE_TABLE, qa=QA_TABLE, row='OLD')
+                   + recount.format(queue=QUEUE_TABLE, qa=QA_TABLE, row='NEW')),
+        ('delete', recount.format(queue=QUEUE_TABLE, qa=QA_TABLE, row='OLD')),
+    ]
+    for event, body in triggers:
+        q="""
+CREATE TRIGGER IF NOT EXISTS {qa}_{event}_count AFTER {EVENT} ON {qa}
+BEGIN
+{body}
+END
+        """.format(qa=QA_TABLE, event=event, EVENT=event.upper(), body=body)
+        curs.execute(q)
+
+    curs.close()
+    conn.commit()
+
+def sync_queue(conn, files_table='files'):
+    """
+    add files that are not yet in the queue, and recount the reviews
+    of all files.  Run after the files table is populated
+    """
+    curs=conn.cursor()
+
+    q="""
+    INSERT INTO {queue} (fileid)
+        SELECT rowid FROM {files}
+        WHERE rowid NOT IN (SELECT fileid FROM {queue})
+    """.format(queue=QUEUE_TABLE, files=files_table)
+    curs.execute(q)
+    print('added %d files to the queue' % curs.rowcount)
+
+    q="""
+    UPDATE {queue} SET nreview=
+        (SELECT count(*) FROM {qa} WHERE {qa}.fileid={queue}.fileid)
+    """.format(queue=QUEUE_TABLE, qa=QA_TABLE)
+    curs.execute(q)
+
+    curs.close()
+    conn.commit()
+
+def get_next(conn, userid, lease_time=DEFAULT_LEASE_TIME, max_reviews=None,
+             now=None):
+    """
+    get the next file for a reviewer and lease it to them
+
+    The reviewer gets back a file they already have a lease on if there
+    is one.  Otherwise they get a file with the fewest reviews that they
+    have not reviewed and that nobody else holds.  Among those, the
+    search starts from a random fileid, so reviewers asking at the same
+    time spread over the queue
+
+    parameters
+    ----------
+    conn: sqlite3 connection
+    userid: integer
+        The reviewer
+    lease_time: float, optional
+        Seconds to hold the file, default DEFAULT_LEASE_TIME
+    max_reviews: integer, optional
+        Only hand out files with fewer than this many reviews.  Default
+        is no limit
+    now: float, optional
+        The current time, default time.time()
+
+    output
+    ------
+    the fileid, which is the rowid in the files table, or None if there
+    are no files left for this reviewer
+    """
+    if now is None:
+        now=time.time()
+
+    if max_reviews is None:
+        max_reviews=2**62
+
+    # take the write lock first, so no one else can lease the same file
+    # between the select and the update
+    conn.commit()
+    curs=conn.cursor()
+    curs.execute('BEGIN IMMEDIATE')
+    try:
+        q="""
+        SELECT fileid FROM {queue}
+            WHERE lease_userid=? AND lease_expires >= ?
+            LIMIT 1
+        """.format(queue=QUEUE_TABLE)
+        curs.execute(q, (userid, now))
+        row=curs.fetchone()
+
+        if row is None:
+            # return expired leases to the free files
+            q="""
+            UPDATE {queue} SET lease_userid=-1, lease_expires=0
+                WHERE lease_userid!=-1 AND lease_expires < ?
+            """.format(queue=QUEUE_TABLE)
+            curs.execute(q, (now,))
+
+            row=_find_free(curs, userid, max_reviews)
+        if row is None:
+            fileid=None
+        else:
+            fileid=row[0]
+            q="""
+            UPDATE {queue} SET lease_userid=?, lease_expires=? WHERE fileid=?
+            """.format(queue=QUEUE_TABLE)
+            curs.execute(q, (userid, now+lease_time, fileid))
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        curs.close()
+
+    return fileid
+
+def release_lease(conn, userid, fileid):
+    """
+    give back a file without reviewing it
+    """
+    q="""
+    UPDATE {queue} SET lease_userid=-1, lease_expires=0
+        WHERE fileid=? AND lease_userid=?
+    """.format(queue=QUEUE_TABLE)
+
+    curs=conn.cursor()
+    curs.execute(q, (fileid, userid))
+    curs.close()
+    conn.commit()
+
+# the free index is named, as the planner otherwise prefers the
+# lease_userid index and sorts all free files
+_free_query="""
+SELECT {queue}.fileid FROM {queue} INDEXED BY {queue}_free_idx
+    LEFT JOIN {qa}
+        ON {qa}.userid=? AND {qa}.fileid={queue}.fileid
+    WHERE {queue}.lease_userid=-1 AND {queue}.nreview=?
+    AND {queue}.fileid {op} ? AND {qa}.fileid IS NULL
+    ORDER BY {queue}.fileid
+    LIMIT 1
+"""
+
+_level_query="""
+SELECT min(nreview) FROM {queue} INDEXED BY {queue}_free_idx
+    WHERE lease_userid=-1 AND nreview > ? AND nreview < ?
+""".format(queue=QUEUE_TABLE)
+
+def _find_free(curs, userid, max_reviews):
+    """
+    a free file with the fewest reviews that the user has not scored,
+    going up a level when the user has scored all of one
+
+    output
+    ------
+    (fileid,) or None
+    """
+    curs.execute("SELECT max(fileid) FROM {queue}".format(queue=QUEUE_TABLE))
+    maxid=curs.fetchone()[0]
+    if maxid is None:
+        return None
+    start=random.randint(0, maxid)
+
+    level=-1
+    while True:
+        curs.execute(_level_query, (level, max_reviews))
+        level=curs.fetchone()[0]
+        if level is None:
+            return None
+
+        # from the start to the end, then wrap around
+        for op in ['>=', '<']:
+            q=_free_query.format(queue=QUEUE_TABLE, qa=QA_TABLE, op=op)
+            curs.execute(q, (userid, level, start))
+            row=curs.fetchone()
+            if row is not None:
+                return row
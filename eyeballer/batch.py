@@ -0,0 +1,276 @@
+"""
+Process many image/bkg/output triples in a single process pool
+
+The config is loaded once and handed to each worker when the pool starts,
+so the per-ccd cost is only the processing itself.
+
+With a store_dir, the products are written as records in a per-run store
+rather than as files.  The workers on a host append to the same shard,
+taking turns under a file lock; see eyeballer.store.
+"""
+from __future__ import print_function
+import os
+import time
+import traceback
+
+from .cutouts import EyeballMaker
+from .timing import StageTimer
+from . import provenance
+from . import store
+
+STATUS_OK='ok'
+STATUS_SKIPPED='skipped'
+STATUS_FAILED='failed'
+
+# set in each worker by _init_worker
+_worker_conf=None
+_worker_store=None
+
+def read_manifest(fname):
+    """
+    read a manifest of image, bkg, output triples
+
+    Each line should hold three whitespace separated columns
+        image bkg output
+    Lines from a commands file, of the form
+        ./master.sh image bkg output &> log
+    are also accepted.  Blank lines, comments and echo lines are skipped.
+
+    parameters
+    ----------
+    fname: string
+        The path to the manifest
+
+    output
+    ------
+    list of dicts with image_file, bkg_file and output_file
+    """
+    items=[]
+    with open(fname) as fobj:
+        for line in fobj:
+            ls=line.split()
+            if len(ls)==0 or ls[0][0]=='#' or ls[0]=='echo':
+                continue
+
+            if os.path.basename(ls[0])=='master.sh':
+                ls=ls[1:4]
+
+            if len(ls) < 3:
+                raise ValueError("bad manifest line: '%s'" % line.strip())
+
+            items.append( {'image_file':ls[0],
+                           'bkg_file':ls[1],
+                           'output_file':ls[2]} )
+
+    return items
+
+def run_batch(conf, items, nproc=1, clobber=False, store_dir=None):
+    """
+    process all items, optionally using a pool of worker processes
+
+    parameters
+    ----------
+    conf: dict
+        The run configuration
+    items: list of dicts
+        Each has image_file, bkg_file and output_file, e.g. as
+        returned by read_manifest
+    nproc: integer, optional
+        Number of worker processes, default 1, in which case
+        no pool is used
+    clobber: bool, optional
+        If True, outputs are remade even if they are up to date.  By
+        default only missing or stale outputs are made; see
+        provenance.check_output
+    store_dir: string, optional
+        Write records to the store in this directory rather than
+        writing the output files
+
+    output
+    ------
+    list of result dicts with output_file, status, time and message
+    """
+    results=[]
+    if store_dir is not None:
+        # the store is checked once here rather than by each worker
+        items, results = get_store_todo(conf, items, store_dir, clobber)
+        clobber=True
+
+    args=[(item, clobber) for item in items]
+
+    nproc=int(nproc)
+    if nproc <= 1:
+        _init_worker(conf, store_dir)
+        try:
+            results += [_process_item(arg) for arg in args]
+        finally:
+            _close_worker()
+    else:
+        import multiprocessing
+        pool=multiprocessing.Pool(processes=nproc,
+                                  initializer=_init_worker,
+                                  initargs=(conf,store_dir))
+        try:
+            results += pool.map(_process_item, args, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    return results
+
+def get_store_todo(conf, items, store_dir, clobber=False):
+    """
+    split items into those that need a record written to the store,
+    and results for those that are up to date
+
+    output
+    ------
+    todo, results
+    """
+    if clobber:
+        return items, []
+
+    stale=store.find_stale(store_dir, items, conf)
+
+    todo=[]
+    results=[]
+    for item in items:
+        output_file=item['output_file']
+        if output_file in stale:
+            todo.append(item)
+        else:
+            print("record is up to date, skipping:",output_file)
+            results.append( {'output_file':output_file,
+                             'status':STATUS_SKIPPED,
+                             'time':0.0,
+                             'message':''} )
+
+    return todo, results
+
+def process_item(conf, image_file, bkg_file, output_file, timer=None,
+                 writer=None, key=None):
+    """
+    Make the eyeball file for a single image/bkg pair
+
+    parameters
+    ----------
+    conf: dict
+        The run configuration
+    image_file: string
+        The image from which to cut
+    bkg_file: string
+        The associated background file
+    output_file: string
+        The .fits.fz output file
+    timer: StageTimer, optional
+        Records the time and memory of each stage
+    writer: store.StoreWriter, optional
+        Write a record to the store rather than writing output_file
+    key: (expnum, ccdnum), optional
+        The key for the store record, default taken from the image name
+    """
+    if writer is None and '.fz' not in output_file:
+        raise ValueError("expected .fz fits file name")
+
+    cutmaker=EyeballMaker(conf, image_file, bkg_file, timer=timer)
+
+    if writer is not None:
+        if key is None:
+            key=store.parse_image_name(image_file)
+        prepared=cutmaker.prepare()
+        cutmaker.write_store(writer, key[0], key[1], prepared)
+    else:
+        cutmaker.write_fits(output_file)
+
+def write_summary(fname, results):
+    """
+    write a per-item summary, one line per item with
+        status time output_file message
+
+    parameters
+    ----------
+    fname: string
+        Where to write the summary
+    results: list of dicts
+        As returned by run_batch
+    """
+    print("writing summary:",fname)
+    with open(fname,'w') as fobj:
+        for r in results:
+            line='%s %.2f %s %s' % (r['status'],
+                                    r['time'],
+                                    r['output_file'],
+                                    r['message'])
+            print(line.strip(), file=fobj)
+
+def count_status(results):
+    """
+    get a dict of counts keyed by status
+    """
+    counts={STATUS_OK:0, STATUS_SKIPPED:0, STATUS_FAILED:0}
+    for r in results:
+        counts[r['status']] += 1
+    return counts
+
+def _init_worker(conf, store_dir=None):
+    global _worker_conf, _worker_store
+    _worker_conf=conf
+
+    _worker_store=None
+    if store_dir is not None:
+        import multiprocessing.util
+        _worker_store=store.get_writer(store_dir, conf)
+
+        # pool workers exit without running atexit handlers, but do run
+        # these finalizers
+        multiprocessing.util.Finalize(None, _close_worker, exitpriority=10)
+
+def _close_worker():
+    global _worker_store
+    if _worker_store is not None:
+        _worker_store.close()
+        _worker_store=None
+
+def _process_item(arg):
+    item, clobber = arg
+    output_file=item['output_file']
+
+    result={'output_file':output_file,
+            'status':STATUS_OK,
+            'time':0.0,
+            'message':''}
+
+    if not clobber:
+        reason, record = provenance.check_output(output_file,
+                                                 item['image_file'],
+                                                 item['bkg_file'],
+                                                 _worker_conf)
+        if reason is None:
+            print("file is up to date, skipping:",output_file)
+            result['status']=STATUS_SKIPPED
+            return result
+        elif reason != provenance.REASON_MISSING:
+            print("remaking %s file: %s" % (reason, output_file))
+
+    tm0=time.time()
+    try:
+        key=None
+        if _worker_store is not None:
+            key=store.get_key(item)
+
+        # one ccd at a time, so the peak memory of each stage can be
+        # measured on its own
+        process_item(_worker_conf,
+                     item['image_file'],
+                     item['bkg_file'],
+                     output_file,
+                     timer=StageTimer(owns_process=True),
+                     writer=_worker_store,
+                     key=key)
+    except Exception as err:
+        traceback.print_exc()
+        result['status']=STATUS_FAILED
+        result['message']=str(err).replace('\n',' ')
+
+    result['time']=time.time()-tm0
+    return result
@@ -0,0 +1,923 @@
+"""
+Benchmarks for the eyeballer processing kernels
+
+Each benchmark compares the current implementation against the reference
+version it replaced, and returns a list of dicts with the timings.
+bench_pipeline times each stage of the per-ccd processing on synthetic
+DECam inputs, and bench_render the display upsampling and bpm overlay.  Results can be appended to a history file with
+save_results and compared to earlier runs with compare_results.
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import numpy
+
+from . import rebin
+from . import synthetic
+from .synthetic import CCD_NROWS, CCD_NCOLS
+
+# allowed import time of the modules used by a processing job beyond
+# numpy and fitsio, in seconds
+IMPORT_BUDGET=0.1
+
+# the modules make-se-eyeball imports
+JOB_MODULES=['files','batch','provenance','pipeline','store']
+
+# these should not be loaded by a processing job
+LAZY_MODULES=['desdb','yaml','images','sqlite3']
+
+def bench_rebin(nrows=CCD_NROWS,
+                ncols=CCD_NCOLS,
+                factor=4,
+                ntrial=3,
+                reference=True,
+                seed=None):
+    """
+    Time the rebin kernels on a synthetic image and bitmask
+
+    parameters
+    ----------
+    nrows, ncols: integers, optional
+        Image dimensions, default is a DECam ccd
+    factor: integer, optional
+        The rebin factor, default 4
+    ntrial: integer, optional
+        Number of trials; the best time is reported
+    reference: bool, optional
+        If True, also time the reference python loop version of the
+        bitmask or and check the results agree.  This is very slow
+        for full size images.
+    seed: integer, optional
+        Seed for the random number generator
+    """
+
+    rng=numpy.random.RandomState(seed)
+    im = rng.normal(size=(nrows,ncols)).astype('f4')
+    bpm = _make_bitmask(rng, nrows, ncols)
+
+    results=[]
+
+    kernels=[
+        ('rebin_image', rebin.rebin_image, im),
+        ('rebin_mean_pad', _pad_kernel(rebin.rebin_mean), im),
+        ('rebin_sum', rebin.rebin_sum, im),
+        ('rebin_max', rebin.rebin_max, im),
+        ('rebin_bitmask_or', rebin.rebin_bitmask_or, bpm),
+    ]
+    if reference:
+        kernels += [
+            ('rebin_image_reference', rebin_image_reference, im),
+            ('rebin_bitmask_or_reference', rebin_bitmask_or_reference, bpm),
+        ]
+
+    for name, func, data in kernels:
+        tm, res = time_func(func, data, factor, ntrial=ntrial)
+        results.append( {'name':name,
+                         'shape':data.shape,
+                         'factor':factor,
+                         'time':tm,
+                         'dtype':res.dtype.descr[0][1]} )
+
+    if reference:
+        new = rebin.rebin_bitmask_or(bpm, factor)
+        old = rebin_bitmask_or_reference(bpm, factor)
+        if not numpy.all(new == old):
+            raise RuntimeError("rebin_bitmask_or does not match reference")
+
+    return results
+
+def bench_write(nrows=CCD_NROWS,
+                ncols=CCD_NCOLS,
+                rebin=4,
+                ntrial=3,
+                tmpdir=None,
+                seed=None):
+    """
+    Compare writing the .fits.fz output directly with tile compression
+    against writing an uncompressed file and running fpack on it
+
+    The fpack path is only timed if fpack is in the PATH.  Bytes written
+    counts every file written, including the temporary file.
+
+    parameters
+    ----------
+    nrows, ncols: integers, optional
+        Image dimensions, default is a DECam ccd
+    rebin: integer, optional
+        The rebin factor, default 4
+    ntrial: integer, optional
+        Number of trials; the best time is reported
+    tmpdir: string, optional
+        Where to write the files, default a new temporary directory
+    seed: integer, optional
+        Seed for the random number generator
+    """
+    import tempfile
+    import shutil
+    from .cutouts import EyeballMaker
+
+    created=False
+    if tmpdir is None:
+        tmpdir=tempfile.mkdtemp(prefix='eyeball-bench-')
+        created=True
+
+    try:
+        image_file, bkg_file = synthetic.write_decam_inputs(tmpdir,
+                                                            nrows=nrows,
+                                                            ncols=ncols,
+                                                            seed=seed)[0]
+
+        maker=EyeballMaker({'rebin':rebin}, image_file, bkg_file)
+
+        fzfile=os.path.join(tmpdir, 'direct-eyeball.fits.fz')
+
+        kernels=[('write_fits_direct', _write_direct, fzfile)]
+        if _have_fpack():
+            fzfile_fpack=os.path.join(tmpdir, 'fpack-eyeball.fits.fz')
+            kernels.append( ('write_fits_fpack', _write_fpack, fzfile_fpack) )
+
+        results=[]
+        for name, func, fname in kernels:
+            tm, nbytes = time_func(func, maker, fname, ntrial=ntrial)
+            results.append( {'name':name,
+                             'shape':(nrows,ncols),
+                             'factor':rebin,
+                             'time':tm,
+                             'nbytes':nbytes,
+                             'dtype':'fz'} )
+    finally:
+        if created:
+            shutil.rmtree(tmpdir)
+
+    return results
+
+def bench_import(ntrial=5, budget=IMPORT_BUDGET):
+    """
+    Time importing the modules used by a processing job, JOB_MODULES, in
+    a fresh interpreter, relative to importing numpy and fitsio alone.
+    Check that importing the package alone loads none of its submodules,
+    and that the job loads none of LAZY_MODULES
+
+    parameters
+    ----------
+    ntrial: integer, optional
+        Number of trials; the best time is reported
+    budget: float, optional
+        Allowed time beyond the numpy and fitsio import, default
+        IMPORT_BUDGET.  RuntimeError is raised if it is exceeded
+
+    output
+    ------
+    list of result dicts
+    """
+
+    base_code='import numpy, fitsio'
+    package_code=(
+        'import sys; import eyeballer; '
+        'print(\' \'.join([m for m in sys.modules '
+        'if m.startswith(\'eyeballer.\') or m in %r]))' % (LAZY_MODULES,)
+    )
+    job_code=(
+        'import sys; from eyeballer import %s; '
+        'print(\' \'.join([m for m in %r if m in sys.modules]))'
+        % (', '.join(JOB_MODULES), LAZY_MODULES)
+    )
+
+    base_tm, junk = time_func(_run_python, base_code, ntrial=ntrial)
+    package_tm, package_loaded = time_func(_run_python, package_code,
+                                           ntrial=ntrial)
+    tm, loaded = time_func(_run_python, job_code, ntrial=ntrial)
+
+    results=[
+        {'name':'import_numpy_fitsio', 'shape':(0,0), 'time':base_tm, 'dtype':''},
+        {'name':'import_package', 'shape':(0,0), 'time':package_tm, 'dtype':''},
+        {'name':'import_job_modules', 'shape':(0,0), 'time':tm, 'dtype':''},
+    ]
+
+    package_loaded=package_loaded.split()
+    if len(package_loaded) > 0:
+        raise RuntimeError("importing eyeballer loaded: %s" % ' '.join(package_loaded))
+
+    loaded=loaded.split()
+    if len(loaded) > 0:
+        raise RuntimeError("importing the job modules loaded: %s" % ' '.join(loaded))
+
+    if tm-base_tm > budget:
+        raise RuntimeError("import took %.3f s beyond numpy and fitsio, "
+                           "budget is %.3f s" % (tm-base_tm, budget))
+
+    return results
+
+def bench_qa(nscores=20000,
+             nclients=8,
+             nreaders=2,
+             nfiles=100000,
+             ntrial=1,
+             reference=True,
+             tmpdir=None,
+             seed=None):
+    """
+    Load test of QA score ingestion through a QAServer, with clients
+    sending one score per request while readers query the table
+
+    The reference is the old pattern of one commit per score on a
+    database in the default journal mode, with a single client.
+
+    parameters
+    ----------
+    nscores: integer, optional
+        Total scores sent by the clients
+    nclients: integer, optional
+        Number of concurrent clients; each is a different userid
+    nreaders: integer, optional
+        Number of concurrent reader threads
+    nfiles: integer, optional
+        Scores are for random fileids up to this number, so some are
+        sent more than once
+    ntrial: integer, optional
+        Number of trials; the best time is reported
+    reference: bool, optional
+        If True, also time the reference
+    tmpdir: string, optional
+        Where to write the databases, default a new temporary directory
+    seed: integer, optional
+        Seed for the random number generator
+    """
+    import tempfile
+    import shutil
+
+    created=False
+    if tmpdir is None:
+        tmpdir=tempfile.mkdtemp(prefix='eyeball-bench-')
+        created=True
+
+    try:
+        rng=numpy.random.RandomState(seed)
+        scores=_make_scores(rng, nscores, nclients, nfiles)
+
+        best=None
+        for i in range(ntrial):
+            dbfile=os.path.join(tmpdir, 'qa-%d.db' % i)
+            res=_run_qa_load(dbfile, scores, nclients, nreaders)
+            if best is None or res['time'] < best['time']:
+                best=res
+
+        tm=best['time']
+        results=[
+            {'name':'qa_ingest', 'shape':(nclients,nreaders),
+             'time':tm, 'dtype':'', 'rate':nscores/tm},
+            {'name':'qa_read', 'shape':(nclients,nreaders),
+             'time':tm, 'dtype':'', 'rate':best['nread']/tm},
+        ]
+
+        if reference:
+            nref=min(nscores, 2000)
+            dbfile=os.path.join(tmpdir, 'qa-reference.db')
+            tm, junk = time_func(_ingest_reference, dbfile,
+                                 [s for c in scores for s in c][:nref])
+            results.append( {'name':'qa_ingest_reference', 'shape':(1,0),
+                             'time':tm, 'dtype':'', 'rate':nref/tm} )
+    finally:
+        if created:
+            shutil.rmtree(tmpdir)
+
+    return results
+
+def bench_assign(nfiles=100000,
+                 nusers=50,
+                 nrequests=2000,
+                 nreference=20,
+                 reference=True,
+                 tmpdir=None,
+                 seed=None):
+    """
+    Time handing out files to reviewers with assign.get_next, with each
+    request followed by a score for the file
+
+    The reference finds the least reviewed file the user has not seen by
+    counting the qa table for every file.
+
+    parameters
+    ----------
+    nfiles: integer, optional
+        Number of files in the queue
+    nusers: integer, optional
+        Number of reviewers; requests come from random reviewers
+    nrequests: integer, optional
+        Number of requests to time
+    nreference: integer, optional
+        Number of requests for the reference, which is slow
+    reference: bool, optional
+        If True, also time the reference
+    tmpdir: string, optional
+        Where to write the database, default a new temporary directory
+    seed: integer, optional
+        Seed for the random number generator
+    """
+    import tempfile
+    import shutil
+    from . import qa
+    from . import assign
+
+    created=False
+    if tmpdir is None:
+        tmpdir=tempfile.mkdtemp(prefix='eyeball-bench-')
+        created=True
+
+    try:
+        rng=numpy.random.RandomState(seed)
+        dbfile=os.path.join(tmpdir, 'assign.db')
+        conn=qa.connect(dbfile)
+
+        conn.execute('create table files (field text)')
+        conn.executemany('insert into files (field) values (?)',
+                         [('file%d' % i,) for i in range(nfiles)])
+        conn.commit()
+
+        qa.make_qa_table(conn)
+        assign.make_queue_table(conn)
+        assign.sync_queue(conn)
+
+        # start with some reviews already done
+        nstart=nfiles//2
+        qa.upsert_scores(conn, [{'userid':int(u), 'fileid':int(f), 'score':1}
+                                for u,f in zip(rng.randint(0,nusers,size=nstart),
+                                               rng.randint(1,nfiles+1,size=nstart))])
+
+        userids=rng.randint(0, nusers, size=nrequests)
+
+        def run_assign():
+            for userid in userids:
+                fileid=assign.get_next(conn, int(userid))
+                qa.upsert_scores(conn, [{'userid':int(userid),
+                                         'fileid':fileid,
+                                         'score':1}])
+
+        tm, junk = time_func(run_assign)
+        results=[
+            {'name':'assign_next', 'shape':(nfiles,nusers),
+             'time':tm, 'dtype':'', 'rate':nrequests/tm},
+        ]
+
+        if reference:
+            def run_reference():
+                for userid in userids[:nreference]:
+                    fileid=_get_next_reference(conn, int(userid))
+                    qa.upsert_scores(conn, [{'userid':int(userid),
+                                             'fileid':fileid,
+                                             'score':1}])
+
+            tm, junk = time_func(run_reference)
+            results.append( {'name':'assign_next_reference',
+                             'shape':(nfiles,nusers),
+                             'time':tm, 'dtype':'', 'rate':nreference/tm} )
+
+        conn.close()
+    finally:
+        if created:
+            shutil.rmtree(tmpdir)
+
+    return results
+
+def bench_pipeline(nrows=CCD_NROWS,
+                   ncols=CCD_NCOLS,
+                   rebin=4,
+                   ntrial=3,
+                   stream=False,
+                   tmpdir=None,
+                   seed=None):
+    """
+    Time each stage of making an eyeball file from synthetic DECam
+    inputs, and the whole per-ccd path as run by make-se-eyeball
+
+    Each trial runs in a fresh python process, so the peak memory of
+    each stage is not hidden by earlier trials.  Peak memory is the
+    process high water mark at the end of the stage.
+
+    parameters
+    ----------
+    nrows, ncols: integers, optional
+        Image dimensions, default is a DECam ccd
+    rebin: integer, optional
+        The rebin factor, default 4
+    ntrial: integer, optional
+        Number of trials; the trial with the best total time is reported
+    stream: bool, optional
+        Process the input in strips, default False
+    tmpdir: string, optional
+        Where to write the files, default a new temporary directory
+    seed: integer, optional
+        Seed for the random number generator
+    """
+    import json
+    import tempfile
+    import shutil
+
+    created=False
+    if tmpdir is None:
+        tmpdir=tempfile.mkdtemp(prefix='eyeball-bench-')
+        created=True
+
+    try:
+        image_file, bkg_file = synthetic.write_decam_inputs(tmpdir,
+                                                            nrows=nrows,
+                                                            ncols=ncols,
+                                                            seed=seed,
+                                                            compress=True)[0]
+        output_file=os.path.join(tmpdir, 'pipeline-eyeball.fits.fz')
+
+        conf={'rebin':rebin, 'stream':bool(stream)}
+        code=_pipeline_code % {'conf':conf,
+                               'image_file':image_file,
+                               'bkg_file':bkg_file,
+                               'output_file':output_file}
+
+        best=None
+        for i in range(ntrial):
+            res=json.loads(_run_python(code).strip().split('\n')[-1])
+            if best is None or res['total']['wall'] < best['total']['wall']:
+                best=res
+
+        results=[]
+        for name in best['order']:
+            rec=best['records'][name]
+            results.append( {'name':'pipeline_%s' % name,
+                             'shape':(nrows,ncols),
+                             'time':rec['wall'],
+                             'cpu':rec['cpu'],
+                             'maxrss_mb':rec['maxrss_mb'],
+                             'dtype':''} )
+
+        rec=best['total']
+        results.append( {'name':'pipeline_total',
+                         'shape':(nrows,ncols),
+                         'time':rec['wall'],
+                         'cpu':rec['cpu'],
+                         'maxrss_mb':rec['maxrss_mb'],
+                         'nbytes':os.path.getsize(output_file),
+                         'dtype':'fz'} )
+    finally:
+        if created:
+            shutil.rmtree(tmpdir)
+
+    return results
+
+# run in a fresh process by bench_pipeline; the last line of output is
+# the json encoded timing
+_pipeline_code="""
+import json, time
+import fitsio
+from eyeballer import batch, jpegs
+from eyeballer.cutouts import EyeballMaker
+from eyeballer.timing import StageTimer, get_cpu_time, get_maxrss_mb
+
+conf=%(conf)r
+timer=StageTimer(verbose=False, owns_process=True)
+
+tm0, cpu0 = time.time(), get_cpu_time()
+batch.process_item(conf, %(image_file)r, %(bkg_file)r, %(output_file)r,
+                   timer=timer)
+# the high-water mark is reset at each stage
+total={'wall':time.time()-tm0, 'cpu':get_cpu_time()-cpu0,
+       'maxrss_mb':max([r['maxrss_mb'] for r in timer.records.values()]
+                       + [get_maxrss_mb()])}
+
+maker=EyeballMaker(conf, %(image_file)r, %(bkg_file)r,
+                   timer=StageTimer(verbose=False))
+field=maker._prepare_image()
+
+# prepare_pyramid is only run with a pyramid
+order=[name for name in timer.stages if name in timer.records]
+try:
+    import images
+    with timer.stage('scale_se_image'):
+        jpegs.scale_se_image(field)
+    order.append('scale_se_image')
+except ImportError:
+    pass
+
+with timer.stage('apply_lut'):
+    lut, xmax = jpegs.make_asinh_lut()
+    jpegs.apply_lut(field, lut, xmax)
+order.append('apply_lut')
+
+print(json.dumps({'records':timer.records, 'order':order, 'total':total}))
+"""
+
+def bench_render(nrows=CCD_NROWS,
+                 ncols=CCD_NCOLS,
+                 rebin=4,
+                 factor=4,
+                 ntrial=3,
+                 seed=None):
+    """
+    Time upsampling a rebinned field for display against the mgrid
+    version of boost_image, and rendering the bpm overlay
+
+    parameters
+    ----------
+    nrows, ncols: integers, optional
+        Dimensions of the unrebinned image, default is a DECam ccd
+    rebin: integer, optional
+        The rebin factor of the product, default 4
+    factor: integer, optional
+        The upsampling factor, default 4
+    ntrial: integer, optional
+        Number of trials; the best time is reported
+    seed: integer, optional
+        Seed for the random number generator
+    """
+    from . import render
+    from .rebin import rebin_image, rebin_bitmask_or
+
+    rng=numpy.random.RandomState(seed)
+    data=synthetic.make_decam_image(rng, nrows=nrows, ncols=ncols)
+
+    field=rebin_image(data['sci']-data['bkg'], rebin)
+    bpm=rebin_bitmask_or(data['msk'], rebin)
+
+    shape=(field.shape[0]*factor, field.shape[1]*factor)
+    out=numpy.empty(shape, dtype=field.dtype)
+
+    renderer=render.OverlayRenderer(factor=factor)
+
+    results=[]
+    runs=[
+        ('boost_image_reference', boost_image_reference, (field, factor), {}),
+        ('upsample', render.upsample, (field, factor), {}),
+        ('upsample_out', render.upsample, (field, factor), {'out':out}),
+        ('render_overlay', renderer.render, (field, bpm), {}),
+    ]
+    for name, func, args, keys in runs:
+        tm, res = time_func(func, *args, ntrial=ntrial, **keys)
+        results.append( {'name':name,
+                         'shape':res.shape[0:2],
+                         'factor':factor,
+                         'time':tm,
+                         'dtype':res.dtype.descr[0][1]} )
+
+    new=render.upsample(field, factor)
+    old=boost_image_reference(field, factor)
+    if not numpy.all(new == old):
+        raise RuntimeError("upsample does not match reference")
+
+    return results
+
+def save_results(fname, results, tag=None):
+    """
+    append benchmark results to a history file, one json entry per
+    line, with the time, host and git commit of the code
+
+    parameters
+    ----------
+    fname: string
+        The history file
+    results: list of dicts
+        As returned by the bench_ functions
+    tag: string, optional
+        A label for the entry
+    """
+    import json
+    import datetime
+    from .timing import get_hostname
+
+    entry={'date':datetime.datetime.now().isoformat(),
+           'host':get_hostname(),
+           'commit':_get_git_commit(),
+           'numpy':numpy.__version__,
+           'tag':tag,
+           'results':results}
+
+    print("appending results to:",fname)
+    with open(fname,'a') as fobj:
+        fobj.write(json.dumps(entry)+'\n')
+
+def read_results(fname):
+    """
+    read all entries from a history file written by save_results
+    """
+    import json
+
+    entries=[]
+    with open(fname) as fobj:
+        for line in fobj:
+            line=line.strip()
+            if line != '':
+                entries.append(json.loads(line))
+    return entries
+
+def compare_results(old, new):
+    """
+    print the ratio of new to old times for benchmarks in both
+
+    parameters
+    ----------
+    old: dict
+        An entry from read_results
+    new: list of dicts
+        Results from the bench_ functions
+    """
+    oldres=dict([(r['name'], r) for r in old['results']])
+
+    print("compared to %s %s commit %s" % (old['date'], old['tag'] or '',
+                                          old['commit'] or 'unknown'))
+    print('%-30s %10s %10s %8s %10s %10s' % ('name','old','new','new/old',
+                                             'old MB','new MB'))
+    for r in new:
+        o=oldres.get(r['name'],None)
+        if o is None or o['time'] <= 0:
+            continue
+
+        line='%-30s %10.4f %10.4f %8.2f' % (r['name'], o['time'], r['time'],
+                                            r['time']/o['time'])
+        if 'maxrss_mb' in r and 'maxrss_mb' in o:
+            line += ' %10.1f %10.1f' % (o['maxrss_mb'], r['maxrss_mb'])
+        print(line)
+
+def time_func(func, *args, **keys):
+    """
+    time a function, returning the best time over the trials and the
+    result of the last call
+
+    parameters
+    ----------
+    func: callable
+        The function to time
+    *args:
+        Arguments for the function
+    ntrial: keyword, optional
+        The number of trials, default 1
+    """
+    ntrial=keys.pop('ntrial',1)
+
+    best=None
+    for i in range(ntrial):
+        tm0=time.time()
+        res=func(*args, **keys)
+        tm=time.time()-tm0
+        if best is None or tm < best:
+            best=tm
+
+    return best, res
+
+def print_results(results):
+    """
+    print a table of benchmark results
+    """
+    for r in results:
+        line='%-30s %-14s %-6s %10.4f s' % (r['name'],
+                                           '%dx%d' % tuple(r['shape']),
+                                           r['dtype'],
+                                           r['time'])
+        if 'nbytes' in r:
+            line += ' %12d bytes' % r['nbytes']
+        if 'rate' in r:
+            line += ' %12.1f /s' % r['rate']
+        if 'maxrss_mb' in r:
+            line += ' %8.1f MB' % r['maxrss_mb']
+        print(line)
+
+def rebin_image_reference(im, factor):
+    """
+    the original image rebinning, which does the sum and divide
+    as separate passes
+    """
+    factor=int(factor)
+    s = im.shape
+    newshape = (s[0]//factor, s[1]//factor)
+    return im.reshape(newshape[0],factor,newshape[1],factor,).sum(1).sum(2)/factor/factor
+
+def rebin_bitmask_or_reference(a, factor):
+    """
+    the original python loop implementation of the bitmask or
+    """
+    nrows_new = a.shape[0]//factor
+    ncols_new = a.shape[1]//factor
+
+    rs_a = a.reshape(nrows_new,factor,ncols_new,factor)
+
+    new_a1 = numpy.zeros( (nrows_new, ncols_new, factor), dtype=a.dtype)
+
+    for i0 in range(nrows_new):
+        for i2 in range(ncols_new):
+            for i3 in range(factor):
+                new_a1[i0,i2,i3] = _or_elements(rs_a[i0,:,i2,i3])
+
+    new_a2 = numpy.zeros( (nrows_new, ncols_new), dtype=a.dtype)
+    for i0 in range(nrows_new):
+        for i1 in range(ncols_new):
+            new_a2[i0,i1] = _or_elements(new_a1[i0,i1,:])
+
+    return new_a2
+
+def boost_image_reference(a, factor):
+    """
+    the original upsampling, which indexes with an mgrid of
+    float coordinates
+    """
+    from numpy import mgrid
+
+    factor=int(factor)
+    newshape=numpy.array(a.shape)*factor
+
+    slices = [ slice(0,old, float(old)/new) for old,new in zip(a.shape,newshape) ]
+    coordinates = mgrid[slices]
+    indices = coordinates.astype('i')
+    return a[tuple(indices)]
+
+def _or_elements(arr):
+    x = 0
+    for xi in arr.flat:
+        x |= xi
+
+    return x
+
+def fpack_file(tmp_fitsfile, fitsfile):
+    """
+    the original fpack round trip: fpack the temporary file and remove it
+    """
+
+    print('fpacking:',fitsfile)
+    if os.path.exists(fitsfile):
+        os.remove(fitsfile)
+
+    ret=os.system('fpack %s' % tmp_fitsfile)
+    if ret != 0:
+        raise ValueError("Error fpacking file")
+
+    if not os.path.exists(fitsfile):
+        raise ValueError("fpacked filem missing: %s" % fitsfile)
+    print('removing:',tmp_fitsfile)
+    os.remove(tmp_fitsfile)
+
+def _write_direct(maker, fzfile):
+    maker.write_fits(fzfile)
+    return os.path.getsize(fzfile)
+
+def _write_fpack(maker, fzfile):
+    tmp_fitsfile=fzfile.replace('.fz','')
+    maker.write_fits(tmp_fitsfile)
+    nbytes=os.path.getsize(tmp_fitsfile)
+
+    fpack_file(tmp_fitsfile, fzfile)
+    return nbytes + os.path.getsize(fzfile)
+
+def _have_fpack():
+    for d in os.environ.get('PATH','').split(os.pathsep):
+        if os.path.exists(os.path.join(d,'fpack')):
+            return True
+    return False
+
+def _get_git_commit():
+    """
+    the commit of the code being benchmarked, or None
+    """
+    import subprocess
+
+    dir=os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull,'w') as devnull:
+            output=subprocess.check_output(['git','rev-parse','HEAD'],
+                                           cwd=dir, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return output.decode('utf-8').strip()
+
+def _run_python(code):
+    import subprocess
+
+    output=subprocess.check_output([sys.executable, '-c', code])
+    return output.decode('utf-8')
+
+def _pad_kernel(func):
+    def _func(im, factor):
+        return func(im, factor, edge=rebin.EDGE_PAD)
+    return _func
+
+def _make_bitmask(rng, nrows, ncols, frac=0.01):
+    """
+    a sparse bitmask with a few random bits set
+    """
+    bpm = numpy.zeros( (nrows,ncols), dtype='i2')
+    npix = int(frac*nrows*ncols)
+
+    rows = rng.randint(0, nrows, size=npix)
+    cols = rng.randint(0, ncols, size=npix)
+    bits = rng.randint(0, 14, size=npix)
+    bpm[rows, cols] |= (2**bits).astype('i2')
+    return bpm
+
+def _make_scores(rng, nscores, nclients, nfiles):
+    """
+    random scores, as a list for each client
+    """
+    nper=nscores//nclients
+    scores=[]
+    for userid in range(nclients):
+        n=nper if userid < nclients-1 else nscores-nper*(nclients-1)
+        fileids=rng.randint(1, nfiles+1, size=n)
+        values=rng.randint(-1, 2, size=n)
+        scores.append( [{'userid':userid, 'fileid':int(f), 'score':int(v)}
+                        for f,v in zip(fileids, values)] )
+    return scores
+
+def _run_qa_load(dbfile, scores, nclients, nreaders):
+    """
+    run the clients and readers against a server, returning the time
+    for the clients to finish and the number of reads
+    """
+    import threading
+    from . import qa
+
+    writer=qa.QAWriter(dbfile)
+    server=qa.QAServer(writer, port=0)
+    host, port = server.server_address[:2]
+
+    server_thread=threading.Thread(target=server.serve_forever)
+    server_thread.daemon=True
+    server_thread.start()
+
+    stop=threading.Event()
+    nread=[0]*nreaders
+
+    def read(ireader):
+        conn=qa.connect(dbfile)
+        rng=numpy.random.RandomState(ireader)
+        while not stop.is_set():
+            fileid=int(rng.randint(1, 1000))
+            conn.execute('SELECT count(*), avg(score) FROM qa WHERE fileid=?',
+                         (fileid,)).fetchall()
+            nread[ireader] += 1
+        conn.close()
+
+    def send(client_scores):
+        client=qa.QAClient(host, port)
+        for score in client_scores:
+            client.send(score)
+        client.close()
+
+    readers=[threading.Thread(target=read, args=(i,)) for i in range(nreaders)]
+    clients=[threading.Thread(target=send, args=(c,)) for c in scores]
+
+    for t in readers:
+        t.start()
+
+    tm0=time.time()
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    tm=time.time()-tm0
+
+    stop.set()
+    for t in readers:
+        t.join()
+
+    server.shutdown()
+    server.server_close()
+    writer.close()
+
+    # scores sent more than once should not be duplicated
+    expected=len(set([(s['userid'],s['fileid']) for c in scores for s in c]))
+    conn=qa.connect(dbfile)
+    nrows=conn.execute('SELECT count(*) FROM qa').fetchone()[0]
+    conn.close()
+    if nrows != expected:
+        raise RuntimeError("expected %d qa rows, got %d" % (expected,nrows))
+
+    return {'time':tm, 'nread':sum(nread)}
+
+def _ingest_reference(dbfile, scores):
+    """
+    one insert and commit per score, default journal mode
+    """
+    import sqlite3
+
+    if os.path.exists(dbfile):
+        os.remove(dbfile)
+
+    conn=sqlite3.connect(dbfile)
+    conn.execute('create table qa (userid int, fileid int, '
+                 'score int, comments text)')
+    for s in scores:
+        conn.execute('insert into qa (userid, fileid, score) values (?, ?, ?)',
+                     (s['userid'], s['fileid'], s['score']))
+        conn.commit()
+    conn.close()
+
+def _get_next_reference(conn, userid):
+    """
+    least reviewed file not reviewed by the user, counting the reviews
+    of every file
+    """
+    q="""
+    SELECT files.rowid, count(qa.fileid) AS nreview
+        FROM files LEFT JOIN qa ON qa.fileid=files.rowid
+        WHERE files.rowid NOT IN (SELECT fileid FROM qa WHERE userid=?)
+        GROUP BY files.rowid
+        ORDER BY nreview
+        LIMIT 1
+    """
+    return conn.execute(q, (userid,)).fetchone()[0]
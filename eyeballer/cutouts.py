@@ -5,6 +5,13 @@ from numpy import flipud
 import fitsio
 
 from . import jpegs
+from . import provenance
+from . import skystats
+from .timing import StageTimer
+from .rebin import rebin_image, rebin_bitmask_or, get_rebinned_shape
+from .masks import MaskRules, get_mask_rules, compose_and_rebin
+from .render import upsample
+
 # uncalibrated mags
 MINMAG=10
 MAXMAG=15
@@ -16,16 +23,21 @@ MAG_FIELD='mag_auto'
 
 PADDING = 10
 
+CUTOUT_SIZE=32
+CAT_EXT='LDAC_OBJECTS'
+
 CHIP_REBIN=4
 
-# this bit is larger than the current set of flags
-# https://opensource.ncsa.illinois.edu/confluence/display/DESDM/Guide+to+Bad+Pixel+Masks+%28BPMs%29+and+Mask+Bits
+# rows per strip when streaming; rounded up to a multiple of the rebin
+STRIP_ROWS=256
 
-WEIGHT_LOWVAL_SVY1 = 0.0001
-WEIGHT_BIT=15
-WEIGHT_FLAG=2**WEIGHT_BIT
+# tile compression for .fz output, matching the fpack defaults
+DEFAULT_COMPRESS='rice'
+DEFAULT_QLEVEL=4.0
 
-BADPIX_SUSPECT = 2048
+# the mask bits are defined with the mask rules
+from .masks import (WEIGHT_LOWVAL_SVY1, WEIGHT_BIT, WEIGHT_FLAG,
+                    BADPIX_SUSPECT)
 
 class Image(dict):
     def __init__(self, image_file, bkg_file, **keys):
@@ -39,6 +51,15 @@ class Image(dict):
         bkg_file: FITS filename
             The associated background file
         image_ext, bpm_ext, wt_ext, bkg_ext
+        stream: bool, optional
+            If True, read the data in strips of rows and keep only
+            the rebinned image and bpm, in image_rebin and bpm_rebin.
+            The full resolution image, bpm and weight are not kept.
+            Default False
+        strip_rows: integer, optional
+            Number of rows per strip when streaming, default STRIP_ROWS
+        rebin, low_weight, mask_rules:
+            Used when streaming; see EyeballMaker
         """
 
         self.update(keys)
@@ -51,13 +72,29 @@ class Image(dict):
         self['wt_ext']    = self.get('wt_ext','wgt')
         self['bkg_ext']   = self.get('bkg_ext','sci')
 
-        self._load_data()
+        self['stream']     = self.get('stream',False)
+        self['strip_rows'] = self.get('strip_rows',STRIP_ROWS)
+        self['rebin']      = self.get('rebin',CHIP_REBIN)
+        self['low_weight'] = self.get('low_weight',None)
+
+        self.image_rebin=None
+        self.bpm_rebin=None
+
+        if self['stream']:
+            self._load_data_strips()
+        else:
+            self._load_data()
 
     def write_jpeg(self, fname, rebin=CHIP_REBIN):
         from . import jpegs
         _make_dir(fname)
         print(fname)
-        if rebin:
+        if self['stream']:
+            if rebin != self['rebin']:
+                raise ValueError("streamed images are only available "
+                                 "at rebin %d" % self['rebin'])
+            jpegs.write_se_jpeg(fname, self.image_rebin)
+        elif rebin:
             imrebin=rebin_image(self.image, rebin)
             jpegs.write_se_jpeg(fname, imrebin)
         else:
@@ -81,6 +118,60 @@ class Image(dict):
         self.bpm=bpm
         self.wt=wt
 
+    def _load_data_strips(self):
+        """
+        read the data in strips of rows, background subtracting,
+        applying the mask rules and rebinning each strip.  Only
+        the rebinned image and bpm are kept
+        """
+        print(self['image_file'])
+        print(self['bkg_file'])
+
+        rebin=max(int(self['rebin']),1)
+        strip_rows=int(self['strip_rows'])
+        strip_rows=max(rebin, (strip_rows//rebin)*rebin)
+
+        rules=get_mask_rules(self)
+
+        with fitsio.FITS(self['image_file']) as fits:
+            with fitsio.FITS(self['bkg_file']) as bkg_fits:
+                image_hdu=fits[self['image_ext']]
+                bpm_hdu=fits[self['bpm_ext']]
+                wt_hdu=fits[self['wt_ext']]
+                bkg_hdu=bkg_fits[self['bkg_ext']]
+
+                nrows, ncols = image_hdu.get_dims()
+                nrows_rebin, ncols_rebin = get_rebinned_shape((nrows,ncols), rebin)
+
+                for row_start in range(0, nrows_rebin*rebin, strip_rows):
+                    row_end=min(row_start+strip_rows, nrows_rebin*rebin)
+
+                    image=image_hdu[row_start:row_end, :]
+                    image -= bkg_hdu[row_start:row_end, :]
+
+                    bpm=bpm_hdu[row_start:row_end, :]
+                    wt=None
+                    if rules.needs_weight():
+                        wt=wt_hdu[row_start:row_end, :]
+
+                    imrebin=rebin_image(image, rebin)
+
+                    if self.image_rebin is None:
+                        self.image_rebin=numpy.zeros( (nrows_rebin,ncols_rebin),
+                                                      dtype=imrebin.dtype)
+                        self.bpm_rebin=numpy.zeros( (nrows_rebin,ncols_rebin),
+                                                    dtype=bpm.dtype)
+
+                    rstart=row_start//rebin
+                    rend=row_end//rebin
+                    self.image_rebin[rstart:rend, :] = imrebin
+                    compose_and_rebin(bpm, wt, rules, rebin,
+                                      out=self.bpm_rebin[rstart:rend, :])
+
+        self.image=None
+        self.bpm=None
+        self.wt=None
+
 class EyeballMaker(object):
     def __init__(self, conf, image_file, bkg_file, **keys):
         """
@@ -97,7 +188,35 @@ class EyeballMaker(object):
             How much to rebin the image, default CHIP_REBIN
         low_weight: float, optional
             Lower limit for weight map; values below this get
-            marked in the bpm.  Default None
+            marked in the bpm with WEIGHT_FLAG.  Default None
+        mask_rules: dict, optional
+            Rules for composing the bpm, replacing low_weight; see
+            eyeballer.masks.  The input bpm is modified in place
+        stream: bool, optional
+            If True, process the input in strips of rows so memory
+            use is bounded by the strip size.  Default False
+        strip_rows: integer, optional
+            Number of rows per strip when streaming, default STRIP_ROWS
+        compress: string, optional
+            Tile compression used when writing to a .fz file,
+            default DEFAULT_COMPRESS.  Set to None for no compression
+        qlevel: float, optional
+            Quantization level for compressing floating point
+            images, default DEFAULT_QLEVEL
+        tile_dims: sequence, optional
+            Dimensions of the compression tiles, default is
+            one row per tile
+        pyramid: list of integers, optional
+            Also write the field and bpm at these rebin levels, e.g.
+            [1,4,16,64], as extensions field_{level} and
+            bpm_and_weight_{level}.  Each level must divide the next;
+            each is made from the previous level, not the raw data.
+            Levels finer than rebin need the full image, so can't be
+            used with stream.  Default None
+
+        timer: StageTimer, optional
+            Records the time and peak memory for each stage; these are
+            written to the metadata.  Send your own to add hooks.
         """
 
         self.conf=conf
@@ -107,33 +226,174 @@ class EyeballMaker(object):
         self.rebin=conf.get('rebin',CHIP_REBIN)
 
         self.low_weight=conf.get('low_weight',None)
+        self.mask_rules=get_mask_rules(conf)
+        self._bpm_composed=False
 
-        self._load_data()
+        self.compress=conf.get('compress',DEFAULT_COMPRESS)
+        self.qlevel=conf.get('qlevel',DEFAULT_QLEVEL)
+        self.tile_dims=conf.get('tile_dims',None)
+
+        self.pyramid=conf.get('pyramid',None)
+
+        self.sky_stats=None
+
+        self.timer=keys.get('timer',None)
+        if self.timer is None:
+            self.timer=StageTimer()
+
+        with self.timer.stage('load'):
+            self._load_data()
 
     def write_fits(self, fitsfile, **keys):
+        """
+        write the metadata, field and bpm
+
+        If the file name ends in .fz, the images are tile compressed
+        as they are written.  Sky statistics of the field are written
+        to the metadata; see eyeballer.skystats.  The provenance of the
+        file is written to the metadata header, and checksums are
+        written last; see eyeballer.provenance
+        """
+        prepared=self.prepare(**keys)
+        self.write_prepared(fitsfile, prepared)
+
+    def prepare(self, **keys):
+        """
+        make the field, bpm and any pyramid levels, ready to be written
+        with write_prepared
+
+        output
+        ------
+        dict with field, bpm and levels, the latter a list of
+        (level, field, bpm)
+        """
+        print("preparing image")
+        with self.timer.stage('prepare_image'):
+            tim = self._prepare_image(**keys)
+
+        print("preparing combined bpm")
+        with self.timer.stage('prepare_bpm'):
+            tbpm = self._prepare_combined_bpm(**keys)
+
+        print("measuring sky statistics")
+        with self.timer.stage('sky_stats'):
+            self.sky_stats=skystats.get_sky_stats(tim, tbpm)
+
+        levels=[]
+        if self.pyramid is not None:
+            print("preparing pyramid")
+            with self.timer.stage('prepare_pyramid'):
+                levels=self._prepare_pyramid(tim, tbpm)
+
+        return {'field':tim, 'bpm':tbpm, 'levels':levels}
+
+    def write_prepared(self, fitsfile, prepared):
+        """
+        write the output of prepare; see write_fits
+        """
         fitsfile=os.path.expandvars(fitsfile)
         fitsfile=os.path.expanduser(fitsfile)
 
         print(fitsfile)
         _make_dir(fitsfile)
 
-        with fitsio.FITS(fitsfile,'rw',clobber=True) as fits:
-            meta = self._get_meta()
-            fits.write(meta, extname="metadata")
+        ckeys=self._get_compression_keys(fitsfile)
 
-            print("preparing image")
-            tim = self._prepare_image(**keys)
-            fits.write(tim, extname="field")
+        # written under a temporary name and renamed into place once
+        # complete, so an interrupted write never leaves a partial file
+        tmpfile=fitsfile+'.tmp'
+        try:
+            with fitsio.FITS(tmpfile,'rw',clobber=True) as fits:
+                print("writing data")
+                with self.timer.stage('write'):
+                    meta = self._get_meta()
+                    fits.write(meta, extname="metadata")
+
+                    header={'REBIN':max(int(self.rebin),1)}
+                    fits.write(prepared['field'], extname="field",
+                               header=header, **ckeys)
+                    fits.write(prepared['bpm'], extname="bpm_and_weight",
+                               header=header, **ckeys)
+
+                    for level, lim, lbpm in prepared['levels']:
+                        header={'REBIN':level}
+                        fits.write(lim, extname=get_pyramid_extname('field',level),
+                                   header=header, **ckeys)
+                        fits.write(lbpm,
+                                   extname=get_pyramid_extname('bpm_and_weight',level),
+                                   header=header, **ckeys)
+
+                # now that the write is timed, update the metadata row
+                meta = self._get_meta()
+                fits['metadata'].write(meta)
+
+                fits['metadata'].write_keys(
+                    provenance.get_provenance_keys(self.conf,
+                                                   self.image_file,
+                                                   self.bkg_file)
+                )
+                provenance.write_checksums(fits)
+        except:
+            _remove_quietly(tmpfile)
+            raise
 
-            print("preparing combined bpm")
-            tbpm = self._prepare_combined_bpm(**keys)
+        os.rename(tmpfile, fitsfile)
 
-            print("writing data")
-            fits.write(tbpm, extname="bpm_and_weight")
+    def write_store(self, writer, expnum, ccdnum, prepared):
+        """
+        write the output of prepare as a record in a store, rather than
+        to a FITS file; see eyeballer.store
+
+        parameters
+        ----------
+        writer: store.StoreWriter
+        expnum, ccdnum: integers
+            The key for the record
+        prepared: dict
+            As returned by prepare
+        """
+        arrays={'field':prepared['field'],
+                'bpm_and_weight':prepared['bpm']}
+        rebins={'field':max(int(self.rebin),1)}
+        for level, lim, lbpm in prepared['levels']:
+            arrays[get_pyramid_extname('field',level)]=lim
+            arrays[get_pyramid_extname('bpm_and_weight',level)]=lbpm
+            rebins[get_pyramid_extname('field',level)]=level
+
+        prov=provenance.get_record(self.conf, self.image_file, self.bkg_file)
+
+        print("writing store record:",expnum,ccdnum)
+        with self.timer.stage('write'):
+            meta=self._get_meta()
+            writer.write(expnum, ccdnum, arrays,
+                         meta=_meta_to_dict(meta, rebins),
+                         provenance=prov)
+
+    def free_data(self):
+        """
+        drop the input data, e.g. once prepare has been called
+        """
+        self.image_obj=None
+
+    def _get_compression_keys(self, fitsfile):
+        """
+        keywords for fitsio image writes; only .fz files are compressed
+        """
+        if not fitsfile.endswith('.fz') or self.compress is None:
+            return {}
+
+        ckeys={'compress':self.compress,
+               'qlevel':self.qlevel}
+        if self.tile_dims is not None:
+            ckeys['tile_dims']=self.tile_dims
+
+        return ckeys
 
     def _prepare_image(self):
 
-        if self.rebin <= 1:
+        if self.image_obj.image_rebin is not None:
+            imrebin=self.image_obj.image_rebin
+        elif self.rebin <= 1:
             imrebin=self.image_obj.image
         else:
             imrebin=rebin_image(self.image_obj.image, self.rebin)
@@ -144,23 +404,89 @@ class EyeballMaker(object):
 
     def _prepare_combined_bpm(self):
 
-        bpm=self.image_obj.bpm.copy()
-
-        if self.low_weight is not None:
-            wt_low = numpy.where(self.image_obj.wt < WEIGHT_LOWVAL_SVY1)
+        if self.image_obj.bpm_rebin is not None:
+            imout = flipud(self.image_obj.bpm_rebin)
+            imout = imout.transpose()
+            return imout
 
-            if wt_low[0].size > 0:
-                bpm[wt_low] |= WEIGHT_FLAG
-
-        if self.rebin <= 1:
-            bpm_rebin=bpm
-        else:
-            bpm_rebin= rebin_bitmask_or(bpm, self.rebin)
+        bpm_rebin=self._compose_bpm(self.rebin)
 
         imout = flipud(bpm_rebin)
         imout = imout.transpose()
         return imout
 
+    def _compose_bpm(self, rebin):
+        """
+        apply the mask rules to the full resolution bpm in place, the
+        first time only, and rebin it
+        """
+        rules=self.mask_rules
+        if self._bpm_composed:
+            rules=MaskRules()
+
+        wt=None
+        if rules.needs_weight():
+            wt=self.image_obj.wt
+
+        bpm_rebin=compose_and_rebin(self.image_obj.bpm, wt, rules, rebin)
+        self._bpm_composed=True
+        return bpm_rebin
+
+    def _prepare_pyramid(self, tim, tbpm):
+        """
+        make the pyramid levels, each from the one before.  The chain
+        passes through the main rebin level, for which the already
+        prepared field and bpm are used.  All levels are rebinned in the
+        orientation of the input image, so they crop the same edges as
+        the main level, and are flipped and transposed at the end
+
+        output
+        ------
+        list of (level, field, bpm) for the requested levels other
+        than the main rebin level
+        """
+        rebin=max(int(self.rebin),1)
+        requested=sorted(set([int(l) for l in self.pyramid]))
+        chain=sorted(set(requested + [rebin]))
+
+        for prev, level in zip(chain[:-1], chain[1:]):
+            if level % prev != 0:
+                raise ValueError("pyramid level %d is not a "
+                                 "multiple of %d" % (level,prev))
+
+        if chain[0] < 1:
+            raise ValueError("pyramid levels must be >= 1")
+
+        if chain[0] < rebin:
+            if self.image_obj.image is None:
+                raise ValueError("pyramid levels finer than rebin %d "
+                                 "can't be made when streaming" % rebin)
+
+            first=chain[0]
+            im=self.image_obj.image
+            bpm=self._compose_bpm(first)
+            if first > 1:
+                im=rebin_image(im, first)
+        else:
+            im, bpm = _unorient(tim), _unorient(tbpm)
+
+        levels=[]
+        for i,level in enumerate(chain):
+            if i > 0:
+                if level==rebin:
+                    im, bpm = _unorient(tim), _unorient(tbpm)
+                else:
+                    factor=level//chain[i-1]
+                    im=rebin_image(im, factor)
+                    bpm=rebin_bitmask_or(bpm, factor)
+
+            if level in requested and level != rebin:
+                levels.append( (level,
+                                flipud(im).transpose(),
+                                flipud(bpm).transpose()) )
+
+        return levels
+
 
     def _get_meta(self):
 
@@ -169,11 +495,15 @@ class EyeballMaker(object):
 
         metadt=[('image_file',istr),
                 ('bkg_file',bstr)]
+        metadt += self.timer.get_meta_dtype()
+        metadt += skystats.get_stats_dtype()
 
 
         meta=numpy.zeros(1, dtype=metadt)
         meta['image_file']=self.image_file
         meta['bkg_file']=self.bkg_file
+        self.timer.fill_meta(meta)
+        skystats.fill_meta(meta, self.sky_stats)
 
         return meta
 
@@ -184,99 +514,284 @@ class EyeballMaker(object):
         self.image_obj=imobj
 
 
-def _make_dir(fname):
-    dir=os.path.dirname(fname)
-    if not os.path.exists(dir):
-        print('making directory:',dir)
+class CutoutMaker(object):
+    def __init__(self, conf, image_file, bkg_file, cat_file, **keys):
+        """
+        Make a mosaic of cutouts around catalog objects
+
+        parameters
+        ----------
+        image_file: FITS filename
+            The image from which to cut
+        bkg_file: FITS filename
+            The associated background file
+        cat_file: FITS filename
+            The SExtractor catalog for the image
+
+        minmag, maxmag: float, optional
+            Objects with MAG_FIELD in this range are cut out,
+            default MINMAG, MAXMAG
+        cutout_size: integer, optional
+            Size of the square cutouts, default CUTOUT_SIZE
+        padding: integer, optional
+            Pixels between cutouts in the mosaic, default PADDING
+        cat_ext: string, optional
+            The catalog extension, default CAT_EXT
+        """
+
+        self.conf=conf
+        self.image_file=image_file
+        self.bkg_file=bkg_file
+        self.cat_file=cat_file
+
+        self.minmag=conf.get('minmag',MINMAG)
+        self.maxmag=conf.get('maxmag',MAXMAG)
+        self.cutout_size=int(conf.get('cutout_size',CUTOUT_SIZE))
+        self.padding=int(conf.get('padding',PADDING))
+        self.cat_ext=conf.get('cat_ext',CAT_EXT)
+
+        self._load_data()
+
+    def write_fits(self, fitsfile):
+        """
+        write the metadata, centers and mosaic
+        """
+        fitsfile=os.path.expandvars(fitsfile)
+        fitsfile=os.path.expanduser(fitsfile)
+
+        print(fitsfile)
+        _make_dir(fitsfile)
+
+        print("extracting %d cutouts" % self.centers.size)
+        stamps=extract_stamps(self.image_obj.image,
+                              self.centers['row'],
+                              self.centers['col'],
+                              self.cutout_size)
+
+        # same orientation as the field image
+        stamps=stamps[:, ::-1, :].transpose(0,2,1)
+
+        mosaic=make_mosaic(stamps, padding=self.padding)
+
+        tmpfile=fitsfile+'.tmp'
         try:
-            os.makedirs(dir)
+            with fitsio.FITS(tmpfile,'rw',clobber=True) as fits:
+                fits.write(self._get_meta(), extname="metadata")
+                fits.write(self.centers, extname="centers")
+                fits.write(mosaic, extname="mosaic")
         except:
-            # probably a race condition
-            pass
+            _remove_quietly(tmpfile)
+            raise
 
+        os.rename(tmpfile, fitsfile)
 
-def _string_to_int(s):
+    def _get_meta(self):
+        metadt=[('image_file','S%d' % len(self.image_file)),
+                ('bkg_file','S%d' % len(self.bkg_file)),
+                ('cat_file','S%d' % len(self.cat_file)),
+                ('cutout_size','i4'),
+                ('padding','i4'),
+                ('ncutout','i4'),
+                ('minmag','f4'),
+                ('maxmag','f4')]
+
+        meta=numpy.zeros(1, dtype=metadt)
+        meta['image_file']=self.image_file
+        meta['bkg_file']=self.bkg_file
+        meta['cat_file']=self.cat_file
+        meta['cutout_size']=self.cutout_size
+        meta['padding']=self.padding
+        meta['ncutout']=self.centers.size
+        meta['minmag']=self.minmag
+        meta['maxmag']=self.maxmag
+        return meta
+
+    def _load_data(self):
+        conf={}
+        conf.update(self.conf)
+        conf['stream']=False
+
+        self.image_obj=Image(self.image_file, self.bkg_file, **conf)
+
+        print(self.cat_file)
+        cat=fitsio.read(self.cat_file, ext=self.cat_ext, lower=True)
+
+        self.centers=get_centers(cat, minmag=self.minmag, maxmag=self.maxmag)
+
+def get_centers(cat, minmag=MINMAG, maxmag=MAXMAG):
     """
-    Just take first ten digits
+    Select objects by magnitude and get the zero offset centers
+
+    parameters
+    ----------
+    cat: structured array
+        The SExtractor catalog, with lower case names
+    minmag, maxmag: float, optional
+        Select objects with MAG_FIELD in this range
+
+    output
+    ------
+    structured array with index in the catalog, row, col and mag
     """
-    #ord3 = lambda x : '%.3d' % ord(x)
-    #return int(''.join(map(ord3, s)))
-    ord0 = lambda x : '%d' % ord(x)
-    ival=int(''.join(map(ord0, s)))
-    return ival
+    mag=cat[MAG_FIELD]
+    w,=numpy.where( (mag > minmag) & (mag < maxmag) )
 
-def or_elements(arr):
-    x = 0
-    for xi in arr.flat:
-        x |= xi
+    dt=[('index','i4'),
+        ('row','f8'),
+        ('col','f8'),
+        ('mag','f4')]
+    centers=numpy.zeros(w.size, dtype=dt)
+    centers['index']=w
 
-    return x
+    # SExtractor positions are one offset
+    centers['row']=cat[ROW_FIELD][w]-1
+    centers['col']=cat[COL_FIELD][w]-1
+    centers['mag']=mag[w]
 
-def rebin_bitmask_or(a, rebin_fac):
-    """
-    rebin using builting array methods
+    return centers
 
-    a.reshape(args[0],factor[0],).mean(1) 
-    a.reshape(args[0],factor[0],args[1],factor[1],).mean(1).mean(2)
+def extract_stamps(image, rows, cols, size, fill=0):
+    """
+    Extract square stamps around all centers at once
+
+    Pixels of stamps that fall off the image are set to the fill value
+
+    parameters
+    ----------
+    image: 2-d array
+        The image from which to cut
+    rows, cols: arrays
+        Zero offset centers
+    size: integer
+        Size of the square stamps
+    fill: number, optional
+        Value for pixels off the image, default 0
+
+    output
+    ------
+    array with shape (ncen, size, size)
     """
-    from numpy import asarray
+    nrows, ncols = image.shape
+    size=int(size)
 
-    shape = a.shape
+    offsets=numpy.arange(size) - size//2
 
-    newshape = asarray(shape)/rebin_fac
-    factor = asarray(shape)/newshape
+    rind = numpy.rint(rows).astype('i8')[:,numpy.newaxis] + offsets
+    cind = numpy.rint(cols).astype('i8')[:,numpy.newaxis] + offsets
 
-    rs_a = a.reshape(newshape[0],factor[0],newshape[1],factor[1])
+    rgood = (rind >= 0) & (rind < nrows)
+    cgood = (cind >= 0) & (cind < ncols)
 
-    new_a1 = numpy.zeros( (newshape[0], newshape[1], factor[1]), dtype=a.dtype)
+    rind.clip(0, nrows-1, out=rind)
+    cind.clip(0, ncols-1, out=cind)
 
-    for i0 in xrange(newshape[0]):
-        for i2 in xrange(newshape[1]):
-            for i3 in xrange(factor[1]):
-                new_a1[i0,i2,i3] = or_elements(rs_a[i0,:,i2,i3])
+    stamps=image[rind[:,:,numpy.newaxis], cind[:,numpy.newaxis,:]]
 
-    new_a2 = numpy.zeros( (newshape[0], newshape[1]), dtype=a.dtype)
-    for i0 in xrange(newshape[0]):
-        for i1 in xrange(newshape[1]):
-            new_a2[i0,i1] = or_elements(new_a1[i0,i1,:])
+    good = rgood[:,:,numpy.newaxis] & cgood[:,numpy.newaxis,:]
+    stamps[~good] = fill
 
-    return new_a2
+    return stamps
 
-def rebin_image(im, factor, dtype=None):
+def make_mosaic(stamps, padding=PADDING, fill=0):
     """
-    Rebin the image so there are fewer pixels.  The pixels are simply
-    averaged.
+    Pack the stamps into a square mosaic, so 100 stamps will be in a
+    10x10 grid.  Stamps are placed in row-major order
+
+    parameters
+    ----------
+    stamps: array
+        Array with shape (nstamp, size, size)
+    padding: integer, optional
+        Pixels between the stamps, default PADDING
+    fill: number, optional
+        Value for the padding and unused grid cells, default 0
     """
-    factor=int(factor)
-    s = im.shape
-    if ( (s[0] % factor) != 0
-            or (s[1] % factor) != 0):
-        raise ValueError("shape in each dim (%d,%d) must be "
-                   "divisible by factor (%d)" % (s[0],s[1],factor))
+    nstamp, size, _ = stamps.shape
+    padding=int(padding)
 
-    newshape=numpy.array(s)/factor
-    if dtype is None:
-        a=im
-    else:
-        a=im.astype(dtype)
+    nside=int(numpy.ceil(numpy.sqrt(nstamp)))
+    nside=max(nside, 1)
+    cell=size+padding
 
-    return a.reshape(newshape[0],factor,newshape[1],factor,).sum(1).sum(2)/factor/factor
+    grid=numpy.zeros( (nside*nside, cell, cell), dtype=stamps.dtype)
+    grid[:,:,:] = fill
+    grid[0:nstamp, 0:size, 0:size] = stamps
 
-def boost_image( a, factor):
+    # (row cell, col cell, row, col) -> image
+    grid=grid.reshape(nside, nside, cell, cell)
+    mosaic=grid.transpose(0,2,1,3).reshape(nside*cell, nside*cell)
+
+    # no padding after the last row and column of stamps
+    npix=nside*cell-padding
+    return mosaic[0:npix, 0:npix].copy()
+
+def get_pyramid_extname(extname, level):
     """
-    Resize an array to larger shape, simply duplicating values.
+    extension name for a pyramid level, e.g. field_16
+    """
+    return '%s_%d' % (extname, level)
+
+def flag_low_weight(bpm, wt, low_weight=WEIGHT_LOWVAL_SVY1):
+    """
+    set WEIGHT_FLAG in the bpm, in place, where the weight is below
+    low_weight
+    """
+    rules=MaskRules(weight=[{'below':low_weight, 'flag':WEIGHT_FLAG}])
+    rules.apply(bpm, wt)
+
+def _make_dir(fname):
+    dir=os.path.dirname(fname)
+    if not os.path.exists(dir):
+        print('making directory:',dir)
+        try:
+            os.makedirs(dir)
+        except:
+            # probably a race condition
+            pass
+
+def _unorient(im):
     """
-    from numpy import mgrid
+    a view of an output image in the orientation of the input image,
+    undoing flipud(im).transpose()
+    """
+    return flipud(im.transpose())
 
-    factor=int(factor)
-    if factor < 1:
-        raise ValueError("boost factor must be >= 1")
+def _remove_quietly(fname):
+    try:
+        os.remove(fname)
+    except OSError:
+        pass
 
-    newshape=numpy.array(a.shape)*factor
+def _meta_to_dict(meta, rebins):
+    """
+    the metadata row as a dict of python values, with the rebin level
+    of each field
+    """
+    d={'rebin':rebins}
+    for name in meta.dtype.names:
+        val=meta[name][0]
+        if isinstance(val, bytes):
+            val=val.decode('utf-8')
+        else:
+            val=val.item()
+        d[name]=val
+    return d
 
-    slices = [ slice(0,old, float(old)/new) for old,new in zip(a.shape,newshape) ]
-    coordinates = mgrid[slices]
-    indices = coordinates.astype('i')   #choose the biggest smaller integer index
-    return a[tuple(indices)]
+def _string_to_int(s):
+    """
+    Just take first ten digits
+    """
+    #ord3 = lambda x : '%.3d' % ord(x)
+    #return int(''.join(map(ord3, s)))
+    ord0 = lambda x : '%d' % ord(x)
+    ival=int(''.join(map(ord0, s)))
+    return ival
+
+def boost_image( a, factor):
+    """
+    Resize an array to larger shape, simply duplicating values.
+    See eyeballer.render.upsample
+    """
+    return upsample(a, factor)
 
 
@@ -1,7 +1,8 @@
 from __future__ import print_function
 import os
 
-import desdb
+# desdb is imported only where it is needed, so that processing
+# scripts can run without it installed
 
 
 def get_dir():
@@ -63,6 +64,35 @@ def get_command_file(run, num, missing=False):
         fname='commands-%06d.sh' % num
     return os.path.join(sd, fname)
 
+def get_manifest_file(run, num, missing=False):
+    """
+    The manifest of image, bkg, output triples for make-se-eyeball
+
+    parameters
+    ----------
+    run: string
+        the run identifier
+    missing: bool
+        For missing files
+    """
+    sd=get_script_dir(run)
+    if missing:
+        fname='manifest-missing-%06d.txt' % num
+    else:
+        fname='manifest-%06d.txt' % num
+    return os.path.join(sd, fname)
+
+def get_red_info_cache_file(run):
+    """
+    The cache of red image info from the database
+
+    parameters
+    ----------
+    run: string
+        the run identifier
+    """
+    sd=get_script_dir(run)
+    return os.path.join(sd, 'red-info.json')
 
 def get_wq_file(run, num, missing=False):
     """
@@ -97,6 +127,7 @@ def get_output_file(run, **keys):
 
     df = keys.get('df',None)
     if df is None:
+        import desdb
         df=desdb.files.DESFiles()
 
     imfile=df.url(type='red_immask', **keys)
@@ -110,6 +141,27 @@ def get_output_file(run, **keys):
 
 
 
+def find_output_files(run):
+    """
+    Find all the eyeball output files for a run by walking the run
+    directory
+
+    parameters
+    ----------
+    run: string
+        the run identifier
+    """
+    rundir=get_run_dir(run)
+
+    flist=[]
+    for root, dirs, fnames in os.walk(rundir):
+        for fname in fnames:
+            if fname.endswith('-eyeball.fits.fz'):
+                flist.append(os.path.join(root, fname))
+
+    flist.sort()
+    return flist
+
 def get_output_dir_runexpnum(run, expname):
     """
     The output directory
@@ -208,6 +260,109 @@ def get_db_file(run):
     fname='%s.db' % run
     return os.path.join(dd, fname)
 
+def get_index_dir(run):
+    """
+    The directory for indexes
+
+    parameters
+    ----------
+    run: string
+        the run identifier
+    """
+    rd=get_run_dir(run)
+    return os.path.join(rd, 'index')
+
+def get_path_index_file(run):
+    """
+    The output path index file
+
+    parameters
+    ----------
+    run: string
+        the run identifier
+    """
+    d=get_index_dir(run)
+    fname='%s-paths.npy' % run
+    return os.path.join(d, fname)
+
+
+def get_provenance_file(run):
+    """
+    The per-run manifest of output provenance, used to find stale outputs
+
+    parameters
+    ----------
+    run: string
+        the run identifier
+    """
+    d=get_index_dir(run)
+    fname='%s-provenance.json' % run
+    return os.path.join(d, fname)
+
+def get_store_dir(run):
+    """
+    The directory of the per-run store, used when the run config has
+    output_backend: store
+
+    parameters
+    ----------
+    run: string
+        the run identifier
+    """
+    rd=get_run_dir(run)
+    return os.path.join(rd, 'store')
+
+def get_store_dir_from_config(run, conf):
+    """
+    the store directory if the run writes to a store, otherwise None
+    """
+    backend=conf.get('output_backend','files')
+    if backend=='store':
+        return get_store_dir(run)
+    elif backend=='files':
+        return None
+    else:
+        raise ValueError("output_backend should be 'files' or 'store', "
+                         "got '%s'" % backend)
+
+def read_run_explist(fname, cache=True):
+    """
+    read a three-column file with run, expname, band into a structured
+    array.  A binary copy is cached next to the file; see load_cached
+
+    parameters
+    ----------
+    fname: string
+        The path to the file
+    cache: bool, optional
+        Use and write the cache, default True
+
+    output
+    ------
+    structured array with run, expname and band
+    """
+    return load_cached(fname, _parse_run_explist, cache=cache)
+
+def read_metalist(fname, cache=True):
+    """
+    read a metalist into a structured array.  Each line holds
+        path reqnum expnum attnum ccdnum band
+    and the project and mystery_path are taken from the path.  A binary
+    copy is cached next to the file; see load_cached
+
+    parameters
+    ----------
+    fname: string
+        The path to the file
+    cache: bool, optional
+        Use and write the cache, default True
+
+    output
+    ------
+    structured array with project, mystery_path, reqnum, expnum, attnum,
+    ccdnum and band
+    """
+    return load_cached(fname, _parse_metalist, cache=cache)
 
 def load_run_explist(fname):
     """
@@ -222,39 +377,233 @@ def load_run_explist(fname):
     ------
     list of dicts holding run and expname
     """
-    run_explist=[]
     print("loading run,exp from:",fname)
-    with open(fname) as fobj:
-        for line in fobj:
-            ls=line.split()
+    return to_dicts(read_run_explist(fname))
 
-            run_explist.append( {'run':ls[0], 'expname':ls[1], 'band':ls[2]} )
+def read_metalist_input(fname):
+    """
+    read a metalist as a list of dicts; see read_metalist
+    """
+    return to_dicts(read_metalist(fname))
 
-    return run_explist
+def get_cache_file(fname):
+    """
+    the binary cache of a text list
+    """
+    return fname+'.npy'
 
-def read_metalist_input(fname):
-    dlist=[]
+def load_cached(fname, parser, cache=True):
+    """
+    load a text list with the parser, using a binary copy cached next to
+    the file if it is not older than the file.  If the cache can't be
+    written, e.g. the directory is not writable, the list is parsed
+    each time
+
+    parameters
+    ----------
+    fname: string
+        The path to the text file
+    parser: function
+        Called as parser(fname) to get a structured array
+    cache: bool, optional
+        Use and write the cache, default True
+    """
+    import numpy
+
+    cache_file=get_cache_file(fname)
+
+    if (cache and os.path.exists(cache_file)
+            and os.path.getmtime(cache_file) >= os.path.getmtime(fname)):
+        return numpy.load(cache_file)
+
+    data=parser(fname)
+
+    if cache:
+        tmpname=cache_file+'.tmp'
+        try:
+            with open(tmpname,'wb') as fobj:
+                numpy.save(fobj, data)
+            os.rename(tmpname, cache_file)
+        except (IOError, OSError) as err:
+            print("could not write cache %s: %s" % (cache_file, err))
+
+    return data
+
+def select_rows(data, **keys):
+    """
+    get the rows of a structured array matching all of the sent fields,
+    e.g. select_rows(data, expnum=229686, band='r').  Values can be
+    scalars or lists
+    """
+    import numpy
+
+    w=numpy.ones(data.size, dtype=bool)
+    for name,val in keys.items():
+        col=data[name]
+        val=numpy.atleast_1d(val)
+        if col.dtype.kind=='S':
+            val=val.astype(col.dtype)
+        w &= numpy.isin(col, val)
+    return data[w]
+
+def to_dicts(data):
+    """
+    convert a structured array to a list of dicts of python values, with
+    strings converted from bytes
+    """
+    names=data.dtype.names
+    columns=[]
+    for name in names:
+        col=data[name]
+        if col.dtype.kind=='S':
+            col=col.astype('U')
+        columns.append(col.tolist())
+
+    return [dict(zip(names,vals)) for vals in zip(*columns)]
+
+# marks line ends when splitting; not whitespace, so split keeps it
+_LINE_END='\x00'
+
+def _read_columns(fname, ncol, extra=False):
+    """
+    read a whitespace separated text file as a list of columns of
+    strings, splitting the whole file at once.  If extra is True, lines
+    may have more columns, which are ignored
+    """
     with open(fname) as fobj:
-        for line in fobj:
-            path,reqnum,expnum,attnum,ccdnum,band=line.split()
+        text=fobj.read()
+
+    if len(text) > 0 and not text.endswith('\n'):
+        text += '\n'
+    nlines=text.count('\n')
+
+    # mark the line ends, so the split can be checked line by line:
+    # every line has ncol columns if each ncol+1'th token is a mark
+    tokens=text.replace('\n', ' %s ' % _LINE_END).split()
+    nper=ncol+1
+    if (len(tokens)==nlines*nper
+            and tokens[ncol::nper].count(_LINE_END)==nlines):
+        return [tokens[i::nper] for i in range(ncol)]
+
+    # blank lines, extra or missing columns; go line by line
+    tokens=[]
+    for line in text.splitlines():
+        ls=line.split()
+        if len(ls)==0:
+            continue
+        if len(ls) < ncol or (len(ls) > ncol and not extra):
+            raise ValueError("expected %d columns in %s, "
+                             "got '%s'" % (ncol,fname,line))
+        tokens += ls[:ncol]
+
+    return [tokens[i::ncol] for i in range(ncol)]
+
+def _make_array(columns, dtype):
+    """
+    make a structured array from columns; string fields given with no
+    size get the longest length in the data
+    """
+    import numpy
+
+    # numpy sizes the strings and converts the integers
+    arrays=[]
+    dt=[]
+    for (name,typ), col in zip(dtype, columns):
+        if typ[0]=='S':
+            col=numpy.asarray(col, dtype='S')
+            if typ=='S':
+                typ=col.dtype.str[1:]
+        else:
+            col=numpy.asarray(col, dtype='S').astype(typ)
+        arrays.append(col)
+        dt.append( (name,typ) )
+
+    data=numpy.zeros(len(columns[0]), dtype=dt)
+    for (name,typ), col in zip(dt, arrays):
+        data[name]=col
+    return data
+
+def _parse_run_explist(fname):
+    columns=_read_columns(fname, 3, extra=True)
+    return _make_array(columns, [('run','S'), ('expname','S'), ('band','S')])
+
+def _parse_metalist(fname):
+    import numpy
+
+    path,reqnum,expnum,attnum,ccdnum,band=_read_columns(fname, 6)
+
+    project, mystery_path = _split_metalist_paths(fname, path)
+
+    dtype=[('project','S'),
+           ('mystery_path','S'),
+           ('reqnum','i4'),
+           ('expnum','i4'),
+           ('attnum','i2'),
+           ('ccdnum','i2'),
+           ('band','S')]
+    columns=[project,mystery_path,reqnum,expnum,attnum,ccdnum,band]
+    return _make_array(columns, dtype)
+
+def _split_metalist_paths(fname, path):
+    """
+    get the project, the first directory of each path, and the mystery
+    path, the fourth directory up to any dash.  This works on the bytes
+    of all the paths at once, finding the slashes with numpy
+    """
+    import numpy
+
+    paths=numpy.asarray(path, dtype='S')
+    n=paths.size
+    b=paths.view('u1').reshape(n, paths.dtype.itemsize)
+    rows=numpy.arange(n)
+
+    # the first three slashes, and the fourth or the end of the path
+    slash=(b==ord('/'))
+    ends=[]
+    for i in range(4):
+        pos=slash.argmax(axis=1)
+        found=slash[rows,pos]
+        if i < 3 and not found.all():
+            raise ValueError("expected at least four directories in metalist "
+                             "path in %s, got '%s'" % (fname, paths[~found][0]))
+        if i==3:
+            pos=numpy.where(found, pos, numpy.count_nonzero(b, axis=1))
 
-            psplit = path.split('/')
+        ends.append(pos)
+        slash[rows[found], pos[found]]=False
 
-            project = psplit[0]
-            mystery_path = psplit[3]
-            mystery_path = mystery_path.split('-')[0]
+    project=_get_bytes(b, numpy.zeros(n, dtype=ends[0].dtype), ends[0])
 
-            conf=dict(project=project,
-                      mystery_path=mystery_path,
-                      reqnum=int(reqnum),
-                      expnum=int(expnum),
-                      attnum=int(attnum),
-                      ccdnum=int(ccdnum),
-                      band=band)
+    mystery_path=_get_bytes(b, ends[2]+1, ends[3])
+    mystery_path[numpy.logical_or.accumulate(mystery_path==ord('-'), axis=1)]=0
+
+    return _to_strings(project), _to_strings(mystery_path)
+
+def _to_strings(b):
+    """
+    a string array from zero padded bytes, as long as the longest string
+    """
+    import numpy
+
+    nmax=max(numpy.count_nonzero(b, axis=1).max(initial=0), 1)
+    b=numpy.ascontiguousarray(b[:, :nmax])
+    return b.view('S%d' % nmax).ravel()
+
+def _get_bytes(b, start, end):
+    """
+    the bytes from start to end of each row of b, zero padded
+    """
+    import numpy
 
-            dlist.append(conf)
+    n, width = b.shape
+    length=end-start
+    maxlen=max(length.max(initial=0), 1)
 
-    return dlist
+    j=numpy.arange(maxlen)
+    ind=numpy.minimum(start[:,None]+j, width-1)
+    out=b[numpy.arange(n)[:,None], ind]
+    out[j >= length[:,None]]=0
+    return out
 
 
 #
@@ -0,0 +1,266 @@
+"""
+Assemble the per-ccd eyeball products of an exposure into a single
+focal plane image
+
+The products are read concurrently and each is placed directly into
+a preallocated focal plane array.  The field and bpm_and_weight images
+are in the orientation written by EyeballMaker, where a DECam ccd is
+wider than it is tall.
+"""
+from __future__ import print_function
+import os
+import re
+import numpy
+import fitsio
+
+from .rebin import rebin_image, rebin_bitmask_or
+
+# ccdnums in each row of the DECam focal plane, S29-S31 at the top
+# through N29-N31 at the bottom.  Rows are centered horizontally.
+DECAM_LAYOUT=[
+    [1,2,3],
+    [4,5,6,7],
+    [8,9,10,11,12],
+    [13,14,15,16,17,18],
+    [19,20,21,22,23,24],
+    [25,26,27,28,29,30,31],
+    [32,33,34,35,36,37,38],
+    [39,40,41,42,43,44],
+    [45,46,47,48,49,50],
+    [51,52,53,54,55],
+    [56,57,58,59],
+    [60,61,62],
+]
+
+# gap between ccds in the output, in output pixels
+CCD_GAP=4
+
+DEFAULT_NTHREADS=8
+
+class FocalPlaneMaker(object):
+    def __init__(self, fnames, rebin=1, gap=CCD_GAP, layout=DECAM_LAYOUT,
+                 nthreads=DEFAULT_NTHREADS):
+        """
+        parameters
+        ----------
+        fnames: list of strings
+            The eyeball files for the ccds of an exposure.  The ccdnum
+            is taken from the _cNN_ part of the name
+        rebin: integer, optional
+            Further rebin the products by this factor, default 1
+        gap: integer, optional
+            Gap between ccds in output pixels, default CCD_GAP
+        layout: list of lists, optional
+            ccdnums in each row of the focal plane, default DECAM_LAYOUT
+        nthreads: integer, optional
+            Number of threads used to read the products,
+            default DEFAULT_NTHREADS
+        """
+
+        self.rebin=int(rebin)
+        self.gap=int(gap)
+        self.layout=layout
+        self.nthreads=int(nthreads)
+
+        self.ccds=self._get_ccd_list(fnames)
+
+        # products that could not be read or placed
+        self.failed=[]
+
+    def go(self):
+        """
+        read the products and assemble the focal plane
+
+        output
+        ------
+        field, bpm arrays; also stored as self.field and self.bpm
+        """
+        import multiprocessing.pool
+
+        if len(self.ccds)==0:
+            raise ValueError("no ccd products to assemble")
+
+        # the first one read sets the size and types
+        for i, first in enumerate(self.ccds):
+            res=self._read_checked(first)
+            if res is not None:
+                break
+        else:
+            raise IOError("none of the %d ccd products could "
+                          "be read" % len(self.ccds))
+
+        field, bpm = res
+        self._allocate(field, bpm)
+        self._place(first, field, bpm)
+
+        print("reading %d products "
+              "with %d threads" % (len(self.ccds), self.nthreads))
+        pool=multiprocessing.pool.ThreadPool(self.nthreads)
+        try:
+            pool.map(self._read_and_place, self.ccds[i+1:], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        return self.field, self.bpm
+
+    def write_fits(self, fitsfile):
+        """
+        write the focal plane field, bpm and a table of the ccd
+        placements.  .fz files are tile compressed
+        """
+        fitsfile=os.path.expandvars(fitsfile)
+        fitsfile=os.path.expanduser(fitsfile)
+
+        dir=os.path.dirname(fitsfile)
+        if dir != '' and not os.path.exists(dir):
+            print('making directory:',dir)
+            os.makedirs(dir)
+
+        ckeys={}
+        if fitsfile.endswith('.fz'):
+            ckeys['compress']='rice'
+
+        # written under a temporary name and renamed into place once
+        # complete, as for the eyeball files
+        print("writing:",fitsfile)
+        tmpfile=fitsfile+'.tmp'
+        try:
+            with fitsio.FITS(tmpfile,'rw',clobber=True) as fits:
+                fits.write(self._get_ccd_table(), extname="ccds")
+                fits.write(self.field, extname="field", **ckeys)
+                fits.write(self.bpm, extname="bpm_and_weight", **ckeys)
+        except:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            raise
+
+        os.rename(tmpfile, fitsfile)
+
+    def _read_and_place(self, ccd):
+        res=self._read_checked(ccd)
+        if res is not None:
+            self._place(ccd, *res)
+
+    def _read_checked(self, ccd):
+        """
+        read a product, or report the error and return None; a bad
+        product only loses its own ccd
+        """
+        try:
+            return self._read_product(ccd['filename'])
+        except (IOError, OSError, KeyError, ValueError) as err:
+            print("error reading %s: %s" % (ccd['filename'], err))
+            self.failed.append(ccd['filename'])
+            return None
+
+    def _read_product(self, fname):
+        with fitsio.FITS(fname) as fits:
+            field=fits['field'].read()
+            bpm=fits['bpm_and_weight'].read()
+
+        if self.rebin > 1:
+            field=rebin_image(field, self.rebin)
+            bpm=rebin_bitmask_or(bpm, self.rebin)
+
+        return field, bpm
+
+    def _allocate(self, field, bpm):
+        """
+        allocate the focal plane arrays and set the ccd origins
+        """
+        self.ccd_nrows, self.ccd_ncols = field.shape
+
+        cell_nrows=self.ccd_nrows + self.gap
+        cell_ncols=self.ccd_ncols + self.gap
+
+        ncells=max([len(row) for row in self.layout])
+        nrows=len(self.layout)*cell_nrows - self.gap
+        ncols=ncells*cell_ncols - self.gap
+
+        self.field=numpy.zeros( (nrows, ncols), dtype=field.dtype)
+        self.bpm=numpy.zeros( (nrows, ncols), dtype=bpm.dtype)
+
+        positions=get_ccd_positions(self.layout)
+        for ccd in self.ccds:
+            grid_row, grid_col = positions[ccd['ccdnum']]
+            ccd['row0']=grid_row*cell_nrows
+            ccd['col0']=int(grid_col*cell_ncols)
+
+    def _place(self, ccd, field, bpm):
+        shape=(self.ccd_nrows, self.ccd_ncols)
+        if field.shape != shape or bpm.shape != shape:
+            print("error: unexpected shape %s for %s" % (field.shape,
+                                                         ccd['filename']))
+            self.failed.append(ccd['filename'])
+            return
+
+        row0, col0 = ccd['row0'], ccd['col0']
+        rows=slice(row0, row0+self.ccd_nrows)
+        cols=slice(col0, col0+self.ccd_ncols)
+
+        self.field[rows, cols] = field
+        self.bpm[rows, cols] = bpm
+
+    def _get_ccd_table(self):
+        flen=max([len(c['filename']) for c in self.ccds])
+        dt=[('ccdnum','i2'),
+            ('row0','i4'),
+            ('col0','i4'),
+            ('nrows','i4'),
+            ('ncols','i4'),
+            ('filename','S%d' % flen)]
+
+        data=numpy.zeros(len(self.ccds), dtype=dt)
+        for i,ccd in enumerate(self.ccds):
+            data['ccdnum'][i]=ccd['ccdnum']
+            data['row0'][i]=ccd['row0']
+            data['col0'][i]=ccd['col0']
+            data['filename'][i]=ccd['filename']
+
+        data['nrows']=self.ccd_nrows
+        data['ncols']=self.ccd_ncols
+        return data
+
+    def _get_ccd_list(self, fnames):
+        positions=get_ccd_positions(self.layout)
+
+        ccds=[]
+        for fname in fnames:
+            ccdnum=get_ccdnum_from_filename(fname)
+            if ccdnum not in positions:
+                print("skipping ccd %d not in layout: %s" % (ccdnum,fname))
+                continue
+            ccds.append( {'ccdnum':ccdnum, 'filename':fname} )
+
+        return ccds
+
+def get_ccd_positions(layout=DECAM_LAYOUT):
+    """
+    get the position of each ccd in the focal plane grid
+
+    output
+    ------
+    dict keyed by ccdnum of (grid row, grid column), where the column
+    can be fractional for rows with fewer ccds
+    """
+    ncells=max([len(row) for row in layout])
+
+    positions={}
+    for grid_row, row in enumerate(layout):
+        offset=(ncells-len(row))/2.0
+        for i,ccdnum in enumerate(row):
+            positions[ccdnum]=(grid_row, offset+i)
+
+    return positions
+
+_ccdnum_regex=re.compile(r'_c(\d\d)_')
+
+def get_ccdnum_from_filename(fname):
+    """
+    extract the ccdnum from the _cNN_ part of a file name
+    """
+    m=_ccdnum_regex.search(os.path.basename(fname))
+    if m is None:
+        raise ValueError("could not get ccdnum from file name: %s" % fname)
+    return int(m.group(1))
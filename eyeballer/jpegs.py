@@ -3,6 +3,14 @@ NOMINAL_EXPTIME=90.0
 SCALE=.004
 NONLINEAR=.16
 
+# entries in the asinh lookup table
+LUT_NBIN=4096
+
+# stretch set from the sky statistics, see make_stats_lut
+STATS_NSIGMA_LOW=1.0
+STATS_HIGH=99.9
+STATS_NONLINEAR=3.0
+
 def write_se_jpeg(fname, image, **keys):
     imout = scale_se_image(image, **keys)
     write_jpg(fname, imout, quality=90)
@@ -28,6 +36,99 @@ def scale_se_image(im,
     ims = images.asinh_scale(ims, nonlinear)
     return ims
 
+def make_asinh_lut(exptime=NOMINAL_EXPTIME,
+                   scale=SCALE,
+                   nonlinear=NONLINEAR,
+                   nominal_exptime=NOMINAL_EXPTIME,
+                   nbin=LUT_NBIN):
+    """
+    Make a lookup table for the asinh stretch used by scale_se_image,
+    mapping directly to bytes.  Use with apply_lut.
+
+    The stretch reaches 1, or 255 in bytes, at a finite image value, so
+    the table only needs to cover image values from zero to that point.
+
+    output
+    ------
+    lut, xmax: the uint8 table and the image value at its last entry
+    """
+    from numpy import sinh
+
+    fac = scale*nominal_exptime/exptime
+
+    # arcsinh(xmax*fac*nonlinear)/nonlinear = 1
+    xmax = sinh(nonlinear)/(nonlinear*fac)
+
+    lut = _make_lut(fac, nonlinear, xmax, nbin)
+    return lut, xmax
+
+def make_stats_lut(stats,
+                   nsigma_low=STATS_NSIGMA_LOW,
+                   high=STATS_HIGH,
+                   nonlinear=STATS_NONLINEAR,
+                   nbin=LUT_NBIN):
+    """
+    Make a lookup table for an asinh stretch set from the sky statistics
+    in the metadata of an eyeball file, rather than from the exposure
+    time; see eyeballer.skystats.  Use with apply_lut, sending xmin.
+
+    The stretch starts nsigma_low sky sigma below the sky median and
+    reaches 255 at the high percentile.
+
+    parameters
+    ----------
+    stats: dict
+        From skystats.read_stats
+    nsigma_low: float, optional
+        Default STATS_NSIGMA_LOW
+    high: float, optional
+        Percentile, one of skystats.PERCENTILES, default STATS_HIGH
+    nonlinear: float, optional
+        Larger values compress the bright end more, default
+        STATS_NONLINEAR
+
+    output
+    ------
+    lut, xmin, xmax: the uint8 table and the image values at its first
+    and last entries
+    """
+    from numpy import sinh
+    from .skystats import get_percentile_name
+
+    xmin = stats['sky_median'] - nsigma_low*stats['sky_sigma']
+    xmax = stats[get_percentile_name(high)]
+
+    # at least a few sigma, for images that are all sky
+    xmax = max(xmax, stats['sky_median'] + nsigma_low*stats['sky_sigma'])
+    width = max(xmax - xmin, 1.0e-6)
+    xmax = xmin + width
+
+    fac = sinh(nonlinear)/(nonlinear*width)
+
+    lut = _make_lut(fac, nonlinear, width, nbin)
+    return lut, xmin, xmax
+
+def apply_lut(im, lut, xmax, out=None, xmin=0.0):
+    """
+    Apply a lookup table made with make_asinh_lut or make_stats_lut,
+    giving a uint8 image.  Values below xmin map to the first entry and
+    above xmax to the last.  Values that are not finite map to the first
+    entry.
+    """
+    import numpy
+
+    nbin = lut.size
+    if xmin == 0.0:
+        ind = im*((nbin-1)/xmax)
+    else:
+        ind = im - xmin
+        ind *= (nbin-1)/(xmax-xmin)
+    numpy.copyto(ind, 0, where=~numpy.isfinite(ind))
+    ind = numpy.clip(ind, 0, nbin-1, out=ind)
+    ind = ind.astype('i4')
+
+    return numpy.take(lut, ind, out=out)
+
 def write_jpg(fname, im, **keys):
     """
     image is flipped up-down and transposed so that, in a jpg, north is up and
@@ -50,3 +151,14 @@ def write_jpg(fname, im, **keys):
 
 
 
+
+def _make_lut(fac, nonlinear, width, nbin):
+    """
+    the asinh stretch in bytes at nbin points from 0 to width
+    """
+    from numpy import linspace, arcsinh, clip
+
+    x = linspace(0.0, width, nbin)
+    vals = arcsinh(x*fac*nonlinear)/nonlinear
+
+    return clip(vals*255 + 0.5, 0, 255).astype('u1')
@@ -0,0 +1,241 @@
+"""
+Compose the bpm written to the eyeball file from the input mask and weight
+
+The composition is a set of rules from the run config, applied in one
+pass over blocks of rows, in place, with each block rebinned as soon as it
+is done
+
+    mask_rules:
+        # bits to keep from the input mask; default all
+        keep_bits: null
+        # bits to clear from the input mask
+        drop_bits: []
+        # set a flag where the weight is below a threshold
+        weight:
+            - {below: 0.0001, flag: WEIGHT_FLAG}
+        # set a flag where any of the bits are set
+        derived:
+            - {any: [BADPIX_SUSPECT], flag: WEIGHT_FLAG}
+
+Bits and flags can be integers or names from BIT_NAMES.  The rules are
+applied in the order keep/drop, derived, weight, so derived flags are made
+from the bits that are kept, and flags set by the rules are not dropped.
+
+Without mask_rules, the low_weight value in the config gives a single
+weight rule, and if it is not set the mask is only rebinned.
+"""
+from __future__ import print_function
+import numpy
+
+from .rebin import rebin_bitmask_or, get_rebinned_shape
+
+# rows per block; rounded to a multiple of the rebin factor
+BLOCK_ROWS=256
+
+# lowest weight considered good in the SVY1 processing
+WEIGHT_LOWVAL_SVY1 = 0.0001
+
+# this bit is larger than the current set of flags
+# https://opensource.ncsa.illinois.edu/confluence/display/DESDM/Guide+to+Bad+Pixel+Masks+%28BPMs%29+and+Mask+Bits
+WEIGHT_BIT=15
+WEIGHT_FLAG=2**WEIGHT_BIT
+
+BADPIX_SUSPECT = 2048
+
+BIT_NAMES={
+    'BADPIX_BPM':1,
+    'BADPIX_SATURATE':2,
+    'BADPIX_INTERP':4,
+    'BADPIX_BADAMP':8,
+    'BADPIX_CRAY':16,
+    'BADPIX_STAR':32,
+    'BADPIX_TRAIL':64,
+    'BADPIX_EDGEBLEED':128,
+    'BADPIX_SSXTALK':256,
+    'BADPIX_EDGE':512,
+    'BADPIX_STREAK':1024,
+    'BADPIX_SUSPECT':BADPIX_SUSPECT,
+    'WEIGHT_FLAG':WEIGHT_FLAG,
+}
+
+class MaskRules(object):
+    def __init__(self, keep_bits=None, drop_bits=None, weight=None, derived=None):
+        """
+        parameters
+        ----------
+        keep_bits: integer, name, or list of them, optional
+            Keep only these bits of the input mask, default all
+        drop_bits: integer, name, or list of them, optional
+            Clear these bits of the input mask
+        weight: list of dicts, optional
+            Each with 'below', a weight threshold, and 'flag', set where
+            the weight is below the threshold
+        derived: list of dicts, optional
+            Each with 'any', bits to check, and 'flag', set where any of
+            the bits are set
+        """
+        self.keep=None
+        if keep_bits is not None:
+            self.keep=get_bits(keep_bits)
+
+        self.drop=0
+        if drop_bits is not None:
+            self.drop=get_bits(drop_bits)
+
+        self.weight=[]
+        if weight is not None:
+            for rule in weight:
+                self.weight.append( (float(rule['below']), get_bits(rule['flag'])) )
+
+        self.derived=[]
+        if derived is not None:
+            for rule in derived:
+                self.derived.append( (get_bits(rule['any']), get_bits(rule['flag'])) )
+
+    def needs_weight(self):
+        """
+        True if the rules use the weight map
+        """
+        return len(self.weight) > 0
+
+    def is_empty(self):
+        return (self.keep is None and self.drop==0
+                and len(self.weight)==0 and len(self.derived)==0)
+
+    def apply(self, bpm, wt=None):
+        """
+        apply the rules to the bpm, in place
+
+        parameters
+        ----------
+        bpm: 2-d integer array
+            The mask, modified in place
+        wt: 2-d array, optional
+            The weight map; required if there are weight rules
+        """
+        if self.is_empty():
+            return
+
+        if self.needs_weight() and wt is None:
+            raise ValueError("a weight map is needed for the weight rules")
+
+        dtype=bpm.dtype
+
+        andmask=self.keep
+        if self.drop != 0:
+            if andmask is None:
+                andmask=-1
+            andmask=andmask & ~self.drop
+
+        if andmask is not None:
+            numpy.bitwise_and(bpm, _as_dtype(andmask, dtype), out=bpm)
+
+        for bits, flag in self.derived:
+            hit=numpy.bitwise_and(bpm, _as_dtype(bits, dtype)) != 0
+            numpy.bitwise_or(bpm, _as_dtype(flag, dtype), out=bpm, where=hit)
+
+        for below, flag in self.weight:
+            numpy.bitwise_or(bpm, _as_dtype(flag, dtype), out=bpm, where=wt < below)
+
+    def __repr__(self):
+        return ('MaskRules(keep=%s, drop=%s, weight=%s, '
+                'derived=%s)' % (self.keep, self.drop, self.weight, self.derived))
+
+def get_mask_rules(conf):
+    """
+    get the MaskRules for a run config.  mask_rules is used if present,
+    otherwise low_weight gives a weight rule setting WEIGHT_FLAG.  For
+    low_weight: true, the threshold is WEIGHT_LOWVAL_SVY1
+    """
+    rules=conf.get('mask_rules',None)
+    if rules is not None:
+        return MaskRules(**rules)
+
+    low_weight=conf.get('low_weight',None)
+    if low_weight is None or low_weight is False:
+        return MaskRules()
+
+    if low_weight is True:
+        low_weight=WEIGHT_LOWVAL_SVY1
+
+    return MaskRules(weight=[{'below':low_weight, 'flag':WEIGHT_FLAG}])
+
+def compose_and_rebin(bpm, wt, rules, rebin, block_rows=BLOCK_ROWS, out=None):
+    """
+    apply the rules and OR-rebin, one block of rows at a time.  The bpm
+    is modified in place; only the rebinned mask is allocated.  Partial
+    blocks at the edges are cropped, as in rebin_bitmask_or
+
+    parameters
+    ----------
+    bpm: 2-d integer array
+        The mask, modified in place
+    wt: 2-d array or None
+        The weight map, needed for weight rules
+    rules: MaskRules
+    rebin: integer
+        The rebin factor; 1 means only the rules are applied
+    block_rows: integer, optional
+        Rows per block, default BLOCK_ROWS
+    out: 2-d array, optional
+        Where to put the rebinned mask
+
+    output
+    ------
+    the rebinned mask, or the bpm itself for rebin 1
+    """
+    rebin=max(int(rebin),1)
+    block_rows=max(rebin, (int(block_rows)//rebin)*rebin)
+
+    if rules.needs_weight() and wt is None:
+        raise ValueError("a weight map is needed for the weight rules")
+
+    if rebin==1:
+        out=bpm
+    elif out is None:
+        out=numpy.zeros(get_rebinned_shape(bpm.shape, rebin), dtype=bpm.dtype)
+
+    # rows past the last full block of the rebin are cropped from the
+    # output, but the rules are still applied so all of the bpm is done
+    nrows_out=out.shape[0]*rebin
+    for row_start in range(0, bpm.shape[0], block_rows):
+        row_end=min(row_start+block_rows, bpm.shape[0])
+
+        block=bpm[row_start:row_end, :]
+        wblock=None
+        if wt is not None:
+            wblock=wt[row_start:row_end, :]
+
+        rules.apply(block, wblock)
+
+        if rebin > 1 and row_start < nrows_out:
+            rend=min(row_end, nrows_out)
+            out[row_start//rebin:rend//rebin, :] = \
+                    rebin_bitmask_or(block[:rend-row_start, :], rebin)
+
+    return out
+
+def get_bits(bits):
+    """
+    convert a bit, name, or list of them to an integer mask
+    """
+    if isinstance(bits, (list, tuple)):
+        mask=0
+        for b in bits:
+            mask |= get_bits(b)
+        return mask
+
+    if isinstance(bits, str):
+        if bits not in BIT_NAMES:
+            raise ValueError("unknown bit name '%s', "
+                             "should be one of %s" % (bits, sorted(BIT_NAMES)))
+        return BIT_NAMES[bits]
+
+    return int(bits)
+
+def _as_dtype(val, dtype):
+    """
+    the value with the bit pattern it has in the dtype, so e.g. bit 15
+    can be set in an int16 mask
+    """
+    return numpy.array(val, dtype='i8').astype(dtype)
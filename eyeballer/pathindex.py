@@ -0,0 +1,202 @@
+"""
+An on-disk index of the output file paths for a run
+
+The index is built once from the metalist, which is the only time
+desdb is used to construct file names.  It is stored as a numpy
+structured array sorted by a key made from reqnum, expnum, attnum and
+ccdnum, so lookups for many ccds at once are a single searchsorted.
+
+    index=load_path_index(run)
+    paths=index.get_paths(reqnum, expnum, attnum, ccdnum)
+"""
+from __future__ import print_function
+import os
+import numpy
+
+from . import files
+
+# string fields given with no size get the size in the metalist
+PATH_INDEX_DTYPE=[
+    ('key','i8'),
+    ('project','S'),
+    ('mystery_path','S'),
+    ('reqnum','i4'),
+    ('expnum','i4'),
+    ('attnum','i2'),
+    ('ccdnum','i2'),
+    ('band','S'),
+]
+
+class PathIndex(object):
+    def __init__(self, data):
+        """
+        parameters
+        ----------
+        data: structured array
+            The index data, with the fields in PATH_INDEX_DTYPE
+            plus output_file, sorted by key
+        """
+        self.data=data
+
+    def __len__(self):
+        return self.data.size
+
+    def get_paths(self, reqnum, expnum, attnum, ccdnum):
+        """
+        get the output paths for many ccds at once
+
+        parameters
+        ----------
+        reqnum, expnum, attnum, ccdnum: scalars or arrays
+
+        output
+        ------
+        array of paths; entries not in the index are empty
+        """
+        ind = self.get_indices(reqnum, expnum, attnum, ccdnum)
+
+        paths=numpy.zeros(ind.size, dtype=self.data['output_file'].dtype)
+        w,=numpy.where(ind >= 0)
+        paths[w] = self.data['output_file'][ind[w]]
+        return paths
+
+    def get_indices(self, reqnum, expnum, attnum, ccdnum):
+        """
+        get the index into data for each entry, -1 for entries
+        not in the index
+        """
+        keys=make_key(reqnum, expnum, attnum, ccdnum)
+        keys=numpy.atleast_1d(keys)
+
+        datakeys=self.data['key']
+        ind=numpy.searchsorted(datakeys, keys)
+        ind.clip(0, max(datakeys.size-1,0), out=ind)
+
+        found = (datakeys.size > 0) & (datakeys[ind]==keys)
+        ind[~found] = -1
+        return ind
+
+    def select(self, **keys):
+        """
+        get the rows matching all of the sent fields, e.g.
+        select(expnum=229686, band='r')
+        """
+        return files.select_rows(self.data, **keys)
+
+    def write(self, fname):
+        """
+        write the index to a .npy file
+        """
+        dir=os.path.dirname(fname)
+        if not os.path.exists(dir):
+            print("making dir:",dir)
+            os.makedirs(dir)
+
+        print("writing path index:",fname)
+        numpy.save(fname, self.data)
+
+def make_key(reqnum, expnum, attnum, ccdnum):
+    """
+    combine the ids into a single integer key
+    """
+    reqnum=numpy.asarray(reqnum, dtype='i8')
+    expnum=numpy.asarray(expnum, dtype='i8')
+    attnum=numpy.asarray(attnum, dtype='i8')
+    ccdnum=numpy.asarray(ccdnum, dtype='i8')
+
+    return ((reqnum*100000000 + expnum)*100 + attnum)*100 + ccdnum
+
+def build_path_index(run, metalist=None):
+    """
+    build the index from the metalist for the run, using desdb to
+    get the file names; see make_path_index
+
+    parameters
+    ----------
+    run: string
+        the run identifier
+    metalist: string, optional
+        The metalist to read, default is the one in the run config
+    """
+    import desdb
+
+    if metalist is None:
+        conf=files.read_config(run)
+        metalist=conf['metalist']
+
+    meta=files.read_metalist(metalist)
+
+    df=desdb.files.DESFiles(version='v2beta')
+
+    paths=[files.get_output_file(run, df=df, **c) for c in files.to_dicts(meta)]
+
+    return make_path_index(meta, paths)
+
+def make_path_index(meta, paths):
+    """
+    make the index from the metalist and the output path of each row
+
+    parameters
+    ----------
+    meta: structured array
+        The metalist, as read by files.read_metalist
+    paths: sequence of strings
+        The output file for each row
+    """
+    paths=numpy.asarray(paths, dtype='S')
+
+    dt=[]
+    for name, typ in PATH_INDEX_DTYPE:
+        if typ=='S':
+            typ=meta.dtype[name].str[1:]
+        dt.append( (name,typ) )
+    dt.append( ('output_file',paths.dtype.str[1:]) )
+
+    data=numpy.zeros(meta.size, dtype=dt)
+    for name in meta.dtype.names:
+        data[name]=meta[name]
+    data['output_file']=paths
+
+    data['key']=make_key(data['reqnum'], data['expnum'],
+                         data['attnum'], data['ccdnum'])
+
+    s=data['key'].argsort(kind='mergesort')
+    data=data[s]
+
+    return PathIndex(data)
+
+def read_path_index(fname):
+    """
+    read an index written with PathIndex.write
+    """
+    data=numpy.load(fname)
+    return PathIndex(data)
+
+def load_path_index(run, rebuild=False):
+    """
+    read the path index for the run, building and writing it if it
+    does not exist or is older than the metalist
+
+    parameters
+    ----------
+    run: string
+        the run identifier
+    rebuild: bool, optional
+        If True, always rebuild
+    """
+    fname=files.get_path_index_file(run)
+
+    if not rebuild and os.path.exists(fname):
+        conf=files.read_config(run)
+        metalist=conf.get('metalist',None)
+
+        if (metalist is None
+                or os.path.getmtime(fname) >= os.path.getmtime(metalist)):
+            print("reading path index:",fname)
+            return read_path_index(fname)
+
+        print("path index is older than the metalist, rebuilding")
+
+    index=build_path_index(run)
+    index.write(fname)
+    return index
@@ -0,0 +1,333 @@
+"""
+Process many ccds in one process with the stages overlapped
+
+Three threads run at the same time: the reader loads and decompresses the
+inputs of the next ccd, the reducer makes the field and bpm of the current
+one, and the writer compresses and writes the previous one.  The threads
+are joined by queues of at most queue_depth ccds, so no more than
+2*queue_depth+3 ccds are held in memory at once
+
+    results, stats = run_pipeline(conf, items, queue_depth=2)
+    print_stats(stats)
+
+The results are in the same form as those from batch.run_batch.  With a
+store_dir, the writer appends records to a store shard instead of writing
+files; see eyeballer.store.
+
+fitsio releases the GIL around its cfitsio calls when cfitsio is built
+reentrant, see fitsio.cfitsio_is_reentrant, so reading, writing and the
+numpy work in the reducer can all run at once.  With a cfitsio that is
+not reentrant, reading and writing hold the GIL and take turns, and only
+the reducer overlaps them.  The per-stage statistics show which stage limits the throughput:
+the slowest stage is busy all the time while the others wait on it.  The
+busy time includes time spent waiting for the GIL or a free cpu, so on a
+single cpu the stages appear slower than when run one after another.
+"""
+from __future__ import print_function
+import time
+import threading
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .cutouts import EyeballMaker
+from . import provenance
+from . import store
+from .batch import STATUS_OK, STATUS_SKIPPED, STATUS_FAILED, get_store_todo
+
+# ccds waiting between stages
+DEFAULT_QUEUE_DEPTH=2
+
+PIPELINE_STAGES=['read','reduce','write']
+
+class StageStats(object):
+    def __init__(self, name):
+        """
+        counts and times for one stage of the pipeline
+
+        busy is the time spent working, wait_in the time spent waiting
+        for the previous stage and wait_out the time spent waiting for
+        room in the queue to the next stage
+        """
+        self.name=name
+        self.count=0
+        self.busy=0.0
+        self.wait_in=0.0
+        self.wait_out=0.0
+
+    def get_rate(self):
+        """
+        ccds per second of busy time
+        """
+        if self.busy <= 0:
+            return 0.0
+        return self.count/self.busy
+
+    def asdict(self):
+        return {'name':self.name,
+                'count':self.count,
+                'busy':self.busy,
+                'wait_in':self.wait_in,
+                'wait_out':self.wait_out,
+                'rate':self.get_rate()}
+
+def run_pipeline(conf, items, queue_depth=DEFAULT_QUEUE_DEPTH, clobber=False,
+                 store_dir=None):
+    """
+    process all items with reading, reduction and writing overlapped
+
+    parameters
+    ----------
+    conf: dict
+        The run configuration
+    items: list of dicts
+        Each has image_file, bkg_file and output_file, e.g. as
+        returned by batch.read_manifest
+    queue_depth: integer, optional
+        Maximum ccds waiting between stages, default DEFAULT_QUEUE_DEPTH
+    clobber: bool, optional
+        If True, outputs are remade even if they are up to date
+    store_dir: string, optional
+        Write records to the store in this directory rather than
+        writing the output files
+
+    output
+    ------
+    results, stats.  The results are a list of dicts with output_file,
+    status, time and message, in the order of the items, except that
+    records found up to date in a store come first.  The stats are
+    a list of dicts, one per stage, with name, count, busy, wait_in,
+    wait_out and rate, plus one for the total with the wall time
+    """
+    queue_depth=max(int(queue_depth),1)
+
+    writer=None
+    skipped=[]
+    if store_dir is not None:
+        items, skipped = get_store_todo(conf, items, store_dir, clobber)
+        clobber=True
+        writer=store.get_writer(store_dir, conf)
+
+    to_reduce=queue.Queue(maxsize=queue_depth)
+    to_write=queue.Queue(maxsize=queue_depth)
+    abort=_Abort()
+
+    stats=dict([(name, StageStats(name)) for name in PIPELINE_STAGES])
+    results=[]
+
+    threads=[
+        threading.Thread(target=_read_stage,
+                         args=(conf, items, clobber, store_dir,
+                               to_reduce, stats['read'], abort)),
+        threading.Thread(target=_reduce_stage,
+                         args=(to_reduce, to_write, stats['reduce'], abort)),
+        threading.Thread(target=_write_stage,
+                         args=(to_write, results, writer, stats['write'], abort)),
+    ]
+
+    tm0=time.time()
+    for thread in threads:
+        thread.daemon=True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall=time.time()-tm0
+
+    if writer is not None:
+        writer.close()
+
+    if abort.error is not None:
+        raise abort.error
+
+    results = skipped + results
+
+    stats=[stats[name].asdict() for name in PIPELINE_STAGES]
+
+    nproc=sum([1 for r in results if r['status'] != STATUS_SKIPPED])
+    stats.append({'name':'total',
+                  'count':nproc,
+                  'busy':wall,
+                  'wait_in':0.0,
+                  'wait_out':0.0,
+                  'rate':nproc/wall if wall > 0 else 0.0})
+
+    return results, stats
+
+def print_stats(stats):
+    """
+    print the per-stage statistics from run_pipeline
+    """
+    print('%-8s %6s %10s %10s %10s %10s' % ('stage','count','busy(s)',
+                                            'wait_in(s)','wait_out(s)',
+                                            'ccd/s'))
+    for s in stats:
+        print('%(name)-8s %(count)6d %(busy)10.3f %(wait_in)10.3f '
+              '%(wait_out)10.3f %(rate)10.3f' % s)
+
+class _Abort(object):
+    """
+    set when a stage fails other than in processing a ccd, which is
+    recorded in the ccd's result.  The other stages then stop working,
+    and run_pipeline raises the error once the threads are done
+    """
+    def __init__(self):
+        self.error=None
+
+    def set(self, err):
+        traceback.print_exc()
+        if self.error is None:
+            self.error=err
+
+    def is_set(self):
+        return self.error is not None
+
+class _Job(object):
+    """
+    one item as it passes through the pipeline
+    """
+    def __init__(self, item):
+        self.item=item
+        self.key=None
+        self.maker=None
+        self.prepared=None
+        self.result={'output_file':item['output_file'],
+                     'status':STATUS_OK,
+                     'time':0.0,
+                     'message':''}
+
+    def is_active(self):
+        return self.result['status']==STATUS_OK
+
+    def fail(self, err):
+        traceback.print_exc()
+        self.result['status']=STATUS_FAILED
+        self.result['message']=str(err).replace('\n',' ')
+        self.maker=None
+        self.prepared=None
+
+def _put(q, job, stats):
+    tm0=time.time()
+    q.put(job)
+    stats.wait_out += time.time()-tm0
+
+def _get(q, stats):
+    tm0=time.time()
+    job=q.get()
+    stats.wait_in += time.time()-tm0
+    return job
+
+def _drain(q):
+    """
+    take jobs until the end marker, so the stage putting them is never
+    blocked on a full queue
+    """
+    while q.get() is not None:
+        pass
+
+def _read_stage(conf, items, clobber, store_dir, to_reduce, stats, abort):
+    try:
+        for item in items:
+            if abort.is_set():
+                break
+
+            job=_Job(item)
+            output_file=item['output_file']
+
+            tm0=time.time()
+            try:
+                if store_dir is not None:
+                    job.key=store.get_key(item)
+                elif '.fz' not in output_file:
+                    raise ValueError("expected .fz fits file name")
+
+                reason=provenance.REASON_MISSING
+                if not clobber:
+                    reason, record = provenance.check_output(output_file,
+                                                             item['image_file'],
+                                                             item['bkg_file'],
+                                                             conf)
+                if reason is None:
+                    print("file is up to date, skipping:",output_file)
+                    job.result['status']=STATUS_SKIPPED
+                else:
+                    if reason != provenance.REASON_MISSING:
+                        print("remaking %s file: %s" % (reason, output_file))
+
+                    job.maker=EyeballMaker(conf,
+                                           item['image_file'],
+                                           item['bkg_file'])
+                    stats.count += 1
+            except Exception as err:
+                job.fail(err)
+
+            dt=time.time()-tm0
+            job.result['time'] += dt
+            stats.busy += dt
+
+            _put(to_reduce, job, stats)
+    except BaseException as err:
+        abort.set(err)
+    finally:
+        to_reduce.put(None)
+
+def _reduce_stage(to_reduce, to_write, stats, abort):
+    try:
+        while True:
+            job=_get(to_reduce, stats)
+            if job is None:
+                break
+
+            if job.is_active() and not abort.is_set():
+                tm0=time.time()
+                try:
+                    job.prepared=job.maker.prepare()
+                    # the full resolution data are not needed to write
+                    job.maker.free_data()
+                    stats.count += 1
+                except Exception as err:
+                    job.fail(err)
+
+                dt=time.time()-tm0
+                job.result['time'] += dt
+                stats.busy += dt
+
+            _put(to_write, job, stats)
+    except BaseException as err:
+        abort.set(err)
+        _drain(to_reduce)
+    finally:
+        to_write.put(None)
+
+def _write_stage(to_write, results, writer, stats, abort):
+    try:
+        while True:
+            job=_get(to_write, stats)
+            if job is None:
+                break
+
+            if job.is_active() and not abort.is_set():
+                tm0=time.time()
+                try:
+                    if writer is not None:
+                        expnum, ccdnum = job.key
+                        job.maker.write_store(writer, expnum, ccdnum, job.prepared)
+                    else:
+                        job.maker.write_prepared(job.item['output_file'],
+                                                 job.prepared)
+                    stats.count += 1
+                except Exception as err:
+                    job.fail(err)
+
+                dt=time.time()-tm0
+                job.result['time'] += dt
+                stats.busy += dt
+
+            job.maker=None
+            job.prepared=None
+            results.append(job.result)
+    except BaseException as err:
+        abort.set(err)
+        _drain(to_write)
@@ -0,0 +1,206 @@
+"""
+Render jpeg or png previews from existing eyeball files
+
+The field in the eyeball file is already rebinned and oriented, so a
+preview only needs the stretch, which is done with a lookup table
+rather than per-pixel asinh.  Previews that are newer than their
+eyeball file are skipped.
+
+With overlay=True the bpm is drawn over the field in color, and with
+factor > 1 the preview is enlarged; see eyeballer.render.  Each worker
+renders into one buffer, reused for all its previews of the same size.
+
+With auto_scale=True the stretch of each preview is set from the sky
+statistics in the metadata of its eyeball file, see jpegs.make_stats_lut,
+rather than from the nominal exposure time.  These previews are named
+-auto.jpg or -auto.png, so they are made alongside the nominal ones
+rather than skipped as up to date.  Files made before the statistics were
+recorded get the nominal stretch.
+"""
+from __future__ import print_function
+import os
+import traceback
+
+from . import jpegs
+from . import render
+from . import skystats
+
+PREVIEW_TYPES=['jpg','png']
+
+# set in each worker by _init_worker
+_worker_renderer=None
+
+def get_preview_file(eyeball_file, type='jpg', overlay=False, auto_scale=False):
+    """
+    the preview file name for an eyeball file
+
+    parameters
+    ----------
+    eyeball_file: string
+        The -eyeball.fits.fz file
+    type: string, optional
+        jpg or png, default jpg
+    overlay: bool, optional
+        If True, the name for a preview with the bpm overlay, which
+        ends in -overlay.jpg or -overlay.png
+    auto_scale: bool, optional
+        If True, the name for a preview stretched from the sky
+        statistics, which ends in -auto.jpg or -auto-overlay.jpg etc.
+    """
+    if type not in PREVIEW_TYPES:
+        raise ValueError("preview type should be one of %s, "
+                         "got '%s'" % (PREVIEW_TYPES, type))
+
+    ext='.'+type
+    if overlay:
+        ext='-overlay'+ext
+    if auto_scale:
+        ext='-auto'+ext
+
+    fname=eyeball_file.replace('.fits.fz','.fits').replace('.fits',ext)
+    if fname==eyeball_file:
+        raise ValueError("expected a .fits or .fits.fz file: %s" % eyeball_file)
+    return fname
+
+def is_up_to_date(eyeball_file, preview_file):
+    """
+    True if the preview exists and is not older than the eyeball file
+    """
+    if not os.path.exists(preview_file):
+        return False
+
+    return os.path.getmtime(preview_file) >= os.path.getmtime(eyeball_file)
+
+def render_preview(eyeball_file, preview_file, lut=None, xmax=None, quality=90,
+                   renderer=None, auto_scale=False):
+    """
+    render a preview of the field in an eyeball file
+
+    parameters
+    ----------
+    eyeball_file: string
+        The -eyeball.fits.fz file
+    preview_file: string
+        The jpg or png to write
+    lut, xmax: optional
+        A lookup table from jpegs.make_asinh_lut; by default one
+        is made with the nominal scaling
+    quality: integer, optional
+        jpeg quality, default 90
+    renderer: render.OverlayRenderer, optional
+        Used for an overlay or enlarged preview; its lookup table is
+        replaced by lut
+    auto_scale: bool, optional
+        If True, make the lookup table from the sky statistics in the
+        metadata, when present
+    """
+    import images
+    from .products import EyeballProduct
+
+    if lut is None:
+        lut, xmax = jpegs.make_asinh_lut()
+    xmin=0.0
+
+    with EyeballProduct(eyeball_file) as product:
+        if auto_scale:
+            stats=skystats.read_stats(product.read_meta())
+            if stats is not None:
+                lut, xmin, xmax = jpegs.make_stats_lut(stats)
+
+        if renderer is not None:
+            renderer.set_lut(lut, xmax, xmin=xmin)
+            imout=renderer.render_product(product)
+        else:
+            field=product.read_field()
+            imout=jpegs.apply_lut(field, lut, xmax, xmin=xmin)
+
+    keys={}
+    if preview_file.endswith('.jpg'):
+        keys['quality']=quality
+
+    images.write_image(preview_file, imout, **keys)
+
+def render_previews(eyeball_files, type='jpg', nproc=1, clobber=False,
+                    overlay=False, factor=1, auto_scale=False, **keys):
+    """
+    render previews for many eyeball files, in parallel
+
+    parameters
+    ----------
+    eyeball_files: list of strings
+        The eyeball files
+    type: string, optional
+        jpg or png, default jpg
+    nproc: integer, optional
+        Number of processes, default 1
+    clobber: bool, optional
+        If True, remake previews even if they are up to date
+    overlay: bool, optional
+        If True, draw the bpm over the field in color, default False
+    factor: integer, optional
+        Enlarge the previews by this factor, default 1
+    auto_scale: bool, optional
+        If True, set the stretch of each preview from the sky statistics
+        in its metadata, default False
+    **keys:
+        exptime, scale, nonlinear for jpegs.make_asinh_lut
+
+    output
+    ------
+    number rendered, number skipped, number failed
+    """
+    lut, xmax = jpegs.make_asinh_lut(**keys)
+
+    renderer=None
+    if overlay or int(factor) > 1:
+        rules=render.DEFAULT_OVERLAY if overlay else None
+        renderer=render.OverlayRenderer(overlay=rules,
+                                        factor=factor,
+                                        lut=lut,
+                                        xmax=xmax)
+
+    args=[]
+    nskip=0
+    for fname in eyeball_files:
+        preview_file=get_preview_file(fname, type=type, overlay=overlay,
+                                      auto_scale=auto_scale)
+        if not clobber and is_up_to_date(fname, preview_file):
+            nskip += 1
+            continue
+        args.append( (fname, preview_file, lut, xmax, auto_scale) )
+
+    print("rendering %d previews, %d up to date" % (len(args), nskip))
+
+    nproc=int(nproc)
+    if nproc <= 1:
+        _init_worker(renderer)
+        results=[_render_one(arg) for arg in args]
+    else:
+        import multiprocessing
+        pool=multiprocessing.Pool(processes=nproc,
+                                  initializer=_init_worker,
+                                  initargs=(renderer,))
+        try:
+            results=pool.map(_render_one, args, chunksize=16)
+        finally:
+            pool.close()
+            pool.join()
+
+    nfail=results.count(False)
+    return len(args)-nfail, nskip, nfail
+
+def _init_worker(renderer):
+    global _worker_renderer
+    _worker_renderer=renderer
+
+def _render_one(arg):
+    eyeball_file, preview_file, lut, xmax, auto_scale = arg
+    try:
+        render_preview(eyeball_file, preview_file, lut=lut, xmax=xmax,
+                       renderer=_worker_renderer, auto_scale=auto_scale)
+    except Exception:
+        print("error rendering:",eyeball_file)
+        traceback.print_exc()
+        return False
+
+    return True
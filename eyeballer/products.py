@@ -0,0 +1,278 @@
+"""
+Read eyeball products
+
+EyeballProduct opens its file only when data are first requested, and
+reads only what is asked for: the metadata, or a sub-region of the
+field or bpm.  Uncompressed products are memory mapped.
+
+    with EyeballProduct(fname) as prod:
+        meta=prod.read_meta()
+        sub=prod.read_field(rows=slice(100,200), cols=slice(0,50))
+
+Products written with a pyramid also hold the field and bpm at other
+rebin levels; get_levels lists them and read_level reads one.
+
+iter_products walks many products, keeping at most max_open files open.
+"""
+from __future__ import print_function
+import os
+from collections import deque
+
+import numpy
+
+EXTNAMES=['metadata','field','bpm_and_weight']
+
+DEFAULT_MAX_OPEN=16
+
+_bitpix_types={
+    8:'u1',
+    16:'>i2',
+    32:'>i4',
+    64:'>i8',
+    -32:'>f4',
+    -64:'>f8',
+}
+
+class EyeballProduct(object):
+    def __init__(self, fname, mmap=True):
+        """
+        parameters
+        ----------
+        fname: string
+            The eyeball file
+        mmap: bool, optional
+            If True, memory map images in uncompressed files rather
+            than reading them.  Default True
+        """
+        self.filename=os.path.expanduser(os.path.expandvars(fname))
+        self.mmap=mmap
+
+        self._fits=None
+        self._meta=None
+        self._levels=None
+        self._maps={}
+
+    @property
+    def fits(self):
+        """
+        the fitsio.FITS object, opened on first use
+        """
+        if self._fits is None:
+            import fitsio
+            self._fits=fitsio.FITS(self.filename)
+        return self._fits
+
+    def is_open(self):
+        return self._fits is not None
+
+    def close(self):
+        """
+        close the file; it is reopened if more data are requested
+        """
+        if self._fits is not None:
+            self._fits.close()
+            self._fits=None
+        self._maps={}
+
+    def read_meta(self):
+        """
+        read the metadata table; the result is cached
+        """
+        if self._meta is None:
+            self._meta=self.fits['metadata'].read()
+        return self._meta
+
+    def read_field(self, rows=None, cols=None):
+        """
+        read the field image or a sub-region of it
+
+        parameters
+        ----------
+        rows, cols: slices, optional
+            The region to read, default all
+        """
+        return self.read_image('field', rows=rows, cols=cols)
+
+    def read_bpm(self, rows=None, cols=None):
+        """
+        read the bpm_and_weight image or a sub-region of it
+
+        parameters
+        ----------
+        rows, cols: slices, optional
+            The region to read, default all
+        """
+        return self.read_image('bpm_and_weight', rows=rows, cols=cols)
+
+    def read_image(self, ext, rows=None, cols=None):
+        """
+        read an image extension or a sub-region of it.  For memory
+        mapped images a view into the map is returned
+
+        parameters
+        ----------
+        ext: string or integer
+            The extension
+        rows, cols: slices, optional
+            The region to read, default all
+        """
+        if rows is None:
+            rows=slice(None)
+        if cols is None:
+            cols=slice(None)
+
+        if self.mmap:
+            mm=self._get_map(ext)
+            if mm is not None:
+                return mm[rows, cols]
+
+        hdu=self.fits[ext]
+        if rows==slice(None) and cols==slice(None):
+            return hdu.read()
+
+        nrows, ncols = hdu.get_dims()
+        rows=_check_slice(rows, nrows)
+        cols=_check_slice(cols, ncols)
+        return hdu[rows, cols]
+
+    def get_levels(self):
+        """
+        the rebin levels in the file, including the main field, sorted.
+        Levels are taken from the REBIN header keyword
+        """
+        if self._levels is None:
+            levels={}
+            for hdu in self.fits[1:]:
+                extname=hdu.get_extname()
+                if extname != 'field' and not extname.startswith('field_'):
+                    continue
+
+                # older products have no REBIN keyword for the field
+                level=hdu.read_header().get('REBIN',None)
+                if level is not None:
+                    levels[int(level)]=extname
+            self._levels=levels
+
+        return sorted(self._levels.keys())
+
+    def read_level(self, level, bpm=False, rows=None, cols=None):
+        """
+        read the field, or the bpm, at the requested rebin level
+
+        parameters
+        ----------
+        level: integer
+            The rebin level, one of get_levels()
+        bpm: bool, optional
+            If True read the bpm_and_weight rather than the field
+        rows, cols: slices, optional
+            The region to read, default all
+        """
+        levels=self.get_levels()
+        level=int(level)
+        if level not in levels:
+            raise ValueError("level %d not in file, have %s" % (level,levels))
+
+        ext=self._levels[level]
+        if bpm:
+            ext=ext.replace('field','bpm_and_weight')
+
+        return self.read_image(ext, rows=rows, cols=cols)
+
+    def get_dims(self, ext='field'):
+        """
+        get the dimensions of an image extension without reading it
+        """
+        return self.fits[ext].get_dims()
+
+    def _get_map(self, ext):
+        """
+        get a memory map of an uncompressed image, or None if it
+        can't be mapped
+        """
+        if ext in self._maps:
+            return self._maps[ext]
+
+        hdu=self.fits[ext]
+        mm=None
+        if not hdu.is_compressed():
+            hdr=hdu.read_header()
+            bitpix=hdr['BITPIX']
+            scaled = (hdr.get('BZERO',0) != 0 or hdr.get('BSCALE',1) != 1)
+
+            if bitpix in _bitpix_types and not scaled:
+                dims=tuple(hdu.get_dims())
+                mm=numpy.memmap(self.filename,
+                                dtype=_bitpix_types[bitpix],
+                                mode='r',
+                                offset=_get_data_start(hdu),
+                                shape=dims)
+
+        self._maps[ext]=mm
+        return mm
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __repr__(self):
+        return 'EyeballProduct(%r)' % self.filename
+
+def iter_products(fnames, max_open=DEFAULT_MAX_OPEN, mmap=True):
+    """
+    iterate over products, keeping at most max_open files open at once.
+    The oldest products are closed first; they reopen if used again
+
+    parameters
+    ----------
+    fnames: sequence of strings
+        The eyeball files
+    max_open: integer, optional
+        Maximum number of open files, default DEFAULT_MAX_OPEN
+    mmap: bool, optional
+        Memory map uncompressed images, default True
+    """
+    max_open=max(int(max_open),1)
+
+    opened=deque()
+    try:
+        for fname in fnames:
+
+            # leave room for the next one to be opened
+            nopen=sum([p.is_open() for p in opened])
+            while nopen >= max_open:
+                p=opened.popleft()
+                if p.is_open():
+                    p.close()
+                    nopen -= 1
+
+            while len(opened) > 0 and not opened[0].is_open():
+                opened.popleft()
+
+            prod=EyeballProduct(fname, mmap=mmap)
+            opened.append(prod)
+            yield prod
+    finally:
+        for prod in opened:
+            prod.close()
+
+def _get_data_start(hdu):
+    """
+    byte offset of the data; older fitsio returns a tuple
+    """
+    offsets=hdu.get_offsets()
+    if isinstance(offsets, dict):
+        return offsets['data_start']
+    else:
+        return offsets[1]
+
+def _check_slice(s, n):
+    """
+    fitsio needs explicit slice bounds with unit step
+    """
+    start, stop, step = s.indices(n)
+    if step != 1:
+        raise ValueError("only unit step slices are supported")
+    return slice(start, stop)
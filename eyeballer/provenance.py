@@ -0,0 +1,398 @@
+"""
+Record what each eyeball file was made from, and find stale outputs
+
+EyeballMaker writes provenance keywords into the metadata header: the
+size, mtime and DATASUM of the image and background inputs, a hash of
+the config keys that affect the output, and the code version.  Every HDU
+gets CHECKSUM and DATASUM keywords, written last, so an interrupted write
+is detected from the headers alone.
+
+An output is stale if it is missing, incomplete, was made from inputs
+that have since changed, or was made with a different config or code
+version.  Checking an output reads only its headers; the results are kept
+in a per-run manifest keyed by output file, and outputs whose size and
+mtime have not changed are not read again
+
+    stale=find_stale(run, items, conf)
+    for output_file, reason in stale.items():
+        ...
+"""
+from __future__ import print_function
+import os
+import json
+import hashlib
+
+from . import files
+
+# config keys that change the content of the output
+PROCESSING_KEYS=['rebin','low_weight','mask_rules',
+                 'compress','qlevel','tile_dims','pyramid',
+                 'image_ext','bpm_ext','wt_ext','bkg_ext']
+
+# extensions every output must have
+REQUIRED_EXTNAMES=['metadata','field','bpm_and_weight']
+
+# seconds; mtimes closer than this are considered equal
+MTIME_TOL=1.0e-3
+
+REASON_MISSING='missing'
+REASON_CORRUPT='corrupt'
+REASON_INPUT='input-changed'
+REASON_CONFIG='config-changed'
+REASON_CODE='code-changed'
+
+# header keywords, at most 8 characters
+_input_keys={
+    'image':('IMSIZE','IMMTIME','IMDSUM'),
+    'bkg':('BKSIZE','BKMTIME','BKDSUM'),
+}
+
+def get_code_version():
+    """
+    the version recorded in the outputs; bump the package version when
+    the output changes
+    """
+    from . import __version__
+    return __version__
+
+def get_config_hash(conf):
+    """
+    hash of the config keys in PROCESSING_KEYS
+    """
+    sub=dict([(key, conf.get(key,None)) for key in PROCESSING_KEYS])
+    text=json.dumps(sub, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+def get_input_identity(fname, ext=None):
+    """
+    size, mtime and DATASUM of an input file.  The DATASUM is read from
+    the header of ext, without reading the data, and is None if the
+    file has no checksum keywords
+
+    output
+    ------
+    dict with size, mtime and datasum
+    """
+    st=os.stat(fname)
+
+    datasum=None
+    if ext is not None:
+        import fitsio
+        try:
+            hdr=fitsio.read_header(fname, ext=ext)
+            datasum=hdr.get('DATASUM',None)
+        except (IOError, OSError, ValueError):
+            datasum=None
+
+    if datasum is not None:
+        datasum=str(datasum).strip()
+
+    return {'size':st.st_size, 'mtime':st.st_mtime, 'datasum':datasum}
+
+def get_provenance_keys(conf, image_file, bkg_file):
+    """
+    keywords to write in the metadata header of an output
+
+    output
+    ------
+    list of dicts with name, value and comment, for fitsio write_keys
+    """
+    keys=[
+        {'name':'EYEVERS', 'value':get_code_version(),
+         'comment':'eyeballer version'},
+        {'name':'CONFHASH', 'value':get_config_hash(conf),
+         'comment':'hash of the processing config'},
+    ]
+
+    for which, fname, ext in [('image', image_file, conf.get('image_ext','sci')),
+                              ('bkg', bkg_file, conf.get('bkg_ext','sci'))]:
+        ident=get_input_identity(fname, ext=ext)
+        size_key, mtime_key, dsum_key = _input_keys[which]
+        keys += [
+            {'name':size_key, 'value':ident['size'],
+             'comment':'%s file size' % which},
+            {'name':mtime_key, 'value':ident['mtime'],
+             'comment':'%s file mtime' % which},
+        ]
+        if ident['datasum'] is not None:
+            keys.append( {'name':dsum_key, 'value':ident['datasum'],
+                          'comment':'%s DATASUM' % which} )
+
+    return keys
+
+def get_record(conf, image_file, bkg_file):
+    """
+    the provenance of an output made now, in the form returned by
+    read_record.  Used where the provenance is not kept in FITS
+    headers, e.g. in the store
+    """
+    record={'ok':True,
+            'code_version':get_code_version(),
+            'conf_hash':get_config_hash(conf)}
+
+    for which, fname, ext in [('image', image_file, conf.get('image_ext','sci')),
+                              ('bkg', bkg_file, conf.get('bkg_ext','sci'))]:
+        record[which]=get_input_identity(fname, ext=ext)
+
+    return record
+
+def write_checksums(fits):
+    """
+    write CHECKSUM and DATASUM for every HDU.  Do this after all other
+    writes; a file without them was not completely written
+    """
+    for hdu in fits:
+        hdu.write_checksum()
+
+def read_record(output_file, verify=False):
+    """
+    read the provenance of an output from its headers
+
+    parameters
+    ----------
+    output_file: string
+        The eyeball file
+    verify: bool, optional
+        If True, also verify the checksums, which reads all the data
+
+    output
+    ------
+    dict with size, mtime, ok, and if ok the provenance.  If the file
+    is incomplete or corrupt ok is False and message says why
+    """
+    import fitsio
+
+    st=os.stat(output_file)
+    record={'size':st.st_size, 'mtime':st.st_mtime, 'ok':False, 'message':''}
+
+    try:
+        with fitsio.FITS(output_file) as fits:
+            extnames=[hdu.get_extname() for hdu in fits]
+            for extname in REQUIRED_EXTNAMES:
+                if extname not in extnames:
+                    raise ValueError("missing extension %s" % extname)
+
+            datasums=[]
+            for hdu in fits:
+                hdr=hdu.read_header()
+                if 'CHECKSUM' not in hdr or 'DATASUM' not in hdr:
+                    raise ValueError("no checksum in hdu %d" % hdu.get_extnum())
+                datasums.append(str(hdr['DATASUM']).strip())
+
+                if verify:
+                    hdu.verify_checksum()
+
+            # the file must extend to the end of the last hdu
+            data_end=_get_data_end(fits[len(fits)-1])
+            if st.st_size < data_end:
+                raise ValueError("file is truncated")
+
+            hdr=fits['metadata'].read_header()
+    except (IOError, OSError, ValueError, RuntimeError) as err:
+        record['message']=str(err)
+        return record
+
+    if 'CONFHASH' not in hdr:
+        record['message']='no provenance keywords'
+        return record
+
+    record['ok']=True
+    record['datasums']=datasums
+    record['code_version']=str(hdr['EYEVERS']).strip()
+    record['conf_hash']=str(hdr['CONFHASH']).strip()
+    for which, (size_key, mtime_key, dsum_key) in _input_keys.items():
+        dsum=hdr.get(dsum_key,None)
+        record[which]={'size':hdr.get(size_key,None),
+                       'mtime':hdr.get(mtime_key,None),
+                       'datasum':None if dsum is None else str(dsum).strip()}
+
+    return record
+
+def check_output(output_file, image_file, bkg_file, conf,
+                 record=None, verify=False):
+    """
+    check whether an output is up to date
+
+    parameters
+    ----------
+    output_file, image_file, bkg_file: strings
+        The output and its inputs
+    conf: dict
+        The run config
+    record: dict, optional
+        A record from an earlier read_record; it is used if the output
+        size and mtime have not changed
+    verify: bool, optional
+        Verify the checksums, which reads all the data
+
+    output
+    ------
+    reason, record.  The reason is None if the output is up to date,
+    otherwise one of the REASON_ values.  The record is None if the
+    output is missing
+    """
+    try:
+        st=os.stat(output_file)
+    except OSError:
+        return REASON_MISSING, None
+
+    if (verify or record is None
+            or record['size'] != st.st_size or record['mtime'] != st.st_mtime):
+        record=read_record(output_file, verify=verify)
+
+    return check_record(record, image_file, bkg_file, conf), record
+
+def check_record(record, image_file, bkg_file, conf):
+    """
+    check a provenance record, from read_record or get_record, against
+    the inputs, config and code version
+
+    output
+    ------
+    None if up to date, otherwise one of the REASON_ values
+    """
+    if record is None:
+        return REASON_MISSING
+
+    if not record['ok']:
+        return REASON_CORRUPT
+
+    if record['code_version'] != get_code_version():
+        return REASON_CODE
+
+    if record['conf_hash'] != get_config_hash(conf):
+        return REASON_CONFIG
+
+    for which, fname, ext in [('image', image_file, conf.get('image_ext','sci')),
+                              ('bkg', bkg_file, conf.get('bkg_ext','sci'))]:
+        if not _input_matches(record[which], fname, ext):
+            return REASON_INPUT
+
+    return None
+
+def find_stale(run, items, conf, nthreads=16, verify=False):
+    """
+    find the outputs that need to be made, updating the per-run manifest
+
+    parameters
+    ----------
+    run: string
+        The run identifier
+    items: list of dicts
+        Each with image_file, bkg_file and output_file
+    conf: dict
+        The run config
+    nthreads: integer, optional
+        Threads used to check the outputs
+    verify: bool, optional
+        Verify the checksums, which reads all the data
+
+    output
+    ------
+    dict keyed by output file of the reason it is stale
+    """
+    import multiprocessing.pool
+
+    fname=files.get_provenance_file(run)
+    manifest=read_manifest(fname)
+
+    def _check(item):
+        output_file=item['output_file']
+        return check_output(output_file,
+                            item['image_file'],
+                            item['bkg_file'],
+                            conf,
+                            record=manifest.get(output_file,None),
+                            verify=verify)
+
+    pool=multiprocessing.pool.ThreadPool(nthreads)
+    try:
+        results=pool.map(_check, items, chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
+
+    stale={}
+    for item, (reason, record) in zip(items, results):
+        output_file=item['output_file']
+        if record is None:
+            manifest.pop(output_file,None)
+        else:
+            manifest[output_file]=record
+
+        if reason is not None:
+            stale[output_file]=reason
+
+    write_manifest(fname, manifest)
+    return stale
+
+def count_reasons(stale):
+    """
+    get a dict of counts keyed by reason
+    """
+    counts={}
+    for reason in stale.values():
+        counts[reason]=counts.get(reason,0) + 1
+    return counts
+
+def read_manifest(fname):
+    """
+    read the per-run manifest; an empty dict if it does not exist
+    """
+    if not os.path.exists(fname):
+        return {}
+
+    print("reading provenance manifest:",fname)
+    with open(fname) as fobj:
+        return json.load(fobj)
+
+def write_manifest(fname, manifest):
+    """
+    write the per-run manifest, replacing the old one only when the
+    new one is complete
+    """
+    dir=os.path.dirname(fname)
+    if not os.path.exists(dir):
+        print("making dir:",dir)
+        os.makedirs(dir)
+
+    print("writing provenance manifest:",fname)
+    tmpname=fname+'.tmp'
+    with open(tmpname,'w') as fobj:
+        json.dump(manifest, fobj)
+    os.rename(tmpname, fname)
+
+def _input_matches(recorded, fname, ext):
+    """
+    compare a recorded input identity with the file.  If only the mtime
+    differs, the DATASUM decides, so copies of identical data match
+    """
+    try:
+        st=os.stat(fname)
+    except OSError:
+        # can't remake it anyway
+        return True
+
+    if recorded['size'] != st.st_size:
+        return False
+
+    # the header value may be rounded
+    if (recorded['mtime'] is not None
+            and abs(recorded['mtime'] - st.st_mtime) < MTIME_TOL):
+        return True
+
+    if recorded['datasum'] is None:
+        return False
+
+    ident=get_input_identity(fname, ext=ext)
+    return ident['datasum'] == recorded['datasum']
+
+def _get_data_end(hdu):
+    """
+    end of the data; older fitsio returns a tuple
+    """
+    offsets=hdu.get_offsets()
+    if isinstance(offsets, dict):
+        return offsets['data_end']
+    else:
+        return offsets[2]
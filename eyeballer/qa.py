@@ -0,0 +1,409 @@
+"""
+Ingest QA scores from reviewers into the qa table of the run database
+
+The database is used in WAL mode, so readers are not blocked while scores
+are written.  There is one score per (userid, fileid); writing a score
+again replaces it, so repeated submissions are harmless.
+
+Writes from many clients go through a single QAWriter thread, which
+groups whatever has arrived into one transaction rather than committing
+each score separately
+
+    writer=QAWriter(dbfile)
+    writer.write([{'userid':3, 'fileid':1234, 'score':-1, 'comments':'streak'}])
+    writer.close()
+
+QAServer is a small socket service in front of a QAWriter.  Clients send
+one JSON score, or a list of them, per line and get back a JSON reply
+once the scores are committed.
+"""
+from __future__ import print_function
+import time
+import json
+import socket
+import sqlite3
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+QA_TABLE='qa'
+QA_COLUMNS=['userid','fileid','score','comments']
+QA_UNIQUE_INDEX=QA_TABLE+'_userid_fileid_uidx'
+
+# superseded scores found when adding the unique index go here
+QA_DUPLICATES_TABLE=QA_TABLE+'_duplicates'
+
+# maximum scores per transaction, and the longest time to wait for more
+# scores to arrive before committing a partial batch
+DEFAULT_BATCH_SIZE=1000
+DEFAULT_MAX_WAIT=0.005
+
+DEFAULT_HOST='localhost'
+DEFAULT_PORT=8765
+
+# seconds to wait for a lock before giving up
+DEFAULT_TIMEOUT=30.0
+
+_upsert_query="""
+INSERT OR REPLACE INTO {tablename} ({cols}) VALUES (?, ?, ?, ?)
+""".format(tablename=QA_TABLE, cols=', '.join(QA_COLUMNS))
+
+def connect(fname, timeout=DEFAULT_TIMEOUT):
+    """
+    open the database in WAL mode
+
+    parameters
+    ----------
+    fname: string
+        The database file
+    timeout: float, optional
+        Seconds to wait for a lock, default DEFAULT_TIMEOUT
+    """
+    conn=sqlite3.connect(fname, timeout=timeout, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+
+    # in WAL mode this is still safe against corruption; a power loss can
+    # only lose the most recent transactions
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def make_qa_table(conn):
+    """
+    create the qa table if needed, with a unique index on (userid, fileid).
+    Tables made before the index existed are migrated once; see
+    migrate_duplicates
+    """
+    curs=conn.cursor()
+
+    q="""
+create table if not exists {tablename} (
+    userid int,
+    fileid int,
+    score int,
+    comments text
+)
+    """.format(tablename=QA_TABLE)
+
+    print(q)
+    curs.execute(q)
+
+    for field in ['fileid','score']:
+        q="CREATE INDEX IF NOT EXISTS {tablename}_{field}_idx ON {tablename} ({field})"
+        q=q.format(tablename=QA_TABLE, field=field)
+        print(q)
+        curs.execute(q)
+
+    curs.close()
+
+    if not _has_index(conn, QA_UNIQUE_INDEX):
+        migrate_duplicates(conn)
+
+        q=("CREATE UNIQUE INDEX {index} "
+           "ON {tablename} (userid, fileid)").format(index=QA_UNIQUE_INDEX,
+                                                     tablename=QA_TABLE)
+        print(q)
+        conn.execute(q)
+
+    conn.commit()
+
+def migrate_duplicates(conn):
+    """
+    move all but the latest score for each (userid, fileid) into the
+    QA_DUPLICATES_TABLE table, so the unique index can be made.  Nothing
+    is deleted that is not first copied there
+
+    output
+    ------
+    the number of scores moved
+    """
+    curs=conn.cursor()
+
+    q="""
+create table if not exists {backup} (
+    qa_rowid int,
+    userid int,
+    fileid int,
+    score int,
+    comments text
+)
+    """.format(backup=QA_DUPLICATES_TABLE)
+    curs.execute(q)
+
+    where="""
+WHERE rowid NOT IN
+    (SELECT max(rowid) FROM {tablename} GROUP BY userid, fileid)
+    """.format(tablename=QA_TABLE)
+
+    q="""
+INSERT INTO {backup} (qa_rowid, {cols})
+    SELECT rowid, {cols} FROM {tablename} {where}
+    """.format(backup=QA_DUPLICATES_TABLE, cols=', '.join(QA_COLUMNS),
+               tablename=QA_TABLE, where=where)
+    curs.execute(q)
+    nmoved=curs.rowcount
+
+    if nmoved > 0:
+        curs.execute("DELETE FROM {tablename} {where}".format(tablename=QA_TABLE,
+                                                              where=where))
+        print('moved %d superseded scores to table %s' % (nmoved,QA_DUPLICATES_TABLE))
+
+    curs.close()
+    return nmoved
+
+def upsert_scores(conn, scores):
+    """
+    write scores in a single transaction, replacing any existing score
+    for the same (userid, fileid)
+
+    parameters
+    ----------
+    conn: sqlite3 connection
+    scores: list of dicts
+        Each with userid, fileid, score and optionally comments
+    """
+    rows=[_get_row(s) for s in scores]
+    _upsert_rows(conn, rows)
+    return len(rows)
+
+class QAWriter(object):
+    def __init__(self, fname,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT):
+        """
+        Write scores from many threads through a single connection,
+        grouping them into batches
+
+        parameters
+        ----------
+        fname: string
+            The database file.  The qa table is created if needed
+        batch_size: integer, optional
+            Maximum scores per transaction, default DEFAULT_BATCH_SIZE
+        max_wait: float, optional
+            Seconds to wait for more scores before committing a partial
+            batch, default DEFAULT_MAX_WAIT.  The writer waits only until
+            as many submissions have arrived as were in the previous
+            batch, so concurrent clients share commits
+        """
+        self.fname=fname
+        self.batch_size=int(batch_size)
+        self.max_wait=float(max_wait)
+
+        self.nwritten=0
+        self.nbatch=0
+
+        conn=connect(self.fname)
+        make_qa_table(conn)
+        conn.close()
+
+        self._queue=queue.Queue()
+        self._thread=threading.Thread(target=self._run)
+        self._thread.daemon=True
+        self._thread.start()
+
+    def submit(self, scores):
+        """
+        queue scores to be written, returning a _Ticket that can be
+        waited on.  The scores are checked here, so bad input raises
+        ValueError in the caller rather than failing the batch
+        """
+        rows=[_get_row(s) for s in scores]
+
+        ticket=_Ticket(len(rows))
+        self._queue.put( (rows, ticket) )
+        return ticket
+
+    def write(self, scores):
+        """
+        write scores, returning once they are committed
+        """
+        return self.submit(scores).wait()
+
+    def close(self):
+        """
+        write anything pending and stop the writer thread
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn=connect(self.fname)
+
+        # submissions in the previous batch
+        nexpect=1
+        try:
+            while True:
+                item=self._queue.get()
+                if item is None:
+                    break
+
+                batch=[item]
+                nrows=len(item[0])
+                stop=False
+
+                tm0=time.time()
+                while nrows < self.batch_size:
+                    remaining=self.max_wait-(time.time()-tm0)
+                    try:
+                        if remaining > 0 and len(batch) < nexpect:
+                            item=self._queue.get(timeout=remaining)
+                        else:
+                            item=self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+
+                    if item is None:
+                        stop=True
+                        break
+
+                    batch.append(item)
+                    nrows += len(item[0])
+
+                self._write_batch(conn, batch)
+                nexpect=len(batch)
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn, batch):
+        rows=[]
+        for r, ticket in batch:
+            rows += r
+
+        error=None
+        try:
+            _upsert_rows(conn, rows)
+        except sqlite3.Error as err:
+            conn.rollback()
+            error=err
+        else:
+            self.nwritten += len(rows)
+            self.nbatch += 1
+
+        for r, ticket in batch:
+            ticket.set(error)
+
+class _Ticket(object):
+    """
+    completion of a submitted set of scores
+    """
+    def __init__(self, nscores):
+        self.nscores=nscores
+        self.error=None
+        self._event=threading.Event()
+
+    def set(self, error=None):
+        self.error=error
+        self._event.set()
+
+    def wait(self, timeout=None):
+        """
+        wait for the scores to be committed, returning the number
+        written.  IOError is raised if the write failed
+        """
+        if not self._event.wait(timeout):
+            raise IOError("timed out waiting for scores to be written")
+        if self.error is not None:
+            raise IOError("failed to write scores: %s" % self.error)
+        return self.nscores
+
+class QAServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    socket service that writes scores sent by clients through a QAWriter.
+    Each line from a client is a JSON score or list of scores, and each
+    is answered with a line {"nwritten": n} or {"error": message}
+    """
+    daemon_threads=True
+    allow_reuse_address=True
+
+    def __init__(self, writer, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.writer=writer
+        socketserver.TCPServer.__init__(self, (host, int(port)), _QAHandler)
+
+class _QAHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line=line.strip()
+            if len(line)==0:
+                continue
+
+            try:
+                scores=json.loads(line.decode('utf-8'))
+                if isinstance(scores, dict):
+                    scores=[scores]
+                nwritten=self.server.writer.write(scores)
+                reply={'nwritten':nwritten}
+            except (ValueError, TypeError, KeyError, IOError) as err:
+                reply={'error':str(err)}
+
+            self.wfile.write((json.dumps(reply)+'\n').encode('utf-8'))
+            self.wfile.flush()
+
+class QAClient(object):
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        a connection to a QAServer
+        """
+        self.sock=socket.create_connection( (host, int(port)) )
+        self.fobj=self.sock.makefile('rwb')
+
+    def send(self, scores):
+        """
+        send a score or list of scores, returning the number written.
+        IOError is raised if the server reports an error
+        """
+        self.fobj.write((json.dumps(scores)+'\n').encode('utf-8'))
+        self.fobj.flush()
+
+        line=self.fobj.readline()
+        if len(line)==0:
+            raise IOError("connection closed by server")
+
+        reply=json.loads(line.decode('utf-8'))
+        if 'error' in reply:
+            raise IOError(reply['error'])
+        return reply['nwritten']
+
+    def close(self):
+        self.fobj.close()
+        self.sock.close()
+
+def _upsert_rows(conn, rows):
+    curs=conn.cursor()
+    curs.executemany(_upsert_query, rows)
+    curs.close()
+    conn.commit()
+
+def _get_row(score):
+    """
+    check a score and convert it to a row for the upsert
+    """
+    try:
+        userid=int(score['userid'])
+        fileid=int(score['fileid'])
+        value=int(score['score'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("scores need integer userid, fileid "
+                         "and score, got %r" % (score,))
+
+    comments=score.get('comments',None)
+    if comments is not None:
+        comments=str(comments)
+
+    return (userid, fileid, value, comments)
+
+def _has_index(conn, name):
+    curs=conn.execute("SELECT name FROM sqlite_master "
+                      "WHERE type='index' AND name=?", (name,))
+    found=curs.fetchone() is not None
+    curs.close()
+    return found
@@ -0,0 +1,210 @@
+"""
+Rebinning kernels for images and bitmasks
+
+All reductions are done in numpy on a reshaped view of the input, so there
+are no python level loops over pixels.  Input shapes that are not divisible
+by the rebin factor are either cropped or padded, controlled by the edge
+keyword.
+
+The output dtype follows the input dtype; float32 images are not promoted
+to float64.
+"""
+from __future__ import print_function
+import numpy
+
+EDGE_CROP='crop'
+EDGE_PAD='pad'
+EDGE_RAISE='raise'
+
+EDGE_TYPES=[EDGE_CROP, EDGE_PAD, EDGE_RAISE]
+
+def rebin_image(im, factor, dtype=None, edge=EDGE_CROP):
+    """
+    Rebin the image so there are fewer pixels.  The pixels are simply
+    averaged.
+
+    parameters
+    ----------
+    im: 2-d array
+        The image to rebin
+    factor: integer
+        The rebin factor, applied to both dimensions
+    dtype: numpy dtype, optional
+        Convert to this type before rebinning.  Integer images are
+        averaged in float32 unless a dtype is sent.
+    edge: string, optional
+        How to handle shapes not divisible by the factor.  'crop' drops
+        the trailing rows and columns, 'pad' includes partial blocks
+        averaged over the pixels they contain, 'raise' raises ValueError.
+        Default 'crop'
+    """
+    return rebin_mean(im, factor, dtype=dtype, edge=edge)
+
+def rebin_mean(im, factor, dtype=None, edge=EDGE_CROP):
+    """
+    Rebin by averaging the pixels in each block.  See rebin_image for
+    a description of the parameters.
+    """
+    dtype=_get_float_dtype(im, dtype)
+
+    sums = rebin_sum(im, factor, dtype=dtype, edge=edge)
+
+    factor=_check_factor(factor)
+    if edge==EDGE_PAD:
+        counts = _get_block_counts(im.shape, factor, dtype)
+        sums /= counts
+    else:
+        sums /= dtype.type(factor*factor)
+
+    return sums
+
+def rebin_sum(im, factor, dtype=None, edge=EDGE_CROP):
+    """
+    Rebin by summing the pixels in each block.  See rebin_image for
+    a description of the parameters.  The sum is accumulated in the
+    input dtype unless dtype is sent.
+    """
+    if dtype is None:
+        dtype=im.dtype
+    else:
+        dtype=numpy.dtype(dtype)
+
+    rs = _get_blocks(im, factor, edge, 0)
+
+    tmp = rs.sum(axis=1, dtype=dtype)
+    return tmp.sum(axis=2, dtype=dtype)
+
+def rebin_max(im, factor, edge=EDGE_CROP):
+    """
+    Rebin by taking the maximum of the pixels in each block.  See
+    rebin_image for a description of the parameters.
+    """
+    fill = _get_min_value(im.dtype)
+    rs = _get_blocks(im, factor, edge, fill)
+
+    tmp = rs.max(axis=1)
+    return tmp.max(axis=2)
+
+def rebin_bitmask_or(a, factor, edge=EDGE_CROP):
+    """
+    Rebin a bitmask, combining the pixels in each block with a bitwise or.
+
+    parameters
+    ----------
+    a: 2-d integer array
+        The bitmask to rebin
+    factor: integer
+        The rebin factor, applied to both dimensions
+    edge: string, optional
+        How to handle shapes not divisible by the factor.  'crop' drops
+        the trailing rows and columns, 'pad' includes partial blocks,
+        'raise' raises ValueError.  Default 'crop'
+    """
+    if a.dtype.kind not in ('i','u','b'):
+        raise ValueError("bitmask must be an integer "
+                         "type, got %s" % a.dtype.descr[0][1])
+
+    rs = _get_blocks(a, factor, edge, 0)
+
+    tmp = numpy.bitwise_or.reduce(rs, axis=1)
+    return numpy.bitwise_or.reduce(tmp, axis=2)
+
+def get_rebinned_shape(shape, factor, edge=EDGE_CROP):
+    """
+    Get the shape of the rebinned image
+
+    parameters
+    ----------
+    shape: sequence
+        The input 2-d shape
+    factor: integer
+        The rebin factor
+    edge: string, optional
+        The edge handling; see rebin_image
+    """
+    factor=_check_factor(factor)
+    nrows, ncols = shape
+    if edge==EDGE_PAD:
+        return (-(-nrows//factor), -(-ncols//factor))
+    else:
+        return (nrows//factor, ncols//factor)
+
+def _get_blocks(im, factor, edge, fill):
+    """
+    get a 4-d view (nrow_new, factor, ncol_new, factor) of the
+    input, cropping or padding as requested.  A copy is only
+    made when padding
+    """
+    factor=_check_factor(factor)
+    if edge not in EDGE_TYPES:
+        raise ValueError("edge should be one of %s, "
+                         "got '%s'" % (EDGE_TYPES, edge))
+    if len(im.shape) != 2:
+        raise ValueError("expected 2-d image, got shape %s" % (im.shape,))
+
+    nrows, ncols = im.shape
+    rrem = nrows % factor
+    crem = ncols % factor
+
+    if rrem != 0 or crem != 0:
+        if edge==EDGE_RAISE:
+            raise ValueError("shape in each dim (%d,%d) must be "
+                             "divisible by factor (%d)" % (nrows,ncols,factor))
+        elif edge==EDGE_CROP:
+            im = im[0:nrows-rrem, 0:ncols-crem]
+        else:
+            im = _pad_image(im, factor, fill)
+
+    nrows_new = im.shape[0]//factor
+    ncols_new = im.shape[1]//factor
+    return im.reshape(nrows_new, factor, ncols_new, factor)
+
+def _pad_image(im, factor, fill):
+    """
+    pad the image up to the next multiple of factor
+    """
+    nrows_new, ncols_new = get_rebinned_shape(im.shape, factor, edge=EDGE_PAD)
+
+    padded = numpy.empty( (nrows_new*factor, ncols_new*factor), dtype=im.dtype)
+    padded[:,:] = fill
+    padded[0:im.shape[0], 0:im.shape[1]] = im
+    return padded
+
+def _get_block_counts(shape, factor, dtype):
+    """
+    number of real pixels in each block when padding
+    """
+    nrows_new, ncols_new = get_rebinned_shape(shape, factor, edge=EDGE_PAD)
+
+    rcounts = numpy.zeros(nrows_new, dtype=dtype)
+    rcounts[:] = factor
+    rcounts[-1] = shape[0] - (nrows_new-1)*factor
+
+    ccounts = numpy.zeros(ncols_new, dtype=dtype)
+    ccounts[:] = factor
+    ccounts[-1] = shape[1] - (ncols_new-1)*factor
+
+    return numpy.outer(rcounts, ccounts)
+
+def _get_float_dtype(im, dtype):
+    if dtype is not None:
+        return numpy.dtype(dtype)
+
+    if im.dtype.kind == 'f':
+        return im.dtype
+    else:
+        return numpy.dtype('f4')
+
+def _get_min_value(dtype):
+    if dtype.kind == 'f':
+        return -numpy.inf
+    elif dtype.kind == 'b':
+        return False
+    else:
+        return numpy.iinfo(dtype).min
+
+def _check_factor(factor):
+    factor=int(factor)
+    if factor < 1:
+        raise ValueError("rebin factor must be >= 1, got %d" % factor)
+    return factor
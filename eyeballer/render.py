@@ -0,0 +1,246 @@
+"""
+Render the field of eyeball products with the bpm as a color overlay
+
+The field and bpm_and_weight of a product have the same shape, so the
+composite is made at the rebinned size and only then upsampled for
+display.  The composite is a single lookup in a table indexed by the
+overlay color and the stretched field value, and the upsampling writes
+through a strided view of the output rather than building coordinate
+arrays, so the only full size array is the output itself.  The renderer
+keeps its output buffer between calls, so rendering many products of the
+same size allocates it once
+
+    renderer=OverlayRenderer(factor=2)
+    for fname in fnames:
+        rgb=renderer.render_file(fname)
+        ...
+
+The overlay rules are applied in order, so later rules take precedence
+where several match.  Bits are integers or names from masks.BIT_NAMES.
+"""
+from __future__ import print_function
+import numpy
+
+from . import jpegs
+from .masks import get_bits, _as_dtype
+
+DEFAULT_OVERLAY=[
+    {'bits':['BADPIX_BPM','BADPIX_BADAMP'], 'color':(255,0,0)},
+    {'bits':['BADPIX_SATURATE','BADPIX_EDGEBLEED'], 'color':(255,255,0)},
+    {'bits':['BADPIX_CRAY','BADPIX_TRAIL','BADPIX_STREAK'], 'color':(0,255,255)},
+    {'bits':['WEIGHT_FLAG'], 'color':(255,0,255)},
+]
+
+# opacity of the overlay colors
+DEFAULT_ALPHA=0.4
+
+class OverlayRenderer(object):
+    def __init__(self,
+                 overlay=DEFAULT_OVERLAY,
+                 alpha=DEFAULT_ALPHA,
+                 factor=1,
+                 lut=None,
+                 xmax=None,
+                 xmin=0.0,
+                 **keys):
+        """
+        parameters
+        ----------
+        overlay: list of dicts, optional
+            Each with 'bits' and 'color', an (r,g,b) triple, default
+            DEFAULT_OVERLAY.  Send None or [] for a gray image
+        alpha: float, optional
+            Opacity of the overlay colors, default DEFAULT_ALPHA
+        factor: integer, optional
+            Upsampling factor for display, default 1
+        lut, xmax, xmin: optional
+            A lookup table from jpegs.make_asinh_lut or
+            jpegs.make_stats_lut; by default one is made from the
+            extra keywords
+        **keys:
+            exptime, scale, nonlinear for jpegs.make_asinh_lut
+        """
+        factor=int(factor)
+        if factor < 1:
+            raise ValueError("upsampling factor must be >= 1")
+        self.factor=factor
+
+        if lut is None:
+            lut, xmax = jpegs.make_asinh_lut(**keys)
+        self.set_lut(lut, xmax, xmin=xmin)
+
+        if overlay is None:
+            overlay=[]
+        self.bits=[get_bits(rule['bits']) for rule in overlay]
+
+        self.alpha=float(alpha)
+        self.table=_make_overlay_table([rule['color'] for rule in overlay],
+                                       self.alpha)
+
+        self._out=None
+
+    def set_lut(self, lut, xmax, xmin=0.0):
+        """
+        use a different lookup table for the following renders, e.g.
+        one from jpegs.make_stats_lut for each product
+        """
+        self.lut=lut
+        self.xmax=xmax
+        self.xmin=xmin
+
+    def get_output_shape(self, shape):
+        """
+        the shape of the rendered image for a field of the given shape
+        """
+        shape=(shape[0]*self.factor, shape[1]*self.factor)
+        if len(self.bits) > 0:
+            shape += (3,)
+        return shape
+
+    def render(self, field, bpm=None, out=None):
+        """
+        stretch the field, overlay the bpm and upsample
+
+        parameters
+        ----------
+        field: 2-d array
+            The field from an eyeball product
+        bpm: 2-d integer array, optional
+            The bpm_and_weight, same shape as the field.  Required if
+            there are overlay rules
+        out: uint8 array, optional
+            Where to put the result, of shape get_output_shape(field.shape).
+            By default a buffer kept by the renderer is used, which is
+            overwritten by the next call
+
+        output
+        ------
+        uint8 array, (nrows, ncols, 3) with an overlay, otherwise
+        (nrows, ncols)
+        """
+        shape=self.get_output_shape(field.shape)
+        if out is None:
+            out=self._get_buffer(shape)
+        elif out.shape != shape or out.dtype != numpy.uint8:
+            raise ValueError("out should be uint8 with shape %s, "
+                             "got %s %s" % (shape, out.dtype, out.shape))
+
+        gray=jpegs.apply_lut(field, self.lut, self.xmax, xmin=self.xmin)
+
+        if len(self.bits)==0:
+            return upsample(gray, self.factor, out=out)
+
+        if bpm is None:
+            raise ValueError("a bpm is needed for the overlay")
+        if bpm.shape != field.shape:
+            raise ValueError("bpm shape %s does not match field "
+                             "shape %s" % (bpm.shape, field.shape))
+
+        # index into the table, (color index)*256 + gray value
+        index=numpy.zeros(field.shape, dtype='i4')
+        for i, bits in enumerate(self.bits):
+            hit=numpy.bitwise_and(bpm, _as_dtype(bits, bpm.dtype)) != 0
+            numpy.copyto(index, (i+1)*256, where=hit)
+        index += gray
+
+        if self.factor==1:
+            return numpy.take(self.table, index, axis=0, out=out)
+
+        rgb=numpy.take(self.table, index, axis=0)
+        return upsample(rgb, self.factor, out=out)
+
+    def render_product(self, product, out=None):
+        """
+        render the field and bpm of an EyeballProduct
+        """
+        field=product.read_field()
+        bpm=None
+        if len(self.bits) > 0:
+            bpm=product.read_bpm()
+        return self.render(field, bpm, out=out)
+
+    def render_file(self, fname, out=None):
+        """
+        render the field and bpm of an eyeball file
+        """
+        from .products import EyeballProduct
+        with EyeballProduct(fname) as product:
+            return self.render_product(product, out=out)
+
+    def _get_buffer(self, shape):
+        if self._out is None or self._out.shape != shape:
+            self._out=numpy.empty(shape, dtype='u1')
+        return self._out
+
+def upsample(a, factor, out=None):
+    """
+    enlarge an image by an integer factor, repeating each pixel in a
+    factor x factor block.  Trailing dimensions, e.g. rgb, are kept
+
+    parameters
+    ----------
+    a: array
+        At least 2-d; the first two dimensions are upsampled
+    factor: integer
+        The upsampling factor
+    out: array, optional
+        Where to put the result, of shape
+        (nrows*factor, ncols*factor) + a.shape[2:]
+
+    output
+    ------
+    the upsampled array
+    """
+    factor=int(factor)
+    if factor < 1:
+        raise ValueError("upsampling factor must be >= 1")
+
+    nrows, ncols = a.shape[0:2]
+    rest=a.shape[2:]
+    shape=(nrows*factor, ncols*factor) + rest
+
+    if out is None:
+        out=numpy.empty(shape, dtype=a.dtype)
+    elif out.shape != shape:
+        raise ValueError("out should have shape %s, got %s" % (shape, out.shape))
+
+    if factor==1:
+        out[...] = a
+        return out
+
+    # setting the shape, rather than reshape, fails rather than
+    # copying if out can't be viewed this way
+    blocks=out.view()
+    blocks.shape=(nrows, factor, ncols, factor) + rest
+    blocks[...] = get_upsampled_view(a, factor)
+
+    return out
+
+def get_upsampled_view(a, factor):
+    """
+    a read only view of a with shape (nrows, factor, ncols, factor) + rest,
+    in which each pixel is repeated over a factor x factor block.  No
+    data are copied; reshape to (nrows*factor, ncols*factor) + rest for
+    an image, which does copy
+    """
+    nrows, ncols = a.shape[0:2]
+    rest=a.shape[2:]
+
+    sub=a[:, numpy.newaxis, :, numpy.newaxis]
+    return numpy.broadcast_to(sub, (nrows, factor, ncols, factor) + rest)
+
+def _make_overlay_table(colors, alpha):
+    """
+    the rgb value for each (color index, gray value), color index 0 being
+    no overlay, flattened to ((ncolor+1)*256, 3)
+    """
+    gray=numpy.arange(256, dtype='f8')
+
+    table=numpy.zeros( (len(colors)+1, 256, 3), dtype='f8')
+    table[0, :, :] = gray[:, numpy.newaxis]
+    for i, color in enumerate(colors):
+        color=numpy.array(color, dtype='f8')
+        table[i+1] = (1-alpha)*gray[:, numpy.newaxis] + alpha*color
+
+    table=numpy.clip(table + 0.5, 0, 255).astype('u1')
+    return table.reshape( (len(colors)+1)*256, 3 )
@@ -0,0 +1,183 @@
+"""
+Pack work items into chunks of roughly equal cost
+
+The cost of an item is its runtime from an earlier run if known,
+otherwise an estimate from the size of its input image, put on the same
+scale as the runtimes with the median seconds per byte of the items that
+have both.  The sizes are best taken from a directory listing already
+made, as make-eyeball-scripts does, rather than a stat per file.  Items are
+assigned largest first to the chunk with the least total cost, which
+keeps the chunks balanced even when costs vary a lot.
+"""
+from __future__ import print_function
+import os
+import heapq
+
+# seconds per byte of input when no item has both a runtime and a size.
+# Then either all costs are runtimes or all are sizes, so the value only
+# sets the units
+DEFAULT_SECONDS_PER_BYTE=1.0e-7
+
+def get_costs(items, runtimes=None, sizes=None, nthreads=16):
+    """
+    estimate the cost of each item
+
+    parameters
+    ----------
+    items: list of dicts
+        Each has image_file and output_file
+    runtimes: dict, optional
+        Runtimes in seconds from earlier runs keyed by output file,
+        e.g. from read_runtimes
+    sizes: dict, optional
+        Sizes of the input images in bytes keyed by image file, None
+        for files that could not be read.  By default the image files
+        without a runtime are stat'ed
+    nthreads: integer, optional
+        Threads used to stat the input files when sizes is not sent
+
+    output
+    ------
+    list of costs in seconds
+    """
+    if runtimes is None:
+        runtimes={}
+
+    if sizes is None:
+        tostat=[item['image_file'] for item in items
+                if item['output_file'] not in runtimes]
+        sizes=_stat_sizes(tostat, nthreads)
+
+    seconds_per_byte=get_seconds_per_byte(items, runtimes, sizes)
+
+    # items with neither a runtime nor a readable input get the median
+    known=[t for t in runtimes.values()] + [s*seconds_per_byte
+                                            for s in sizes.values()
+                                            if s is not None]
+    default=_median(known) if len(known) > 0 else 1.0
+
+    costs=[]
+    for item in items:
+        runtime=runtimes.get(item['output_file'],None)
+        if runtime is not None:
+            costs.append(runtime)
+            continue
+
+        size=sizes.get(item['image_file'],None)
+        if size is not None:
+            costs.append(size*seconds_per_byte)
+        else:
+            costs.append(default)
+
+    return costs
+
+def get_seconds_per_byte(items, runtimes, sizes):
+    """
+    the median runtime per byte of input over the items with both a
+    runtime and a size, or DEFAULT_SECONDS_PER_BYTE if there are none
+    """
+    ratios=[]
+    for item in items:
+        runtime=runtimes.get(item['output_file'],None)
+        size=sizes.get(item['image_file'],None)
+        if runtime is not None and size is not None and size > 0:
+            ratios.append(runtime/float(size))
+
+    if len(ratios)==0:
+        return DEFAULT_SECONDS_PER_BYTE
+
+    return _median(ratios)
+
+def pack_chunks(costs, nchunks):
+    """
+    split items into chunks with roughly equal total cost
+
+    parameters
+    ----------
+    costs: sequence
+        The cost of each item
+    nchunks: integer
+        The number of chunks
+
+    output
+    ------
+    list of lists of item indices.  Empty chunks are dropped
+    """
+    nchunks=max(int(nchunks),1)
+
+    heap=[(0.0, ichunk) for ichunk in range(nchunks)]
+    chunks=[[] for ichunk in range(nchunks)]
+
+    order=sorted(range(len(costs)), key=lambda i: costs[i], reverse=True)
+    for i in order:
+        total, ichunk = heapq.heappop(heap)
+        chunks[ichunk].append(i)
+        heapq.heappush(heap, (total+costs[i], ichunk))
+
+    return [sorted(c) for c in chunks if len(c) > 0]
+
+def read_runtimes(summary_files):
+    """
+    read runtimes of successful items from batch summary files
+
+    parameters
+    ----------
+    summary_files: list of strings
+        Files written by batch.write_summary
+
+    output
+    ------
+    dict of runtimes keyed by output file
+    """
+    from .batch import STATUS_OK
+
+    runtimes={}
+    for fname in summary_files:
+        with open(fname) as fobj:
+            for line in fobj:
+                ls=line.split()
+                if len(ls) < 3 or ls[0] != STATUS_OK:
+                    continue
+                runtimes[ls[2]]=float(ls[1])
+
+    return runtimes
+
+def print_balance(chunks, costs):
+    """
+    print the spread of the chunk costs
+    """
+    totals=[sum([costs[i] for i in c]) for c in chunks]
+    if len(totals)==0:
+        return
+
+    print("%d chunks, cost min %.1f max %.1f "
+          "mean %.1f" % (len(totals),
+                         min(totals),
+                         max(totals),
+                         sum(totals)/len(totals)))
+
+def _stat_sizes(fnames, nthreads):
+    import multiprocessing.pool
+
+    pool=multiprocessing.pool.ThreadPool(nthreads)
+    try:
+        sizes=pool.map(_get_size, fnames, chunksize=64)
+    finally:
+        pool.close()
+        pool.join()
+
+    return dict(zip(fnames, sizes))
+
+def _get_size(fname):
+    try:
+        return os.path.getsize(fname)
+    except OSError:
+        return None
+
+def _median(vals):
+    vals=sorted(vals)
+    n=len(vals)
+    if n % 2 == 1:
+        return vals[n//2]
+    else:
+        return 0.5*(vals[n//2-1] + vals[n//2])
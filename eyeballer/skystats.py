@@ -0,0 +1,177 @@
+"""
+Robust sky statistics of the field, for choosing the display scaling
+
+EyeballMaker computes these as it prepares the field and writes them to
+the metadata extension, so previews and viewers can set the stretch of
+each ccd from the metadata alone, without another pass over the image.
+
+The statistics are made from a regular grid of about nsample pixels of
+the rebinned field, so the cost does not grow with the image size.
+Pixels with any bit set in the bpm, or that are not finite, are skipped.
+The sky level and noise are the median and the scaled median absolute
+deviation after iterative sigma clipping; the percentiles are of all
+the unmasked sampled pixels, so the upper ones include the stars
+
+    stats=get_sky_stats(field, bpm)
+    lut, xmin, xmax = jpegs.make_stats_lut(stats)
+"""
+from __future__ import print_function
+import numpy
+
+# pixels in the grid sample
+DEFAULT_NSAMPLE=40000
+
+# clipping for the sky median and noise
+DEFAULT_NSIGMA=3.0
+DEFAULT_NITER=5
+
+PERCENTILES=[1.0, 5.0, 50.0, 95.0, 99.0, 99.9]
+
+# sigma of a gaussian from the median absolute deviation
+MAD_TO_SIGMA=1.4826
+
+# value for statistics that could not be measured
+NULL_VALUE=-9999
+
+def get_sky_stats(field, bpm=None,
+                  nsample=DEFAULT_NSAMPLE,
+                  nsigma=DEFAULT_NSIGMA,
+                  niter=DEFAULT_NITER,
+                  percentiles=PERCENTILES):
+    """
+    measure the sky statistics on a grid sample of the field
+
+    parameters
+    ----------
+    field: 2-d array
+        The rebinned, background subtracted image
+    bpm: 2-d integer array, optional
+        The bpm, same shape as the field.  Pixels with any bit set
+        are skipped
+    nsample: integer, optional
+        Approximate number of pixels to sample, default DEFAULT_NSAMPLE
+    nsigma: float, optional
+        Clip at this many sigma from the median, default DEFAULT_NSIGMA
+    niter: integer, optional
+        Maximum clipping iterations, default DEFAULT_NITER.  0 for
+        the median and MAD of all the unmasked sample
+    percentiles: sequence, optional
+        Percentiles of the unmasked sample, default PERCENTILES
+
+    output
+    ------
+    dict with the columns of get_stats_dtype.  If no pixels are
+    unmasked, the statistics are NULL_VALUE
+    """
+    if bpm is not None and bpm.shape != field.shape:
+        raise ValueError("bpm shape %s does not match field "
+                         "shape %s" % (bpm.shape, field.shape))
+
+    sample=get_sample(field, nsample)
+    good=numpy.isfinite(sample)
+    if bpm is not None:
+        good &= get_sample(bpm, nsample) == 0
+
+    stats=dict([(name, NULL_VALUE) for name, dt in get_stats_dtype(percentiles)])
+    stats['stats_nsample']=sample.size
+    stats['masked_frac']=1.0 - numpy.count_nonzero(good)/float(sample.size)
+
+    x=sample[good].astype('f8')
+    if x.size==0:
+        return stats
+
+    pvals=numpy.percentile(x, percentiles)
+    for p, val in zip(percentiles, pvals):
+        stats[get_percentile_name(p)]=val
+
+    med=numpy.median(x)
+    dev=numpy.abs(x-med)
+    mad=numpy.median(dev)
+
+    for i in range(niter):
+        keep=dev <= nsigma*MAD_TO_SIGMA*mad
+        nkeep=numpy.count_nonzero(keep)
+        if nkeep==x.size or nkeep==0:
+            break
+
+        x=x[keep]
+        med=numpy.median(x)
+        dev=numpy.abs(x-med)
+        mad=numpy.median(dev)
+
+    stats['sky_median']=med
+    stats['sky_mad']=mad
+    stats['sky_sigma']=MAD_TO_SIGMA*mad
+    stats['sky_nclip']=x.size
+
+    return stats
+
+def get_sample(image, nsample=DEFAULT_NSAMPLE):
+    """
+    a view of image on a regular grid of about nsample pixels, offset
+    by half the grid spacing from the edges.  No data are copied
+    """
+    step=int(numpy.sqrt(image.size/float(max(nsample,1))))
+    if step <= 1:
+        return image
+
+    start=step//2
+    return image[start::step, start::step]
+
+def get_percentile_name(p):
+    """
+    the column name for a percentile, e.g. pct99 or pct99p9
+    """
+    return ('pct%g' % p).replace('.','p')
+
+def get_stats_dtype(percentiles=PERCENTILES):
+    """
+    dtype for the sky statistics columns of the metadata table
+    """
+    dt=[('sky_median','f4'),
+        ('sky_mad','f4'),
+        ('sky_sigma','f4'),
+        ('sky_nclip','i4')]
+    dt += [(get_percentile_name(p),'f4') for p in percentiles]
+    dt += [('masked_frac','f4'),
+           ('stats_nsample','i4')]
+    return dt
+
+def fill_meta(meta, stats):
+    """
+    copy the statistics into the metadata; if stats is None, e.g. they
+    were not measured, the columns are set to NULL_VALUE
+    """
+    for name, dt in get_stats_dtype():
+        if stats is None:
+            meta[name]=NULL_VALUE
+        else:
+            meta[name]=stats[name]
+
+def read_stats(meta):
+    """
+    get the sky statistics from a metadata table, or a dict from the
+    store
+
+    output
+    ------
+    dict, or None if the metadata has no statistics or they could not
+    be measured
+    """
+    if hasattr(meta, 'dtype'):
+        names=meta.dtype.names
+        get=lambda name: meta[name][0].item()
+    else:
+        names=meta.keys()
+        get=lambda name: meta[name]
+
+    if 'sky_sigma' not in names:
+        return None
+
+    stats=dict([(name, get(name)) for name, dt in get_stats_dtype()
+                if name in names])
+
+    if stats['sky_sigma']==NULL_VALUE:
+        return None
+
+    return stats
@@ -0,0 +1,1047 @@
+"""
+A per-run container for eyeball products, instead of one small file per ccd
+
+Worker processes append records to a shard file for their host in the
+store directory, taking turns by holding a lock on the shard while
+writing.  Next to each shard is a key file listing the key, offset and
+length of its records.  A record holds the rebinned field, bpm and any pyramid levels of one ccd, with its
+metadata and provenance, and is keyed by (expnum, ccdnum)
+
+    writer=StoreWriter(store_dir)
+    writer.write(expnum, ccdnum, arrays, meta=meta, provenance=prov)
+
+merge_store combines the shards, and any earlier merged container, into
+a single container with an index at the end.  The newest record for each
+key is kept.  Each shard is first renamed under its lock, so writers start
+a new shard and nothing is written to a shard while it is being merged;
+merging while workers are running is safe.  Reading a record from the
+merged container is one seek and one read
+
+    with EyeballStore(store_dir) as store:
+        rec=store.read(229686, 1)
+        field=rec['field']
+
+An EyeballStore also sees the records in shards that are not yet merged,
+found by reading through the shards when the store is opened, so merge
+after each batch of processing.  To look up a single record, e.g. to check
+whether a ccd is up to date, read_record_info reads only the key files and
+a binary search of the merged index.
+
+Each record is a fixed size header, then a JSON description, then the
+array data.  As for the .fz files, floating point arrays are quantized
+to a fraction 1/qlevel of the noise, and arrays of more than one byte per
+element are byte shuffled before zlib compression.  The header holds a
+crc32 of the rest of the record, so a record left incomplete by a crashed
+worker is detected and ignored.
+"""
+from __future__ import print_function
+import os
+import re
+import json
+import time
+import zlib
+import struct
+import socket
+
+import numpy
+
+try:
+    import fcntl
+except ImportError:
+    # no locking, e.g. on windows
+    fcntl=None
+
+STORE_EXT='.eyestore'
+MERGED_NAME='merged'+STORE_EXT
+SHARD_PREFIX='shard-'
+KEYS_EXT='.keys'
+
+# shards being merged are renamed to end with this plus STORE_EXT
+MERGING_TAG='.merging'
+
+# zlib level for the array data, 0 for none
+DEFAULT_COMPRESS_LEVEL=1
+
+# floating point arrays are quantized to noise/qlevel, as for the .fz
+# output; None for no quantization
+DEFAULT_QLEVEL=4.0
+
+# by default merge all shards; writers move on to a new shard when one is
+# taken for merging, so a minimum age only avoids merging tiny shards
+DEFAULT_MIN_AGE=0.0
+
+# times to try opening a store while shards are being merged
+_OPEN_ATTEMPTS=10
+
+# magic, expnum, ccdnum, json bytes, data bytes, crc32
+_record_header=struct.Struct('<8sqiiqI')
+_RECORD_MAGIC=b'EYEREC01'
+
+# magic, index offset, number of entries
+_index_trailer=struct.Struct('<8sqq')
+_INDEX_MAGIC=b'EYEINDEX'
+
+INDEX_DTYPE=[('expnum','<i8'),
+             ('ccdnum','<i4'),
+             ('offset','<i8'),
+             ('length','<i8')]
+
+# image names for finalcut and SVA1 style processing
+_image_name_patterns=[
+    re.compile(r'^D(\d{8})_\w+?_c(\d{2})_'),
+    re.compile(r'^DECam_(\d{8})_(\d{2})[._]'),
+]
+
+def get_key(item):
+    """
+    get (expnum, ccdnum) for an item with image_file, and optionally
+    expnum and ccdnum, which are used if present.  Otherwise they are
+    taken from the DESDM image file name
+    """
+    if 'expnum' in item and 'ccdnum' in item:
+        return int(item['expnum']), int(item['ccdnum'])
+
+    return parse_image_name(item['image_file'])
+
+def parse_image_name(image_file):
+    """
+    get (expnum, ccdnum) from a DESDM image file name
+    """
+    bname=os.path.basename(image_file)
+    for pattern in _image_name_patterns:
+        m=pattern.match(bname)
+        if m is not None:
+            return int(m.group(1)), int(m.group(2))
+
+    raise ValueError("could not get expnum and ccdnum "
+                     "from image name: %s" % image_file)
+
+def get_writer(store_dir, conf):
+    """
+    a StoreWriter with the compression from the run config: no
+    compression if compress is null, otherwise quantization at qlevel
+    """
+    if 'compress' in conf and conf['compress'] is None:
+        return StoreWriter(store_dir, compress_level=0, qlevel=None)
+
+    return StoreWriter(store_dir, qlevel=conf.get('qlevel',DEFAULT_QLEVEL))
+
+class StoreWriter(object):
+    def __init__(self, store_dir,
+                 compress_level=DEFAULT_COMPRESS_LEVEL,
+                 qlevel=DEFAULT_QLEVEL):
+        """
+        append records to the shard of the store for this host, holding
+        a lock on the shard while writing
+
+        parameters
+        ----------
+        store_dir: string
+            The store directory, created if needed
+        compress_level: integer, optional
+            zlib level, default DEFAULT_COMPRESS_LEVEL.  0 for none
+        qlevel: float, optional
+            Quantize floating point arrays to noise/qlevel, default
+            DEFAULT_QLEVEL.  None for lossless
+        """
+        self.store_dir=store_dir
+        self.compress_level=int(compress_level)
+        self.qlevel=qlevel
+
+        self.pid=None
+        self.fobj=None
+        self.keys_fobj=None
+
+    def get_shard_file(self):
+        """
+        the shard for this host; the processes on a host take turns
+        appending to it
+        """
+        name='%s%s%s' % (SHARD_PREFIX, socket.gethostname(), STORE_EXT)
+        return os.path.join(self.store_dir, name)
+
+    def write(self, expnum, ccdnum, arrays, meta=None, provenance=None):
+        """
+        append a record
+
+        parameters
+        ----------
+        expnum, ccdnum: integers
+            The key
+        arrays: dict
+            Arrays keyed by name, e.g. field and bpm_and_weight
+        meta: dict, optional
+            JSON serializable metadata
+        provenance: dict, optional
+            JSON serializable provenance, see provenance.get_record
+
+        output
+        ------
+        number of bytes written
+        """
+        data=encode_record(expnum, ccdnum, arrays,
+                           meta=meta,
+                           provenance=provenance,
+                           compress_level=self.compress_level,
+                           qlevel=self.qlevel)
+
+        fobj=self._lock_shard()
+        try:
+            fobj.seek(0, os.SEEK_END)
+
+            entry=numpy.zeros(1, dtype=INDEX_DTYPE)
+            entry['expnum']=expnum
+            entry['ccdnum']=ccdnum
+            entry['offset']=fobj.tell()
+            entry['length']=len(data)
+
+            fobj.write(data)
+            fobj.flush()
+
+            # the key is written once the record is complete
+            self.keys_fobj.write(entry.tobytes())
+            self.keys_fobj.flush()
+        finally:
+            _unlock(fobj)
+
+        return len(data)
+
+    def close(self):
+        if self.fobj is not None:
+            self.fobj.close()
+            self.fobj=None
+        if self.keys_fobj is not None:
+            self.keys_fobj.close()
+            self.keys_fobj=None
+
+    def _lock_shard(self):
+        """
+        lock the shard, starting a new one if it was taken for merging
+        while we waited.  The key file is opened under the lock, so it
+        always goes with the shard
+        """
+        while True:
+            fobj=self._get_fobj()
+            _lock(fobj)
+
+            if not _is_moved(fobj, self.get_shard_file()):
+                break
+
+            _unlock(fobj)
+            self.close()
+
+        if self.keys_fobj is None:
+            self.keys_fobj=open(self.get_shard_file()+KEYS_EXT, 'ab')
+
+        return fobj
+
+    def _get_fobj(self):
+        # a forked worker shares its parent's open file and so its lock;
+        # it must open the shard itself
+        if self.fobj is not None and self.pid != os.getpid():
+            self.fobj=None
+            self.keys_fobj=None
+
+        if self.fobj is None:
+            if not os.path.exists(self.store_dir):
+                try:
+                    os.makedirs(self.store_dir)
+                except OSError:
+                    # probably a race condition
+                    pass
+
+            self.pid=os.getpid()
+            self.fobj=open(self.get_shard_file(), 'ab')
+
+        return self.fobj
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+class EyeballStore(object):
+    def __init__(self, store_dir, shards=True):
+        """
+        read records from a store
+
+        parameters
+        ----------
+        store_dir: string
+            The store directory
+        shards: bool, optional
+            If True, also see records in shards that are not yet
+            merged, which take precedence.  Default True
+        """
+        self.store_dir=store_dir
+
+        # key -> (fname, offset, length)
+        self._entries={}
+        self._fobjs={}
+
+        for i in range(_OPEN_ATTEMPTS):
+            if self._open(shards):
+                break
+            self.close()
+        else:
+            raise IOError("shards of %s kept being merged while "
+                          "opening the store" % store_dir)
+
+    def get_keys(self):
+        """
+        sorted list of (expnum, ccdnum) in the store
+        """
+        return sorted(self._entries.keys())
+
+    def has(self, expnum, ccdnum):
+        return (int(expnum), int(ccdnum)) in self._entries
+
+    def read(self, expnum, ccdnum, names=None):
+        """
+        read a record
+
+        parameters
+        ----------
+        expnum, ccdnum: integers
+            The key
+        names: list of strings, optional
+            Only decode these arrays, default all
+
+        output
+        ------
+        dict with the arrays keyed by name, plus meta and provenance
+        """
+        data=self._read_raw(expnum, ccdnum)
+        return decode_record(data, names=names)
+
+    def read_info(self, expnum, ccdnum):
+        """
+        read the description of a record, without reading the arrays.
+        The checksum is not verified
+
+        output
+        ------
+        dict with meta, provenance, time and arrays, the latter a list
+        of dicts describing each array
+        """
+        fobj, offset, length = self._seek(expnum, ccdnum)
+
+        hdata=fobj.read(_record_header.size)
+        magic, expnum, ccdnum, njson, ndata, crc = _record_header.unpack(hdata)
+        if magic != _RECORD_MAGIC:
+            raise IOError("bad record magic for expnum %d ccdnum %d" % (expnum, ccdnum))
+
+        return json.loads(fobj.read(njson).decode('utf-8'))
+
+    def close(self):
+        for fobj in self._fobjs.values():
+            fobj.close()
+        self._fobjs={}
+
+    def _open(self, shards):
+        """
+        read the shards, then the merged container.  The shards are held
+        open, so the records of a shard opened here are seen even if a
+        merge then moves them.  If a listed shard is gone before it can
+        be opened, a merge took it, and its records may not be in the
+        merged container we would open, so this returns False and the
+        caller starts again
+        """
+        self._entries={}
+
+        if shards:
+            newest={}
+            for fname in find_shards(self.store_dir):
+                try:
+                    fobj=open(fname,'rb')
+                except (IOError, OSError):
+                    return False
+
+                self._fobjs[fname]=fobj
+                for key, offset, length, info in _scan_fobj(fobj, fname):
+                    if key in newest and newest[key] > info['time']:
+                        continue
+                    newest[key]=info['time']
+                    self._entries[key]=(fname, offset, length)
+
+        merged_file=get_merged_file(self.store_dir)
+        if os.path.exists(merged_file):
+            fobj=open(merged_file,'rb')
+            self._fobjs[merged_file]=fobj
+            for row in _read_index_fobj(fobj, merged_file):
+                key=(int(row['expnum']), int(row['ccdnum']))
+                if key not in self._entries:
+                    self._entries[key]=(merged_file, int(row['offset']), int(row['length']))
+
+        return True
+
+    def _read_raw(self, expnum, ccdnum):
+        fobj, offset, length = self._seek(expnum, ccdnum)
+
+        data=fobj.read(length)
+        if len(data) != length:
+            raise IOError("short read of record for expnum %d "
+                          "ccdnum %d" % (expnum, ccdnum))
+        return data
+
+    def _seek(self, expnum, ccdnum):
+        key=(int(expnum), int(ccdnum))
+        if key not in self._entries:
+            raise KeyError("no record for expnum %d ccdnum %d" % key)
+
+        fname, offset, length = self._entries[key]
+
+        fobj=self._fobjs.get(fname,None)
+        if fobj is None:
+            fobj=open(fname,'rb')
+            self._fobjs[fname]=fobj
+
+        fobj.seek(offset)
+        return fobj, offset, length
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.has(*key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __repr__(self):
+        return 'EyeballStore(%s, nrecords: %d)' % (self.store_dir, len(self))
+
+def check_item(store_dir, item, conf):
+    """
+    check whether the record for one item is up to date, reading only
+    that record; see read_record_info
+
+    parameters
+    ----------
+    store_dir: string
+        The store directory
+    item: dict
+        With image_file and bkg_file, and optionally expnum and ccdnum;
+        see get_key
+    conf: dict
+        The run config
+
+    output
+    ------
+    the reason the record is stale, or None if it is up to date
+    """
+    from . import provenance
+
+    try:
+        key=get_key(item)
+    except ValueError:
+        return provenance.REASON_MISSING
+
+    record=None
+    info=read_record_info(store_dir, *key)
+    if info is not None:
+        record=info['provenance']
+
+    return provenance.check_record(record,
+                                   item['image_file'],
+                                   item['bkg_file'],
+                                   conf)
+
+def find_stale(store_dir, items, conf):
+    """
+    find the items whose records are missing from the store or out of
+    date; the store version of provenance.find_stale
+
+    parameters
+    ----------
+    store_dir: string
+        The store directory
+    items: list of dicts
+        Each with image_file, bkg_file and output_file, and optionally
+        expnum and ccdnum; see get_key
+    conf: dict
+        The run config
+
+    output
+    ------
+    dict keyed by output file of the reason it is stale
+    """
+    from . import provenance
+
+    stale={}
+    with EyeballStore(store_dir) as st:
+        for item in items:
+            try:
+                key=get_key(item)
+            except ValueError:
+                # this will fail with a message when processed
+                stale[item['output_file']]=provenance.REASON_MISSING
+                continue
+
+            record=None
+            if st.has(*key):
+                record=st.read_info(*key)['provenance']
+
+            reason=provenance.check_record(record,
+                                           item['image_file'],
+                                           item['bkg_file'],
+                                           conf)
+            if reason is not None:
+                stale[item['output_file']]=reason
+
+    return stale
+
+def merge_store(store_dir, min_age=DEFAULT_MIN_AGE, remove=True):
+    """
+    merge the shards, and any earlier merged container, into a new
+    merged container with an index.  The newest record for each key
+    is kept.  The new container replaces the old one only once it is
+    complete
+
+    Each shard is renamed while holding its lock before it is read, so
+    writers finish the record they are writing and then start a new
+    shard.  Shards left renamed by an interrupted merge are merged too
+
+    parameters
+    ----------
+    store_dir: string
+        The store directory
+    min_age: float, optional
+        Only merge shards not modified in this many seconds.  Default
+        DEFAULT_MIN_AGE, all shards
+    remove: bool, optional
+        Remove the merged shards, default True
+
+    output
+    ------
+    the number of records in the merged container, and the shards merged
+    """
+    merged_file=get_merged_file(store_dir)
+
+    now=time.time()
+    shards=[]
+    fobjs={}
+    try:
+        for fname in find_shards(store_dir):
+            if MERGING_TAG not in os.path.basename(fname):
+                try:
+                    age=now-os.path.getmtime(fname)
+                except OSError:
+                    continue
+
+                if age < min_age:
+                    print("shard is newer than %g seconds, not merging: %s" % (min_age, fname))
+                    continue
+
+            fobj, mname = _take_shard(fname, now)
+            if fobj is not None:
+                fobjs[mname]=fobj
+                shards.append(mname)
+
+        # key -> (time, fname, offset, length); records in the merged
+        # container are older than any shard
+        entries={}
+        if os.path.exists(merged_file):
+            fobjs[merged_file]=open(merged_file,'rb')
+            for row in _read_index_fobj(fobjs[merged_file], merged_file):
+                key=(int(row['expnum']), int(row['ccdnum']))
+                entries[key]=(-1.0, merged_file, int(row['offset']), int(row['length']))
+
+        for fname in shards:
+            print("scanning shard:",fname)
+            for key, offset, length, info in _scan_fobj(fobjs[fname], fname):
+                old=entries.get(key,None)
+                if old is None or info['time'] >= old[0]:
+                    entries[key]=(info['time'], fname, offset, length)
+
+        keys=sorted(entries.keys())
+        index=numpy.zeros(len(keys), dtype=INDEX_DTYPE)
+
+        if not os.path.exists(store_dir):
+            print("making dir:",store_dir)
+            os.makedirs(store_dir)
+
+        tmpname=merged_file+'.tmp'
+        print("writing merged store:",merged_file)
+        with open(tmpname,'wb') as out:
+            for i, key in enumerate(keys):
+                tm, fname, offset, length = entries[key]
+
+                fobj=fobjs[fname]
+                fobj.seek(offset)
+                data=fobj.read(length)
+
+                index['expnum'][i]=key[0]
+                index['ccdnum'][i]=key[1]
+                index['offset'][i]=out.tell()
+                index['length'][i]=length
+                out.write(data)
+
+            index_offset=out.tell()
+            out.write(index.tobytes())
+            out.write(_index_trailer.pack(_INDEX_MAGIC, index_offset, index.size))
+
+            out.flush()
+            os.fsync(out.fileno())
+
+        os.rename(tmpname, merged_file)
+
+        # removed while still locked
+        if remove:
+            for fname in shards:
+                print("removing merged shard:",fname)
+                os.remove(fname)
+                if os.path.exists(fname+KEYS_EXT):
+                    os.remove(fname+KEYS_EXT)
+    finally:
+        for fobj in fobjs.values():
+            fobj.close()
+
+    return index.size, shards
+
+def get_merged_file(store_dir):
+    return os.path.join(store_dir, MERGED_NAME)
+
+def find_shards(store_dir):
+    """
+    the shard files in the store directory, sorted by name, including
+    those being merged
+    """
+    if not os.path.exists(store_dir):
+        return []
+
+    fnames=[os.path.join(store_dir, f) for f in os.listdir(store_dir)
+            if f.startswith(SHARD_PREFIX) and f.endswith(STORE_EXT)]
+    fnames.sort()
+    return fnames
+
+def read_index(fname):
+    """
+    read the index at the end of a merged container
+
+    output
+    ------
+    structured array with expnum, ccdnum, offset and length
+    """
+    with open(fname,'rb') as fobj:
+        return _read_index_fobj(fobj, fname)
+
+def scan_records(fname):
+    """
+    walk the records in a shard, checking each and decoding the JSON
+    descriptions.  Scanning stops at the first incomplete or corrupt
+    record
+
+    output
+    ------
+    list of ((expnum, ccdnum), offset, length, info), with info the
+    JSON description
+    """
+    with open(fname,'rb') as fobj:
+        return _scan_fobj(fobj, fname)
+
+def read_shard_keys(fname):
+    """
+    read the key file of a shard
+
+    output
+    ------
+    structured array with expnum, ccdnum, offset and length, in the
+    order the records were written, or None if the shard has no key file
+    """
+    keys_file=fname+KEYS_EXT
+    if not os.path.exists(keys_file):
+        return None
+
+    with open(keys_file,'rb') as fobj:
+        data=fobj.read()
+
+    # an entry may be partly written
+    dtype=numpy.dtype(INDEX_DTYPE)
+    return numpy.frombuffer(data, dtype=dtype, count=len(data)//dtype.itemsize)
+
+def read_record_info(store_dir, expnum, ccdnum):
+    """
+    read the description of the newest record for one key, without
+    opening the whole store.  The shards are searched with their key
+    files and the merged container with a binary search of its index,
+    so only records with this key are read.  The checksum is verified
+
+    output
+    ------
+    dict as for EyeballStore.read_info, or None if there is no record
+    """
+    key=(int(expnum), int(ccdnum))
+
+    # as for EyeballStore, start again if a merge took a shard
+    for i in range(_OPEN_ATTEMPTS):
+        try:
+            return _find_record_info(store_dir, key)
+        except _ShardGone:
+            pass
+
+    raise IOError("shards of %s kept being merged while "
+                  "reading" % store_dir)
+
+def encode_record(expnum, ccdnum, arrays, meta=None, provenance=None,
+                  compress_level=DEFAULT_COMPRESS_LEVEL,
+                  qlevel=DEFAULT_QLEVEL):
+    """
+    encode a record as bytes; see StoreWriter.write
+    """
+    descr=[]
+    chunks=[]
+    for name in sorted(arrays):
+        arr=numpy.ascontiguousarray(arrays[name])
+        dtype=arr.dtype.newbyteorder('<') if arr.dtype.byteorder=='>' else arr.dtype
+        arr=arr.astype(dtype, copy=False)
+
+        scale=None
+        if qlevel is not None and arr.dtype.kind=='f':
+            scale=get_quantize_scale(arr, qlevel)
+            if scale is not None:
+                fdtype=arr.dtype.str
+                arr=numpy.rint(arr/scale).astype('<i4')
+
+        shuffle = arr.dtype.itemsize > 1 and compress_level > 0
+        if shuffle:
+            buf=_shuffle(arr).tobytes()
+        else:
+            buf=arr.tobytes()
+
+        if compress_level > 0:
+            buf=zlib.compress(buf, compress_level)
+
+        d={'name':name,
+           'dtype':arr.dtype.str,
+           'shape':list(arr.shape),
+           'nbytes':len(buf),
+           'shuffle':shuffle,
+           'zlib':compress_level > 0}
+        if scale is not None:
+            d['scale']=scale
+            d['float_dtype']=fdtype
+
+        descr.append(d)
+        chunks.append(buf)
+
+    info={'time':time.time(),
+          'meta':meta or {},
+          'provenance':provenance,
+          'arrays':descr}
+
+    jdata=json.dumps(info).encode('utf-8')
+    body=jdata + b''.join(chunks)
+    ndata=len(body)-len(jdata)
+
+    header=_record_header.pack(_RECORD_MAGIC, int(expnum), int(ccdnum),
+                               len(jdata), ndata,
+                               zlib.crc32(body) & 0xffffffff)
+    return header + body
+
+def decode_record(data, names=None):
+    """
+    decode a record from bytes
+
+    parameters
+    ----------
+    data: bytes
+        The whole record
+    names: list of strings, optional
+        Only decode these arrays, default all.  Send [] for only the
+        description
+    """
+    magic, expnum, ccdnum, njson, ndata, crc = \
+            _record_header.unpack(data[:_record_header.size])
+    if magic != _RECORD_MAGIC:
+        raise IOError("bad record magic for expnum %d ccdnum %d" % (expnum, ccdnum))
+
+    body=data[_record_header.size:]
+    if zlib.crc32(body) & 0xffffffff != crc:
+        raise IOError("corrupt record for expnum %d ccdnum %d" % (expnum, ccdnum))
+
+    info=json.loads(body[:njson].decode('utf-8'))
+    if names is not None and len(names)==0:
+        return info
+
+    out={'expnum':expnum,
+         'ccdnum':ccdnum,
+         'meta':info['meta'],
+         'provenance':info['provenance']}
+
+    pos=njson
+    for d in info['arrays']:
+        buf=body[pos:pos+d['nbytes']]
+        pos += d['nbytes']
+
+        if names is not None and d['name'] not in names:
+            continue
+
+        if d['zlib']:
+            buf=zlib.decompress(buf)
+
+        dtype=numpy.dtype(d['dtype'])
+        shape=tuple(d['shape'])
+        if d['shuffle']:
+            arr=_unshuffle(buf, dtype, shape)
+        else:
+            arr=numpy.frombuffer(buf, dtype=dtype).reshape(shape)
+
+        if 'scale' in d:
+            arr=arr.astype(d['float_dtype'])
+            arr *= d['scale']
+
+        out[d['name']]=arr
+
+    return out
+
+def get_quantize_scale(arr, qlevel, nsample=10000):
+    """
+    the quantization step for an array, noise/qlevel, with the noise
+    from the median absolute difference of neighboring pixels in a
+    sample of rows.  None if the array has non-finite values or no
+    noise, in which case it is stored as is
+    """
+    if arr.size < 2 or not numpy.all(numpy.isfinite(arr)):
+        return None
+
+    if arr.ndim > 1:
+        flat=arr.reshape(arr.shape[0], -1)
+    else:
+        flat=arr.reshape(1, -1)
+
+    nrows, ncols = flat.shape
+    row_step=max(nrows//max(nsample//ncols, 1), 1)
+    sub=flat[::row_step, :].astype('f8')
+
+    diff=numpy.abs(sub[:, 1:] - sub[:, :-1])
+    if diff.size==0:
+        return None
+
+    sigma=1.4826*numpy.median(diff)/numpy.sqrt(2.0)
+    if sigma <= 0:
+        return None
+
+    scale=float(sigma/qlevel)
+
+    # values must fit in 32 bits
+    if numpy.abs(arr).max()/scale > 2.0**31-1:
+        return None
+
+    return scale
+
+def _shuffle(arr):
+    """
+    group the bytes of the elements by significance
+    """
+    return arr.view('u1').reshape(-1, arr.dtype.itemsize).T
+
+def _unshuffle(buf, dtype, shape):
+    b=numpy.frombuffer(buf, dtype='u1').reshape(dtype.itemsize, -1)
+    return numpy.ascontiguousarray(b.T).view(dtype).reshape(shape)
+
+def _lock(fobj):
+    if fcntl is not None:
+        fcntl.flock(fobj.fileno(), fcntl.LOCK_EX)
+
+def _unlock(fobj):
+    if fcntl is not None:
+        fcntl.flock(fobj.fileno(), fcntl.LOCK_UN)
+
+def _is_moved(fobj, fname):
+    """
+    True if fname is no longer the open file, e.g. it was renamed for
+    merging or removed
+    """
+    try:
+        st=os.stat(fname)
+    except OSError:
+        return True
+
+    fst=os.fstat(fobj.fileno())
+    return (st.st_dev, st.st_ino) != (fst.st_dev, fst.st_ino)
+
+def _take_shard(fname, stamp):
+    """
+    lock a shard and rename it for merging, with its key file
+
+    output
+    ------
+    the open, locked shard and its new name, or None, None if the shard
+    was taken by another merge
+    """
+    try:
+        fobj=open(fname,'rb')
+    except (IOError, OSError):
+        return None, None
+
+    _lock(fobj)
+    if _is_moved(fobj, fname):
+        fobj.close()
+        return None, None
+
+    if MERGING_TAG in os.path.basename(fname):
+        # left by an interrupted merge
+        return fobj, fname
+
+    mname='%s-%d-%d%s%s' % (fname[:-len(STORE_EXT)], os.getpid(), int(stamp),
+                            MERGING_TAG, STORE_EXT)
+    if os.path.exists(fname+KEYS_EXT):
+        os.rename(fname+KEYS_EXT, mname+KEYS_EXT)
+    os.rename(fname, mname)
+
+    return fobj, mname
+
+def _read_index_trailer(fobj, fname):
+    """
+    get the offset and number of entries of the index of a merged
+    container
+    """
+    fobj.seek(0, os.SEEK_END)
+    size=fobj.tell()
+    if size < _index_trailer.size:
+        raise IOError("store is too small to have an index: %s" % fname)
+
+    fobj.seek(size-_index_trailer.size)
+    magic, offset, nentries = _index_trailer.unpack(fobj.read(_index_trailer.size))
+    if magic != _INDEX_MAGIC:
+        raise IOError("no index found in store: %s" % fname)
+
+    return offset, nentries
+
+def _read_index_fobj(fobj, fname):
+    offset, nentries = _read_index_trailer(fobj, fname)
+
+    dtype=numpy.dtype(INDEX_DTYPE)
+    fobj.seek(offset)
+    data=fobj.read(nentries*dtype.itemsize)
+
+    return numpy.frombuffer(data, dtype=dtype, count=nentries)
+
+def _scan_fobj(fobj, fname):
+    records=[]
+
+    fobj.seek(0, os.SEEK_END)
+    size=fobj.tell()
+    offset=0
+
+    while offset < size:
+        fobj.seek(offset)
+        hdata=fobj.read(_record_header.size)
+        if len(hdata) < _record_header.size:
+            print("incomplete record at %d in %s" % (offset, fname))
+            break
+
+        magic, expnum, ccdnum, njson, ndata, crc = _record_header.unpack(hdata)
+        length=_record_header.size + njson + ndata
+        if magic != _RECORD_MAGIC or offset+length > size:
+            print("incomplete record at %d in %s" % (offset, fname))
+            break
+
+        body=fobj.read(njson+ndata)
+        if zlib.crc32(body) & 0xffffffff != crc:
+            print("corrupt record at %d in %s" % (offset, fname))
+            break
+
+        info=json.loads(body[:njson].decode('utf-8'))
+        records.append( ((expnum, ccdnum), offset, length, info) )
+        offset += length
+
+    return records
+
+def _read_checked_info(fobj, key, offset, length):
+    """
+    the description of the record for key at offset, or None if it is
+    incomplete, corrupt or for another key
+    """
+    fobj.seek(offset)
+    data=fobj.read(length)
+    if len(data) != length or length < _record_header.size:
+        return None
+
+    magic, expnum, ccdnum, njson, ndata, crc = \
+            _record_header.unpack(data[:_record_header.size])
+    if (expnum, ccdnum) != key:
+        return None
+
+    try:
+        return decode_record(data, names=[])
+    except (IOError, ValueError, struct.error):
+        return None
+
+class _ShardGone(Exception):
+    pass
+
+def _find_record_info(store_dir, key):
+    best=None
+    for fname in find_shards(store_dir):
+        try:
+            info=_find_in_shard(fname, key)
+        except (IOError, OSError):
+            raise _ShardGone(fname)
+
+        if info is not None and (best is None or info['time'] >= best['time']):
+            best=info
+
+    if best is not None:
+        return best
+
+    merged_file=get_merged_file(store_dir)
+    if not os.path.exists(merged_file):
+        return None
+
+    return _find_in_merged(merged_file, key)
+
+def _find_in_shard(fname, key):
+    """
+    the description of the last good record for key in a shard, or None
+    """
+    with open(fname,'rb') as fobj:
+        keys=read_shard_keys(fname)
+        if _is_moved(fobj, fname):
+            # the key file may be that of a new shard
+            raise IOError("shard was moved: %s" % fname)
+
+        if keys is None:
+            # written without a key file
+            infos=[info for rkey, offset, length, info in _scan_fobj(fobj, fname)
+                   if rkey==key]
+            return infos[-1] if infos else None
+
+        w,=numpy.where((keys['expnum']==key[0]) & (keys['ccdnum']==key[1]))
+        for i in w[::-1]:
+            info=_read_checked_info(fobj, key, int(keys['offset'][i]), int(keys['length'][i]))
+            if info is not None:
+                return info
+
+    return None
+
+def _find_in_merged(fname, key):
+    """
+    binary search of the index of a merged container, reading one
+    entry at each step
+    """
+    dtype=numpy.dtype(INDEX_DTYPE)
+
+    with open(fname,'rb') as fobj:
+        index_offset, nentries = _read_index_trailer(fobj, fname)
+
+        lo, hi = 0, nentries
+        while lo < hi:
+            mid=(lo+hi)//2
+            fobj.seek(index_offset + mid*dtype.itemsize)
+            row=numpy.frombuffer(fobj.read(dtype.itemsize), dtype=dtype)[0]
+
+            rkey=(int(row['expnum']), int(row['ccdnum']))
+            if rkey < key:
+                lo=mid+1
+            elif rkey > key:
+                hi=mid
+            else:
+                return _read_checked_info(fobj, key, int(row['offset']), int(row['length']))
+
+    return None
@@ -0,0 +1,211 @@
+"""
+Synthetic DECam single epoch inputs for benchmarks
+
+The images have the size and types of the DESDM immasked files: a float
+sci image, an int16 msk bitmask and a float wgt weight map, plus a
+background file with a sci extension.  The content is a smooth sky with
+noise, stars, cosmic rays and bad columns, with the mask bits and
+weights set the way the pipeline sets them, so the data compress and
+rebin like the real thing.
+
+    pairs=write_decam_inputs(dir, nccd=4, seed=35)
+    for image_file, bkg_file in pairs:
+        ...
+"""
+from __future__ import print_function
+import os
+import numpy
+
+# DECam ccd dimensions
+CCD_NROWS=4096
+CCD_NCOLS=2048
+
+# some of the DESDM mask bits
+BADPIX_BPM=1
+BADPIX_SATURATE=2
+BADPIX_INTERP=4
+BADPIX_CRAY=16
+BADPIX_EDGE=512
+BADPIX_SUSPECT=2048
+
+SKY=1000.0
+GAIN=4.0
+SATURATION=40000.0
+
+EDGE_PIX=15
+
+def write_decam_inputs(dir,
+                       nccd=1,
+                       nrows=CCD_NROWS,
+                       ncols=CCD_NCOLS,
+                       seed=None,
+                       compress=False,
+                       expnum=229686,
+                       band='r'):
+    """
+    write synthetic image and background files
+
+    parameters
+    ----------
+    dir: string
+        Where to write the files
+    nccd: integer, optional
+        Number of ccds, default 1
+    nrows, ncols: integers, optional
+        Image dimensions, default is a DECam ccd
+    seed: integer, optional
+        Seed for the random number generator
+    compress: bool, optional
+        If True write tile compressed .fits.fz files as DESDM does
+    expnum: integer, optional
+        Exposure number used in the file names
+    band: string, optional
+        Band used in the file names
+
+    output
+    ------
+    list of (image_file, bkg_file)
+    """
+    import fitsio
+
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+
+    rng=numpy.random.RandomState(seed)
+
+    ext='.fits.fz' if compress else '.fits'
+    ckeys={'compress':'rice'} if compress else {}
+
+    pairs=[]
+    for ccdnum in range(1, nccd+1):
+        front='D%08d_%s_c%02d_r2358p01' % (expnum, band, ccdnum)
+        image_file=os.path.join(dir, front+'_immasked'+ext)
+        bkg_file=os.path.join(dir, front+'_bkg'+ext)
+
+        data=make_decam_image(rng, nrows=nrows, ncols=ncols)
+
+        # DESDM files carry checksums
+        with fitsio.FITS(image_file,'rw',clobber=True) as fits:
+            fits.write(data['sci'], extname='sci', **ckeys)
+            fits.write(data['msk'], extname='msk', **ckeys)
+            fits.write(data['wgt'], extname='wgt', **ckeys)
+            for hdu in fits:
+                hdu.write_checksum()
+
+        with fitsio.FITS(bkg_file,'rw',clobber=True) as fits:
+            fits.write(data['bkg'], extname='sci', **ckeys)
+            for hdu in fits:
+                hdu.write_checksum()
+
+        pairs.append( (image_file, bkg_file) )
+
+    return pairs
+
+def make_decam_image(rng, nrows=CCD_NROWS, ncols=CCD_NCOLS,
+                     nstars=2000, ncray=300, nbadcol=3):
+    """
+    make the sci, msk, wgt and bkg arrays for one ccd
+
+    parameters
+    ----------
+    rng: numpy.random.RandomState
+    nrows, ncols: integers, optional
+        Image dimensions, default is a DECam ccd
+    nstars: integer, optional
+        Number of stars; the brightest saturate
+    ncray: integer, optional
+        Number of cosmic rays
+    nbadcol: integer, optional
+        Number of bad columns
+
+    output
+    ------
+    dict with sci, msk, wgt and bkg
+    """
+    bkg=make_background(rng, nrows, ncols)
+
+    sci=bkg + rng.normal(scale=numpy.sqrt(SKY/GAIN), size=(nrows,ncols)).astype('f4')
+    msk=numpy.zeros( (nrows,ncols), dtype='i2')
+    wgt=numpy.zeros( (nrows,ncols), dtype='f4')
+    wgt[:,:] = GAIN/SKY
+
+    _add_stars(rng, sci, nstars)
+
+    w=numpy.where(sci > SATURATION)
+    msk[w] |= BADPIX_SATURATE|BADPIX_INTERP
+    sci[w] = SATURATION
+
+    _add_cosmic_rays(rng, msk, ncray)
+
+    cols=rng.randint(EDGE_PIX, ncols-EDGE_PIX, size=nbadcol)
+    msk[:,cols] |= BADPIX_BPM
+    wgt[:,cols] = 0.0
+
+    # a few suspect regions with low weight
+    nsuspect=max(nrows//1000,1)
+    for i in range(nsuspect):
+        row=rng.randint(0, nrows-50)
+        col=rng.randint(0, ncols-50)
+        msk[row:row+50, col:col+50] |= BADPIX_SUSPECT
+        wgt[row:row+50, col:col+50] *= 0.01
+
+    msk[:EDGE_PIX,:] |= BADPIX_EDGE
+    msk[-EDGE_PIX:,:] |= BADPIX_EDGE
+    msk[:,:EDGE_PIX] |= BADPIX_EDGE
+    msk[:,-EDGE_PIX:] |= BADPIX_EDGE
+
+    return {'sci':sci, 'msk':msk, 'wgt':wgt, 'bkg':bkg}
+
+def make_background(rng, nrows, ncols):
+    """
+    a sky level with a smooth gradient across the ccd
+    """
+    rows=numpy.linspace(-1.0, 1.0, nrows, dtype='f4')
+    cols=numpy.linspace(-1.0, 1.0, ncols, dtype='f4')
+
+    grad=rng.uniform(-0.02, 0.02, size=3)*SKY
+    bkg = SKY + grad[0]*rows[:,numpy.newaxis] + grad[1]*cols[numpy.newaxis,:]
+    bkg += grad[2]*(rows[:,numpy.newaxis]*cols[numpy.newaxis,:])
+    return bkg.astype('f4')
+
+def _add_stars(rng, sci, nstars, fwhm=4.0):
+    """
+    add gaussian stars with a power law flux distribution
+    """
+    nrows, ncols = sci.shape
+    sigma=fwhm/2.35
+    rad=int(4*sigma)+1
+
+    # dN/dF ~ F^-2, the brightest saturate
+    flux=100.0/rng.uniform(0.0001, 1.0, size=nstars)
+    rows=rng.uniform(rad, nrows-rad-1, size=nstars)
+    cols=rng.uniform(rad, ncols-rad-1, size=nstars)
+
+    off=numpy.arange(-rad, rad+1, dtype='f4')
+    for f, row, col in zip(flux, rows, cols):
+        irow, icol = int(row), int(col)
+        dr=off + (irow-row)
+        dc=off + (icol-col)
+        stamp=numpy.exp(-0.5*(dr[:,numpy.newaxis]**2
+                              + dc[numpy.newaxis,:]**2)/sigma**2)
+        stamp *= f/(2*numpy.pi*sigma**2)
+        sci[irow-rad:irow+rad+1, icol-rad:icol+rad+1] += stamp
+
+def _add_cosmic_rays(rng, msk, ncray):
+    """
+    flag short cosmic ray tracks.  The pipeline interpolates over them,
+    so only the mask shows them
+    """
+    nrows, ncols = msk.shape
+    maxlen=20
+
+    for i in range(ncray):
+        n=rng.randint(1, maxlen)
+        row=rng.randint(maxlen, nrows-maxlen)
+        col=rng.randint(maxlen, ncols-maxlen)
+        drow, dcol = rng.randint(-1, 2, size=2)
+
+        rows=row + drow*numpy.arange(n)
+        cols=col + dcol*numpy.arange(n)
+
+        msk[rows, cols] |= BADPIX_CRAY|BADPIX_INTERP
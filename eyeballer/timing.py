@@ -0,0 +1,327 @@
+"""
+Per-stage timing and memory instrumentation
+
+A StageTimer records wall time, cpu time and the peak resident memory
+of each named stage.  Hooks can be added to get a callback as each stage
+finishes, e.g. for logging or an external profiler.
+
+The peak memory of a stage is the process high-water mark.  This is
+shared by all the threads of the process, so it is only reset at the
+start of each stage, by writing to /proc/self/clear_refs on linux, when
+the timer is made with owns_process=True; do that only when nothing else
+runs in the process while the stages run, e.g. in a batch worker.
+Otherwise, as in the threads of the pipeline, or where the reset is not
+allowed, the high-water mark is cumulative: it includes earlier stages,
+in pooled workers earlier ccds, and anything run in other threads.  The
+maxrss_per_stage metadata column says which was recorded.
+
+    timer=StageTimer()
+    timer.add_hook(my_hook)
+
+    with timer.stage('load'):
+        ...
+
+The records can be converted to columns for the metadata extension
+with get_meta_dtype and fill_meta.
+"""
+from __future__ import print_function
+import sys
+import time
+import socket
+
+try:
+    import resource
+except ImportError:
+    resource=None
+
+STAGES=['load','prepare_image','prepare_bpm','sky_stats','prepare_pyramid','write']
+
+class StageTimer(object):
+    def __init__(self, stages=STAGES, verbose=True, owns_process=False):
+        """
+        parameters
+        ----------
+        stages: list of strings, optional
+            The stages stored in the metadata, default STAGES.  Other
+            stage names are timed but not stored
+        verbose: bool, optional
+            If True, print the timing as each stage finishes
+        owns_process: bool, optional
+            If True, nothing else runs in the process while the stages
+            run, so the peak memory is reset at the start of each stage.
+            Default False, in which case the peak is cumulative
+        """
+        self.stages=list(stages)
+        self.verbose=verbose
+        self.owns_process=owns_process
+
+        self.records={}
+        self.hooks=[]
+
+        # False if the peak is not reset, or any stage could not reset it
+        self.maxrss_per_stage=owns_process
+
+    def add_hook(self, hook):
+        """
+        add a function to be called as hook(name, record) when a stage
+        finishes.  The record is a dict with wall, cpu and maxrss_mb
+        """
+        self.hooks.append(hook)
+
+    def stage(self, name):
+        """
+        get a context manager that times the named stage
+        """
+        return _StageContext(self, name)
+
+    def record(self, name, wall, cpu, maxrss_mb):
+        """
+        record the result for a stage and call the hooks
+        """
+        rec={'wall':wall,
+             'cpu':cpu,
+             'maxrss_mb':maxrss_mb}
+
+        self.records[name]=rec
+
+        if self.verbose:
+            print('stage %s: wall %.3f s cpu %.3f s '
+                  'maxrss %.1f MB' % (name, wall, cpu, maxrss_mb))
+
+        for hook in self.hooks:
+            hook(name, rec)
+
+    def get_meta_dtype(self):
+        """
+        dtype for the timing columns of the metadata table
+        """
+        dt=[('host','S%d' % max(len(get_hostname()),1)),
+            ('maxrss_per_stage','i2')]
+        for name in self.stages:
+            dt += [('%s_wall' % name, 'f4'),
+                   ('%s_cpu' % name, 'f4'),
+                   ('%s_maxrss_mb' % name, 'f4')]
+        return dt
+
+    def fill_meta(self, meta):
+        """
+        copy the records into the metadata; stages not yet
+        run are set to -9999
+        """
+        meta['host']=get_hostname()
+        meta['maxrss_per_stage']=int(self.maxrss_per_stage)
+        for name in self.stages:
+            rec=self.records.get(name,None)
+            for key in ['wall','cpu','maxrss_mb']:
+                col='%s_%s' % (name, key)
+                if rec is None:
+                    meta[col]=-9999
+                else:
+                    meta[col]=rec[key]
+
+class _StageContext(object):
+    def __init__(self, timer, name):
+        self.timer=timer
+        self.name=name
+
+    def __enter__(self):
+        if self.timer.owns_process and not reset_maxrss():
+            self.timer.maxrss_per_stage=False
+        self.wall0=time.time()
+        self.cpu0=get_cpu_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        wall=time.time()-self.wall0
+        cpu=get_cpu_time()-self.cpu0
+        self.timer.record(self.name, wall, cpu, get_maxrss_mb())
+        return False
+
+def get_cpu_time():
+    """
+    user plus system cpu time for this process
+    """
+    if resource is None:
+        return time.time()
+
+    r=resource.getrusage(resource.RUSAGE_SELF)
+    return r.ru_utime + r.ru_stime
+
+def reset_maxrss():
+    """
+    reset the peak resident memory reported by get_maxrss_mb to the
+    current resident memory.  Only possible on linux
+
+    output
+    ------
+    True if reset
+    """
+    try:
+        with open('/proc/self/clear_refs','w') as fobj:
+            fobj.write('5')
+    except (IOError, OSError):
+        return False
+
+    return True
+
+def get_maxrss_mb():
+    """
+    peak resident memory of this process in MB, or -1 if not available.
+    This is the peak since the last reset_maxrss, if any
+
+    On linux this is read from /proc, because ru_maxrss is carried over
+    from the parent process when a new program is started, and so can
+    report the parent's peak
+    """
+    hwm=_get_proc_hwm_mb()
+    if hwm is not None:
+        return hwm
+
+    if resource is None:
+        return -1.0
+
+    maxrss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform=='darwin':
+        # bytes on OS X, kilobytes elsewhere
+        return maxrss/1024.0**2
+    else:
+        return maxrss/1024.0
+
+def _get_proc_hwm_mb():
+    try:
+        with open('/proc/self/status') as fobj:
+            for line in fobj:
+                if line.startswith('VmHWM:'):
+                    return float(line.split()[1])/1024.0
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+def get_hostname():
+    return socket.gethostname()
+
+def read_timing(fnames):
+    """
+    read the timing columns from the metadata of many eyeball files
+
+    parameters
+    ----------
+    fnames: list of strings
+        The eyeball files
+
+    output
+    ------
+    structured array with filename, host, maxrss_per_stage and the
+    timing columns.  Files without timing information are skipped
+    """
+    import numpy
+    import fitsio
+
+    cols=[]
+    for name in STAGES:
+        cols += ['%s_wall' % name, '%s_cpu' % name, '%s_maxrss_mb' % name]
+
+    flen=max([len(f) for f in fnames] + [1])
+    dt=[('filename','S%d' % flen), ('host','S64'), ('maxrss_per_stage','i2')]
+    dt += [(c,'f4') for c in cols]
+
+    data=numpy.zeros(len(fnames), dtype=dt)
+
+    keep=numpy.zeros(len(fnames), dtype=bool)
+    for i,fname in enumerate(fnames):
+        meta=fitsio.read(fname, ext='metadata')
+        if 'host' not in meta.dtype.names:
+            print("no timing information in:",fname)
+            continue
+
+        data['filename'][i]=fname
+        data['host'][i]=meta['host'][0]
+        if 'maxrss_per_stage' in meta.dtype.names:
+            data['maxrss_per_stage'][i]=meta['maxrss_per_stage'][0]
+        for c in cols:
+            if c in meta.dtype.names:
+                data[c][i]=meta[c][0]
+            else:
+                # made before the stage was recorded
+                data[c][i]=-9999
+        keep[i]=True
+
+    return data[keep]
+
+def print_report(data, nslow=10):
+    """
+    print a hot-spot report for timing data from read_timing
+
+    The summary gives the median, 90th percentile and max of each stage
+    over all files, the share of the total wall time and the largest
+    peak memory of the stage; stages are
+    then broken down by host, and the slowest files are listed
+    """
+    import numpy
+
+    if data.size == 0:
+        print("no timing data")
+        return
+
+    total=numpy.zeros(data.size)
+    for name in STAGES:
+        total += data['%s_wall' % name].clip(min=0)
+
+    grand_total=total.sum()
+
+    print("%d files, total wall time %.1f s" % (data.size, grand_total))
+    print()
+    print('%-14s %10s %10s %10s %10s %8s %10s' % ('stage','median','p90','max',
+                                                   'cpu/wall','share','maxrss'))
+    for name in STAGES:
+        wall=data['%s_wall' % name].clip(min=0)
+        cpu=data['%s_cpu' % name].clip(min=0)
+        rss=data['%s_maxrss_mb' % name]
+
+        wsum=wall.sum()
+        if wsum > 0:
+            cpufrac=cpu.sum()/wsum
+        else:
+            cpufrac=0.0
+
+        if grand_total > 0:
+            share=wsum/grand_total
+        else:
+            share=0.0
+
+        print('%-14s %10.3f %10.3f %10.3f %10.2f %7.1f%% %10.1f' % (name,
+                                                       numpy.median(wall),
+                                                       numpy.percentile(wall, 90),
+                                                       wall.max(),
+                                                       cpufrac,
+                                                       100*share,
+                                                       rss.max()))
+
+    ncumulative=(data['maxrss_per_stage']==0).sum()
+    if ncumulative > 0:
+        print("maxrss is the cumulative process peak, not the stage "
+              "peak, for %d/%d files" % (ncumulative, data.size))
+
+    print()
+    print("median wall time per stage by host")
+    print('%-20s %6s' % ('host','nfiles') + ''.join(['%14s' % n for n in STAGES]))
+    for host in numpy.unique(data['host']):
+        w,=numpy.where(data['host']==host)
+        line='%-20s %6d' % (_to_str(host), w.size)
+        for name in STAGES:
+            line += '%14.3f' % numpy.median(data['%s_wall' % name][w])
+        print(line)
+
+    print()
+    print("slowest %d files" % min(nslow, data.size))
+    s=total.argsort()[::-1][0:nslow]
+    for i in s:
+        print('%10.3f %-20s %s' % (total[i],
+                                   _to_str(data['host'][i]),
+                                   _to_str(data['filename'][i])))
+
+def _to_str(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
@@ -4,7 +4,15 @@ from distutils.core import setup
 
 scripts=['make-se-eyeball',
          'make-eyeball-scripts',
-         'make-eyeball-db']
+         'make-eyeball-db',
+         'eyeball-bench',
+         'eyeball-timing-report',
+         'make-se-cutouts',
+         'make-eyeball-focalplane',
+         'make-eyeball-path-index',
+         'make-eyeball-previews',
+         'make-eyeball-store',
+         'eyeball-qa-server']
 scripts=[os.path.join('bin',s) for s in scripts]
 
 config_files=glob.glob('config/*.yaml')
@@ -18,7 +26,7 @@ for f in config_files:
 
 
 setup(name="eyeballer", 
-      version="0.1.0",
+      version="0.1.3",
       description="Python code to make cutouts for eyeballing",
       license = "GPL",
       author="Erin Scott Sheldon",
@@ -0,0 +1,48 @@
+from eyeballer import qa, assign
+
+def _make_db(tmp_path, nfiles):
+    conn=qa.connect(str(tmp_path / 'assign.db'))
+    conn.execute('create table files (field text)')
+    conn.executemany('insert into files (field) values (?)',
+                     [('file%d' % i,) for i in range(nfiles)])
+    conn.commit()
+
+    qa.make_qa_table(conn)
+    assign.make_queue_table(conn)
+    assign.sync_queue(conn)
+    return conn
+
+def test_least_reviewed_and_not_seen(tmp_path):
+    conn=_make_db(tmp_path, 10)
+
+    # all but file 7 have a review; user 1 reviewed file 3 only
+    qa.upsert_scores(conn, [{'userid':2, 'fileid':i, 'score':1}
+                            for i in range(1, 11) if i != 7])
+    assert assign.get_next(conn, 1, now=100.0)==7
+
+    # file 7 is leased to user 1, so user 3 gets another
+    fileid=assign.get_next(conn, 3, now=100.0)
+    assert fileid not in (7, None)
+
+    # user 1 asking again gets the same file
+    assert assign.get_next(conn, 1, now=100.0)==7
+
+    qa.upsert_scores(conn, [{'userid':1, 'fileid':7, 'score':1}])
+    fileid=assign.get_next(conn, 1, now=100.0)
+    assert fileid not in (7, None)
+
+def test_expired_lease(tmp_path):
+    conn=_make_db(tmp_path, 1)
+
+    assert assign.get_next(conn, 1, lease_time=10.0, now=100.0)==1
+    assert assign.get_next(conn, 2, now=105.0) is None
+    assert assign.get_next(conn, 2, now=111.0)==1
+
+def test_all_seen(tmp_path):
+    conn=_make_db(tmp_path, 5)
+    qa.upsert_scores(conn, [{'userid':1, 'fileid':i, 'score':1}
+                            for i in range(1, 6)])
+    assert assign.get_next(conn, 1, now=100.0) is None
+    assert assign.get_next(conn, 1, now=100.0, max_reviews=1) is None
+    assert assign.get_next(conn, 2, now=100.0, max_reviews=1) is None
+    assert assign.get_next(conn, 2, now=100.0) is not None
@@ -0,0 +1,75 @@
+from __future__ import print_function
+import os
+import pytest
+
+from eyeballer import batch
+
+def test_read_manifest(tmp_path):
+    fname=str(tmp_path / 'manifest.txt')
+    with open(fname,'w') as fobj:
+        fobj.write('# a comment\n'
+                   '\n'
+                   'im1.fits bkg1.fits out1-eyeball.fits.fz\n'
+                   'echo starting\n'
+                   './master.sh im2.fits bkg2.fits out2-eyeball.fits.fz &> log2\n'
+                   '  im3.fits   bkg3.fits\tout3-eyeball.fits.fz  \n')
+
+    items=batch.read_manifest(fname)
+    assert items==[
+        {'image_file':'im%d.fits' % i,
+         'bkg_file':'bkg%d.fits' % i,
+         'output_file':'out%d-eyeball.fits.fz' % i}
+        for i in [1,2,3]
+    ]
+
+    with open(fname,'w') as fobj:
+        fobj.write('im1.fits bkg1.fits\n')
+    with pytest.raises(ValueError):
+        batch.read_manifest(fname)
+
+def test_run_batch(tmp_path):
+    pytest.importorskip('fitsio')
+    from eyeballer import synthetic
+
+    pairs=synthetic.write_decam_inputs(str(tmp_path / 'input'), nccd=2,
+                                       nrows=128, ncols=64, seed=6)
+    pairs.append( (str(tmp_path / 'missing.fits'), pairs[0][1]) )
+
+    manifest=str(tmp_path / 'manifest.txt')
+    with open(manifest,'w') as fobj:
+        for i, (image_file, bkg_file) in enumerate(pairs):
+            output_file=str(tmp_path / 'out' / ('out%d-eyeball.fits.fz' % i))
+            fobj.write('%s %s %s\n' % (image_file, bkg_file, output_file))
+
+    items=batch.read_manifest(manifest)
+    conf={'rebin':4}
+
+    results=batch.run_batch(conf, items, nproc=1)
+    assert [r['output_file'] for r in results]==[i['output_file'] for i in items]
+    assert [r['status'] for r in results]==[batch.STATUS_OK, batch.STATUS_OK,
+                                            batch.STATUS_FAILED]
+    assert results[2]['message'] != ''
+    assert os.path.exists(items[0]['output_file'])
+    assert os.path.exists(items[1]['output_file'])
+    assert not os.path.exists(items[2]['output_file'])
+
+    # the outputs are now up to date
+    results=batch.run_batch(conf, items[0:2], nproc=1)
+    assert [r['status'] for r in results]==[batch.STATUS_SKIPPED]*2
+
+    # unless clobbered, or the config changes
+    results=batch.run_batch(conf, items[0:1], nproc=1, clobber=True)
+    assert results[0]['status']==batch.STATUS_OK
+    results=batch.run_batch({'rebin':8}, items[0:1], nproc=1)
+    assert results[0]['status']==batch.STATUS_OK
+
+    assert batch.count_status(results)=={batch.STATUS_OK:1,
+                                         batch.STATUS_SKIPPED:0,
+                                         batch.STATUS_FAILED:0}
+
+    summary=str(tmp_path / 'summary.txt')
+    batch.write_summary(summary, results)
+    with open(summary) as fobj:
+        lines=fobj.read().split('\n')
+    assert lines[0].split()[0]==batch.STATUS_OK
+    assert lines[0].split()[2]==items[0]['output_file']
@@ -0,0 +1,126 @@
+from __future__ import print_function
+import os
+import numpy
+import pytest
+
+pytest.importorskip('fitsio')
+
+from eyeballer import cutouts
+from eyeballer import provenance
+from eyeballer import synthetic
+
+def _make_maker(dir):
+    image_file, bkg_file = synthetic.write_decam_inputs(dir, nrows=256, ncols=128,
+                                                        seed=5, compress=True)[0]
+    return cutouts.EyeballMaker({'rebin':4}, image_file, bkg_file)
+
+def test_write_fits_replaces_complete_file(tmp_path, monkeypatch):
+    maker=_make_maker(str(tmp_path))
+    fitsfile=str(tmp_path / 'out-eyeball.fits.fz')
+
+    maker.write_fits(fitsfile)
+    assert os.listdir(str(tmp_path)).count('out-eyeball.fits.fz')==1
+    assert not os.path.exists(fitsfile+'.tmp')
+
+    with open(fitsfile,'rb') as fobj:
+        data=fobj.read()
+
+    def fail(fits):
+        raise IOError("disk full")
+    monkeypatch.setattr(provenance, 'write_checksums', fail)
+
+    # a failed write leaves the earlier file as it was, and no partial file
+    with pytest.raises(IOError):
+        maker.write_fits(fitsfile)
+
+    assert not os.path.exists(fitsfile+'.tmp')
+    with open(fitsfile,'rb') as fobj:
+        assert fobj.read()==data
+
+def test_pyramid_levels_crop_like_main_level(tmp_path):
+    from numpy import flipud
+    from numpy.testing import assert_allclose
+    from eyeballer.rebin import rebin_image
+
+    # not divisible by the levels, so each rebin crops
+    image_file, bkg_file = synthetic.write_decam_inputs(str(tmp_path), nrows=250,
+                                                        ncols=134, seed=2)[0]
+    conf={'rebin':4, 'pyramid':[1,4,8,16]}
+    maker=cutouts.EyeballMaker(conf, image_file, bkg_file)
+    raw=maker.image_obj.image.copy()
+
+    prepared=maker.prepare()
+    assert_allclose(prepared['field'], flipud(rebin_image(raw,4)).transpose(),
+                    rtol=1.0e-5)
+
+    levels=prepared['levels']
+    assert [l[0] for l in levels]==[1,8,16]
+    for level, field, bpm in levels:
+        expected=flipud(rebin_image(raw,level)).transpose() if level > 1 \
+                else flipud(raw).transpose()
+        assert bpm.shape==field.shape
+        assert_allclose(field, expected, rtol=1.0e-5, atol=1.0e-5)
+
+@pytest.mark.parametrize('low_weight', [None, 0.1*synthetic.GAIN/synthetic.SKY])
+def test_stream_matches_full_read(tmp_path, low_weight):
+    from numpy.testing import assert_array_equal
+
+    # the width is not divisible by the rebin, nor the strip by the rebin
+    image_file, bkg_file = synthetic.write_decam_inputs(str(tmp_path), nrows=1000,
+                                                        ncols=530, seed=8)[0]
+    conf={'rebin':4, 'low_weight':low_weight}
+
+    full=cutouts.EyeballMaker(conf, image_file, bkg_file).prepare()
+
+    sconf=dict(conf, stream=True, strip_rows=98)
+    streamed=cutouts.EyeballMaker(sconf, image_file, bkg_file).prepare()
+
+    assert_array_equal(streamed['field'], full['field'])
+    assert_array_equal(streamed['bpm'], full['bpm'])
+    if low_weight is not None:
+        assert (full['bpm'].view('u2') & cutouts.WEIGHT_FLAG).any()
+
+def _naive_stamp(image, row, col, size, fill):
+    stamp=numpy.zeros((size,size), dtype=image.dtype) + fill
+    row0=int(round(row)) - size//2
+    col0=int(round(col)) - size//2
+    for i in range(size):
+        for j in range(size):
+            r, c = row0+i, col0+j
+            if 0 <= r < image.shape[0] and 0 <= c < image.shape[1]:
+                stamp[i,j]=image[r,c]
+    return stamp
+
+@pytest.mark.parametrize('size', [5, 6])
+def test_extract_stamps_matches_loop(size):
+    image=numpy.arange(20*15, dtype='f4').reshape(20,15)
+
+    # interior, near and on each edge and corner, and entirely off the image
+    rows=numpy.array([10.2, 0.0, 19.0, 1.4, 18.6, 10.0, 10.0, 0.0, 19.0, -10.0])
+    cols=numpy.array([7.0, 7.0, 7.0, 0.0, 14.0, 1.6, 13.4, 0.0, 14.0, 7.0])
+
+    stamps=cutouts.extract_stamps(image, rows, cols, size, fill=-1)
+    assert stamps.shape==(rows.size, size, size)
+    for i in range(rows.size):
+        expected=_naive_stamp(image, rows[i], cols[i], size, -1)
+        numpy.testing.assert_array_equal(stamps[i], expected)
+
+    assert (stamps[-1]==-1).all()
+
+@pytest.mark.parametrize('nstamp', [1, 4, 7])
+def test_make_mosaic(nstamp):
+    size, padding = 3, 2
+    stamps=numpy.arange(nstamp*size*size, dtype='i4').reshape(nstamp,size,size)+1
+
+    mosaic=cutouts.make_mosaic(stamps, padding=padding, fill=-5)
+
+    nside=int(numpy.ceil(numpy.sqrt(nstamp)))
+    npix=nside*(size+padding)-padding
+    assert mosaic.shape==(npix, npix)
+
+    expected=numpy.zeros((npix,npix), dtype='i4') - 5
+    for i in range(nstamp):
+        row0=(i//nside)*(size+padding)
+        col0=(i%nside)*(size+padding)
+        expected[row0:row0+size, col0:col0+size]=stamps[i]
+    numpy.testing.assert_array_equal(mosaic, expected)
@@ -0,0 +1,73 @@
+import pytest
+
+from eyeballer import files
+
+def _write(tmp_path, text):
+    fname=str(tmp_path / 'list.dat')
+    with open(fname,'w') as fobj:
+        fobj.write(text)
+    return fname
+
+def test_read_columns_regular(tmp_path):
+    fname=_write(tmp_path, 'r1 D001 g\nr2 D002 r')
+    cols=files._read_columns(fname, 3)
+    assert cols==[['r1','r2'], ['D001','D002'], ['g','r']]
+
+def test_read_columns_blank_and_extra(tmp_path):
+    # as many tokens as two full lines, but not one row per line
+    fname=_write(tmp_path, 'r1 D001 g extra1 extra2 extra3\n\nr2 D002 r\n')
+
+    cols=files._read_columns(fname, 3, extra=True)
+    assert cols==[['r1','r2'], ['D001','D002'], ['g','r']]
+
+    with pytest.raises(ValueError):
+        files._read_columns(fname, 3)
+
+def test_read_columns_ragged(tmp_path):
+    fname=_write(tmp_path, 'r1 D001 g x\nr2 D002\n')
+    with pytest.raises(ValueError):
+        files._read_columns(fname, 3)
+    with pytest.raises(ValueError):
+        files._read_columns(fname, 3, extra=True)
+
+def test_read_run_explist_blank_lines(tmp_path):
+    fname=_write(tmp_path, 'r1 D001 g extra1 extra2 extra3\n\nr2 D002 r\n')
+    data=files.read_run_explist(fname, cache=False)
+    assert list(data['expname'])==[b'D001', b'D002']
+
+def test_read_metalist_ragged(tmp_path):
+    fname=_write(tmp_path,
+                 '/a/D001_c01.fits 1 229686 1 1 r extra\n'
+                 '/a/D001_c02.fits 1 229686 1 2\n')
+    with pytest.raises(ValueError):
+        files.read_metalist(fname, cache=False)
+
+def test_read_metalist_paths(tmp_path):
+    paths=['OPS/red/20130101_r2358p01/red/D00229686/D00229686_r_c01.fits.fz',
+           'OPS/red/20130101_r2358p01/red-v2/x/y.fits',
+           'sva1/a/b/longer_mystery_path',
+           'p/a/b/-starts-with-dash/f.fits',
+           'q/a/b//f.fits']
+    lines=['%s 1%d 229686 1 %d r' % (p, i, i+1) for i, p in enumerate(paths)]
+    fname=_write(tmp_path, '\n'.join(lines)+'\n')
+
+    data=files.read_metalist(fname, cache=False)
+
+    project=[p.split('/')[0] for p in paths]
+    mystery_path=[p.split('/')[3].split('-')[0] for p in paths]
+    assert data['project'].astype('U').tolist()==project
+    assert data['mystery_path'].astype('U').tolist()==mystery_path
+    assert data.dtype['mystery_path'].itemsize==len('longer_mystery_path')
+    assert data['reqnum'].tolist()==[10,11,12,13,14]
+    assert data['ccdnum'].tolist()==[1,2,3,4,5]
+
+def test_read_metalist_short_path(tmp_path):
+    fname=_write(tmp_path, 'OPS/red/r/a.fits 1 229686 1 1 r\n'
+                           'OPS/a.fits 1 229686 1 2 r\n')
+    with pytest.raises(ValueError):
+        files.read_metalist(fname, cache=False)
+
+def test_read_metalist_empty(tmp_path):
+    fname=_write(tmp_path, '')
+    data=files.read_metalist(fname, cache=False)
+    assert data.size==0
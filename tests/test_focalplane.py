@@ -0,0 +1,74 @@
+from __future__ import print_function
+import os
+import numpy
+import pytest
+
+fitsio=pytest.importorskip('fitsio')
+
+from eyeballer import focalplane
+
+SHAPE=(6,12)
+
+def _write_product(dir, ccdnum, shape=SHAPE, extnames=('field','bpm_and_weight')):
+    fname=os.path.join(dir, 'D00229686_r_c%02d_r2358p01-eyeball.fits' % ccdnum)
+    field=numpy.zeros(shape, dtype='f4') + ccdnum
+    bpm=numpy.zeros(shape, dtype='i2') + ccdnum
+    with fitsio.FITS(fname,'rw',clobber=True) as fits:
+        if 'field' in extnames:
+            fits.write(field, extname='field')
+        fits.write(bpm, extname='bpm_and_weight')
+    return fname
+
+def test_bad_products_lose_only_their_ccd(tmp_path):
+    dir=str(tmp_path)
+    good=[_write_product(dir, ccdnum) for ccdnum in [2,5,9]]
+
+    missing_field=_write_product(dir, 1, extnames=('bpm_and_weight',))
+    wrong_shape=_write_product(dir, 3, shape=(5,12))
+    not_fits=os.path.join(dir, 'D00229686_r_c04_r2358p01-eyeball.fits')
+    with open(not_fits,'w') as fobj:
+        fobj.write('not a fits file')
+
+    # the bad first product must not stop the others
+    fnames=[missing_field, good[0], wrong_shape, not_fits] + good[1:]
+    maker=focalplane.FocalPlaneMaker(fnames, nthreads=2)
+    field, bpm = maker.go()
+
+    assert sorted(maker.failed)==sorted([missing_field, wrong_shape, not_fits])
+
+    for ccd in maker.ccds:
+        rows=slice(ccd['row0'], ccd['row0']+SHAPE[0])
+        cols=slice(ccd['col0'], ccd['col0']+SHAPE[1])
+        expected=ccd['ccdnum'] if ccd['filename'] in good else 0
+        assert (field[rows,cols]==expected).all()
+        assert (bpm[rows,cols]==expected).all()
+
+def test_no_readable_products(tmp_path):
+    fname=_write_product(str(tmp_path), 1, extnames=('bpm_and_weight',))
+    maker=focalplane.FocalPlaneMaker([fname])
+    with pytest.raises(IOError):
+        maker.go()
+
+def test_write_fits_replaces_complete_file(tmp_path, monkeypatch):
+    maker=focalplane.FocalPlaneMaker([_write_product(str(tmp_path), 1)])
+    maker.go()
+
+    fitsfile=str(tmp_path / 'out' / 'focalplane.fits')
+    maker.write_fits(fitsfile)
+    assert os.listdir(str(tmp_path / 'out'))==['focalplane.fits']
+    numpy.testing.assert_array_equal(fitsio.read(fitsfile, ext='field'),
+                                     maker.field)
+
+    with open(fitsfile,'rb') as fobj:
+        data=fobj.read()
+
+    # a failed write leaves the earlier file as it was, and no partial file
+    def fail():
+        raise IOError("disk full")
+    monkeypatch.setattr(maker, '_get_ccd_table', fail)
+    with pytest.raises(IOError):
+        maker.write_fits(fitsfile)
+
+    assert os.listdir(str(tmp_path / 'out'))==['focalplane.fits']
+    with open(fitsfile,'rb') as fobj:
+        assert fobj.read()==data
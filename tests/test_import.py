@@ -0,0 +1,6 @@
+from eyeballer import bench
+
+def test_import_budget():
+    # raises RuntimeError if over budget or lazy modules get loaded
+    results=bench.bench_import(ntrial=3)
+    assert len(results)==3
@@ -0,0 +1,37 @@
+import numpy
+import pytest
+
+from eyeballer import jpegs
+
+def _bytescale(im):
+    return numpy.clip(im*255 + 0.5, 0, 255).astype('u1')
+
+def test_lut_matches_direct_stretch():
+    pytest.importorskip('images')
+
+    im=numpy.linspace(-20.0, 400.0, 20000).reshape(100, 200)
+    lut, xmax = jpegs.make_asinh_lut()
+
+    direct=_bytescale(numpy.clip(jpegs.scale_se_image(im), 0, 1))
+    fromlut=jpegs.apply_lut(im, lut, xmax)
+
+    diff=numpy.abs(fromlut.astype('i4') - direct.astype('i4'))
+    assert diff.max() <= 1
+
+def test_lut_values():
+    lut, xmax = jpegs.make_asinh_lut()
+    im=numpy.array([[1.0, 5.0, 10.0, 1000.0]])
+    vals=jpegs.apply_lut(im, lut, xmax)
+
+    expected=numpy.arcsinh(im*jpegs.SCALE*jpegs.NONLINEAR)/jpegs.NONLINEAR
+    expected=numpy.clip(expected*255 + 0.5, 0, 255)
+    assert numpy.all(numpy.abs(vals - expected) <= 1)
+    assert vals[0,-1]==255
+
+def test_lut_non_finite():
+    lut, xmax = jpegs.make_asinh_lut()
+    im=numpy.array([[numpy.nan, numpy.inf, -numpy.inf, 50.0]], dtype='f4')
+
+    for xmin in [0.0, -5.0]:
+        vals=jpegs.apply_lut(im, lut, xmax, xmin=xmin)
+        assert numpy.all(vals[0,:3]==lut[0])
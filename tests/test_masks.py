@@ -0,0 +1,126 @@
+from __future__ import print_function
+import numpy
+import pytest
+
+from eyeballer import masks
+from eyeballer.rebin import rebin_bitmask_or
+
+def _make_inputs(nrows=70, ncols=36, seed=11):
+    rng=numpy.random.RandomState(seed)
+    bpm=rng.randint(0, 2**12, size=(nrows,ncols)).astype('i2')
+    # some pixels have the top bit already
+    bpm.view('u2')[rng.uniform(size=bpm.shape) < 0.1] |= 2**15
+    wt=rng.uniform(size=bpm.shape).astype('f4')
+    return bpm, wt
+
+def _expected(bpm, wt, keep, drop, derived, weight):
+    """
+    the rules applied directly on the unsigned bits
+    """
+    b=bpm.view('u2').astype('i8')
+    if keep is not None:
+        b &= keep
+    b &= ~drop
+    for bits, flag in derived:
+        b[(b & bits) != 0] |= flag
+    for below, flag in weight:
+        b[wt < below] |= flag
+    return b.astype('u2').view('i2')
+
+RULES=[
+    {},
+    {'keep_bits':['BADPIX_BPM','BADPIX_SATURATE','BADPIX_SUSPECT',16]},
+    {'drop_bits':'BADPIX_CRAY'},
+    {'keep_bits':[1,2,16,2048], 'drop_bits':[16]},
+    {'derived':[{'any':['BADPIX_SUSPECT','BADPIX_STAR'], 'flag':'BADPIX_BPM'}]},
+    {'weight':[{'below':0.3, 'flag':'WEIGHT_FLAG'},
+               {'below':0.1, 'flag':'BADPIX_EDGE'}]},
+    {'keep_bits':[1,2048],
+     'derived':[{'any':2048, 'flag':'WEIGHT_FLAG'}],
+     'weight':[{'below':0.2, 'flag':4}]},
+]
+
+@pytest.mark.parametrize('conf', RULES)
+def test_rules_match_numpy(conf):
+    bpm, wt = _make_inputs()
+
+    keep=None
+    if 'keep_bits' in conf:
+        keep=masks.get_bits(conf['keep_bits'])
+    drop=masks.get_bits(conf.get('drop_bits',[]))
+    derived=[(masks.get_bits(r['any']), masks.get_bits(r['flag']))
+             for r in conf.get('derived',[])]
+    weight=[(r['below'], masks.get_bits(r['flag']))
+            for r in conf.get('weight',[])]
+    expected=_expected(bpm, wt, keep, drop, derived, weight)
+
+    masks.MaskRules(**conf).apply(bpm, wt)
+    assert bpm.dtype==numpy.dtype('i2')
+    numpy.testing.assert_array_equal(bpm, expected)
+
+def test_weight_flag_in_int16():
+    bpm=numpy.zeros((3,4), dtype='i2')
+    wt=numpy.ones((3,4), dtype='f4')
+    wt[1,2]=0.0
+
+    rules=masks.MaskRules(weight=[{'below':masks.WEIGHT_LOWVAL_SVY1,
+                                   'flag':'WEIGHT_FLAG'}])
+    rules.apply(bpm, wt)
+
+    assert bpm.view('u2')[1,2]==masks.WEIGHT_FLAG
+    assert (bpm!=0).sum()==1
+
+    # clearing a low bit keeps the top bit
+    masks.MaskRules(drop_bits=1).apply(bpm)
+    assert bpm.view('u2')[1,2]==masks.WEIGHT_FLAG
+
+def test_get_mask_rules():
+    assert masks.get_mask_rules({}).is_empty()
+    assert masks.get_mask_rules({'low_weight':False}).is_empty()
+
+    rules=masks.get_mask_rules({'low_weight':True})
+    assert rules.weight==[(masks.WEIGHT_LOWVAL_SVY1, masks.WEIGHT_FLAG)]
+
+    rules=masks.get_mask_rules({'low_weight':0.5})
+    assert rules.weight==[(0.5, masks.WEIGHT_FLAG)]
+
+    # mask_rules takes precedence
+    rules=masks.get_mask_rules({'low_weight':0.5,
+                                'mask_rules':{'drop_bits':['BADPIX_STAR']}})
+    assert rules.weight==[]
+    assert rules.drop==32
+
+def test_bad_rules():
+    with pytest.raises(ValueError):
+        masks.MaskRules(drop_bits=['BADPIX_NOPE'])
+
+    rules=masks.get_mask_rules({'low_weight':True})
+    bpm, wt = _make_inputs()
+    with pytest.raises(ValueError):
+        rules.apply(bpm)
+    with pytest.raises(ValueError):
+        masks.compose_and_rebin(bpm, None, rules, 4)
+
+# block rows that are and are not multiples of the rebin, and a single block
+@pytest.mark.parametrize('block_rows', [8, 10, 16, 1000])
+@pytest.mark.parametrize('rebin', [1, 4])
+def test_compose_and_rebin_blocks(block_rows, rebin):
+    # 70 rows is not a multiple of the rebin or the blocks
+    bpm, wt = _make_inputs()
+    rules=masks.MaskRules(drop_bits=[16],
+                          derived=[{'any':2048, 'flag':'BADPIX_BPM'}],
+                          weight=[{'below':0.2, 'flag':'WEIGHT_FLAG'}])
+
+    expected=bpm.copy()
+    rules.apply(expected, wt)
+
+    out=masks.compose_and_rebin(bpm, wt, rules, rebin, block_rows=block_rows)
+
+    # all of the bpm has the rules applied, including the cropped rows
+    numpy.testing.assert_array_equal(bpm, expected)
+
+    if rebin==1:
+        assert out is bpm
+    else:
+        assert out.shape==(70//rebin, 36//rebin)
+        numpy.testing.assert_array_equal(out, rebin_bitmask_or(expected, rebin))
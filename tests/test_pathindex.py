@@ -0,0 +1,35 @@
+from __future__ import print_function
+import numpy
+
+from eyeballer import files
+from eyeballer import pathindex
+
+def test_long_fields(tmp_path):
+    # fields longer than any fixed width are kept whole
+    project='P'*40
+    mystery_path='m'*30
+    band='VR_long'
+    lines=['%s/a/b/%s-x/D00229686_c%02d.fits %d 229686 1 %d %s'
+           % (project, mystery_path, ccdnum, 100+ccdnum, ccdnum, band)
+           for ccdnum in [3,1,2]]
+    fname=str(tmp_path / 'metalist.txt')
+    with open(fname,'w') as fobj:
+        fobj.write('\n'.join(lines)+'\n')
+
+    meta=files.read_metalist(fname, cache=False)
+    paths=['/out/%s/%s/c%02d-eyeball.fits.fz' % (project, mystery_path, c)
+           for c in meta['ccdnum']]
+    index=pathindex.make_path_index(meta, paths)
+
+    assert index.data['project'].astype('U').tolist()==[project]*3
+    assert index.data['mystery_path'].astype('U').tolist()==[mystery_path]*3
+    assert index.data['band'].astype('U').tolist()==[band]*3
+    assert index.data['ccdnum'].tolist()==[1,2,3]
+
+    found=index.get_paths([102,101,105], 229686, 1, [2,1,5])
+    assert found.astype('U').tolist()==[paths[2], paths[1], '']
+
+    fname=str(tmp_path / 'index.npy')
+    index.write(fname)
+    numpy.testing.assert_array_equal(pathindex.read_path_index(fname).data,
+                                     index.data)
@@ -0,0 +1,49 @@
+from __future__ import print_function
+import threading
+import pytest
+
+pytest.importorskip('fitsio')
+
+from eyeballer import cutouts
+from eyeballer import pipeline
+from eyeballer import synthetic
+
+class _Crash(BaseException):
+    pass
+
+def _items(tmp_path, nccd):
+    pairs=synthetic.write_decam_inputs(str(tmp_path / 'input'), nccd=nccd,
+                                       nrows=128, ncols=64, seed=6)
+    return [{'image_file':image_file,
+             'bkg_file':bkg_file,
+             'output_file':str(tmp_path / ('out%d-eyeball.fits.fz' % i))}
+            for i, (image_file, bkg_file) in enumerate(pairs)]
+
+def _run(items, out):
+    try:
+        out['results']=pipeline.run_pipeline({'rebin':4}, items, queue_depth=1)
+    except BaseException as err:
+        out['error']=err
+
+def test_pipeline(tmp_path):
+    items=_items(tmp_path, 3)
+    results, stats = pipeline.run_pipeline({'rebin':4}, items, queue_depth=1)
+    assert [r['status'] for r in results]==['ok']*3
+    assert [s['count'] for s in stats]==[3,3,3,3]
+
+def test_write_stage_failure(tmp_path, monkeypatch):
+    items=_items(tmp_path, 6)
+
+    def crash(self, fitsfile, prepared):
+        raise _Crash("write stage died")
+    monkeypatch.setattr(cutouts.EyeballMaker, 'write_prepared', crash)
+
+    # the other stages must not block on the full queues
+    out={}
+    thread=threading.Thread(target=_run, args=(items, out))
+    thread.daemon=True
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive()
+
+    assert isinstance(out.get('error',None), _Crash)
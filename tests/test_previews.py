@@ -0,0 +1,21 @@
+from __future__ import print_function
+import pytest
+
+from eyeballer import previews
+
+def test_preview_names():
+    fname='/data/D00229686_r_c01_r2358p01-eyeball.fits.fz'
+    names=[previews.get_preview_file(fname, type=type, overlay=overlay,
+                                     auto_scale=auto_scale)
+           for type in previews.PREVIEW_TYPES
+           for overlay in [False, True]
+           for auto_scale in [False, True]]
+
+    # each kind of preview has its own file, so one does not make
+    # another look up to date
+    assert len(set(names))==len(names)
+    assert previews.get_preview_file(fname, auto_scale=True)==\
+            '/data/D00229686_r_c01_r2358p01-eyeball-auto.jpg'
+
+    with pytest.raises(ValueError):
+        previews.get_preview_file(fname, type='gif')
@@ -0,0 +1,101 @@
+from __future__ import print_function
+import numpy
+import pytest
+
+fitsio=pytest.importorskip('fitsio')
+
+from eyeballer import products
+
+def _write_product(fname, compress=None):
+    rng=numpy.random.RandomState(3)
+    field=rng.normal(size=(40,30)).astype('f4')
+    bpm=rng.randint(0, 2**12, size=field.shape).astype('i2')
+    # unsigned ints are written with BZERO, so can't be mapped
+    extra=rng.randint(0, 2**16, size=field.shape).astype('u2')
+
+    meta=numpy.zeros(1, dtype=[('rebin','i4')])
+    meta['rebin']=4
+    with fitsio.FITS(fname,'rw',clobber=True) as fits:
+        fits.write(meta, extname='metadata')
+        fits.write(field, extname='field', compress=compress,
+                   header={'REBIN':4})
+        fits.write(bpm, extname='bpm_and_weight', compress=compress)
+        fits.write(field[::2,::2].copy(), extname='field_8', compress=compress,
+                   header={'REBIN':8})
+        fits.write(bpm[::2,::2].copy(), extname='bpm_and_weight_8',
+                   compress=compress)
+        fits.write(extra, extname='extra')
+    return fname
+
+SLICES=[
+    (None, None),
+    (slice(5,17), slice(0,30)),
+    (slice(None,10), slice(12,None)),
+    (slice(-7,None), slice(3,-4)),
+    (slice(39,100), slice(29,30)),
+]
+
+@pytest.mark.parametrize('compress', [None, 'rice'])
+@pytest.mark.parametrize('mmap', [True, False])
+def test_read_image_matches_fitsio(tmp_path, compress, mmap):
+    fname=_write_product(str(tmp_path / 'prod-eyeball.fits'), compress=compress)
+
+    with products.EyeballProduct(fname, mmap=mmap) as prod:
+        assert prod.read_meta()['rebin'][0]==4
+        assert prod.get_dims()==[40,30]
+
+        for ext in ['field','bpm_and_weight','extra']:
+            full=fitsio.read(fname, ext=ext)
+            for rows, cols in SLICES:
+                data=prod.read_image(ext, rows=rows, cols=cols)
+                expected=full[rows if rows is not None else slice(None),
+                              cols if cols is not None else slice(None)]
+                numpy.testing.assert_array_equal(data, expected)
+
+        numpy.testing.assert_array_equal(prod.read_field(rows=slice(1,3)),
+                                         fitsio.read(fname, ext='field')[1:3])
+        numpy.testing.assert_array_equal(prod.read_bpm(cols=slice(1,3)),
+                                         fitsio.read(fname, ext='bpm_and_weight')[:,1:3])
+
+    assert not prod.is_open()
+
+def test_memmap_only_uncompressed(tmp_path):
+    fname=_write_product(str(tmp_path / 'prod-eyeball.fits'))
+    with products.EyeballProduct(fname) as prod:
+        assert isinstance(prod.read_field(), numpy.memmap)
+        assert isinstance(prod.read_bpm(rows=slice(2,4)), numpy.memmap)
+        # scaled data are read
+        assert not isinstance(prod.read_image('extra'), numpy.memmap)
+
+    fname=_write_product(str(tmp_path / 'prod-eyeball.fits.fz'), compress='rice')
+    with products.EyeballProduct(fname) as prod:
+        assert not isinstance(prod.read_field(), numpy.memmap)
+
+def test_step_slices_not_supported(tmp_path):
+    fname=_write_product(str(tmp_path / 'prod-eyeball.fits'))
+    with products.EyeballProduct(fname, mmap=False) as prod:
+        with pytest.raises(ValueError):
+            prod.read_field(rows=slice(0,10,2))
+
+def test_levels(tmp_path):
+    fname=_write_product(str(tmp_path / 'prod-eyeball.fits'))
+    with products.EyeballProduct(fname) as prod:
+        assert prod.get_levels()==[4,8]
+        numpy.testing.assert_array_equal(prod.read_level(8, bpm=True),
+                                         fitsio.read(fname, ext='bpm_and_weight_8'))
+        numpy.testing.assert_array_equal(prod.read_level(4, rows=slice(0,2)),
+                                         fitsio.read(fname, ext='field')[0:2])
+        with pytest.raises(ValueError):
+            prod.read_level(16)
+
+def test_iter_products_max_open(tmp_path):
+    fname=_write_product(str(tmp_path / 'prod-eyeball.fits'))
+
+    seen=[]
+    for prod in products.iter_products([fname]*5, max_open=2):
+        prod.read_meta()
+        seen.append(prod)
+        assert sum([p.is_open() for p in seen]) <= 2
+
+    assert len(seen)==5
+    assert not any([p.is_open() for p in seen])
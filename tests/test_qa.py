@@ -0,0 +1,45 @@
+import sqlite3
+
+from eyeballer import qa
+
+def _make_old_table(fname, rows):
+    conn=sqlite3.connect(fname)
+    conn.execute('create table qa (userid int, fileid int, score int, comments text)')
+    conn.executemany('insert into qa values (?,?,?,?)', rows)
+    conn.commit()
+    return conn
+
+def test_migrate_duplicates(tmp_path):
+    fname=str(tmp_path / 'qa.db')
+    rows=[(1, 10, -1, 'first'),
+          (1, 10, 1, 'second'),
+          (2, 10, 0, None)]
+    conn=_make_old_table(fname, rows)
+
+    qa.make_qa_table(conn)
+
+    kept=sorted(conn.execute('select userid, fileid, score, comments from qa'))
+    assert kept==[(1, 10, 1, 'second'), (2, 10, 0, None)]
+
+    moved=list(conn.execute('select userid, fileid, score, comments '
+                            'from qa_duplicates'))
+    assert moved==[(1, 10, -1, 'first')]
+
+    # the migration runs only once; later scores are kept
+    qa.upsert_scores(conn, [{'userid':3, 'fileid':11, 'score':1}])
+    qa.make_qa_table(conn)
+    assert conn.execute('select count(*) from qa').fetchone()[0]==3
+    assert conn.execute('select count(*) from qa_duplicates').fetchone()[0]==1
+
+def test_writer_batches(tmp_path):
+    fname=str(tmp_path / 'qa.db')
+    writer=qa.QAWriter(fname)
+    try:
+        writer.write([{'userid':1, 'fileid':i, 'score':1} for i in range(5)])
+        writer.write([{'userid':1, 'fileid':0, 'score':-1}])
+    finally:
+        writer.close()
+
+    conn=qa.connect(fname)
+    assert conn.execute('select count(*) from qa').fetchone()[0]==5
+    assert conn.execute('select score from qa where fileid=0').fetchone()[0]==-1
@@ -0,0 +1,104 @@
+from __future__ import print_function
+import numpy
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+from eyeballer import rebin
+
+def _naive(im, factor, func, edge):
+    """
+    reduce each block with a python loop; with pad, the last blocks hold
+    only the pixels that exist
+    """
+    nrows, ncols = rebin.get_rebinned_shape(im.shape, factor, edge=edge)
+    out=numpy.zeros( (nrows,ncols), dtype='f8')
+    for i in range(nrows):
+        for j in range(ncols):
+            block=im[i*factor:(i+1)*factor, j*factor:(j+1)*factor]
+            out[i,j]=func(block)
+    return out
+
+def _image(shape, seed=1):
+    rng=numpy.random.RandomState(seed)
+    return rng.normal(size=shape).astype('f4')
+
+@pytest.mark.parametrize('shape', [(12,16), (13,18)])
+@pytest.mark.parametrize('edge', [rebin.EDGE_CROP, rebin.EDGE_PAD])
+@pytest.mark.parametrize('factor', [1,2,4])
+def test_against_loop(shape, edge, factor):
+    im=_image(shape)
+
+    res=rebin.rebin_mean(im, factor, edge=edge)
+    assert res.dtype==im.dtype
+    assert_allclose(res, _naive(im, factor, numpy.mean, edge), rtol=1.0e-5, atol=1.0e-6)
+
+    res=rebin.rebin_sum(im, factor, edge=edge)
+    assert_allclose(res, _naive(im, factor, numpy.sum, edge), rtol=1.0e-5, atol=1.0e-5)
+
+    res=rebin.rebin_max(im, factor, edge=edge)
+    assert_array_equal(res, _naive(im, factor, numpy.max, edge))
+
+    assert_array_equal(rebin.rebin_image(im, factor, edge=edge),
+                       rebin.rebin_mean(im, factor, edge=edge))
+
+@pytest.mark.parametrize('edge', [rebin.EDGE_CROP, rebin.EDGE_PAD])
+def test_bitmask_or(edge):
+    rng=numpy.random.RandomState(3)
+    bits=(1 << rng.randint(0, 15, size=(11,14))).astype('i2')
+    bits[rng.uniform(size=bits.shape) < 0.7]=0
+    # bit 15 makes the value negative in an int16
+    bits[0,0]=-32768
+
+    res=rebin.rebin_bitmask_or(bits, 4, edge=edge)
+    assert res.dtype==bits.dtype
+    expected=_naive(bits, 4, lambda b: numpy.bitwise_or.reduce(b.ravel()), edge)
+    assert_array_equal(res, expected.astype('i2'))
+    assert res[0,0] < 0
+
+    with pytest.raises(ValueError):
+        rebin.rebin_bitmask_or(bits.astype('f4'), 4)
+
+def test_integer_mean_is_f4():
+    im=numpy.arange(16, dtype='i4').reshape(4,4)
+    res=rebin.rebin_image(im, 2)
+    assert res.dtype==numpy.dtype('f4')
+    assert_array_equal(res, [[2.5,4.5],[10.5,12.5]])
+
+    res=rebin.rebin_image(im, 2, dtype='f8')
+    assert res.dtype==numpy.dtype('f8')
+
+def test_edges():
+    im=_image((10,7))
+
+    # crop drops the trailing rows and columns
+    res=rebin.rebin_image(im, 4)
+    assert res.shape==(2,1)
+    assert_allclose(res, rebin.rebin_image(im[:8,:4], 4))
+
+    # pad averages the partial blocks over their pixels
+    res=rebin.rebin_image(im, 4, edge=rebin.EDGE_PAD)
+    assert res.shape==(3,2)
+    assert_allclose(res[2,1], im[8:,4:].mean(), rtol=1.0e-5)
+
+    with pytest.raises(ValueError):
+        rebin.rebin_image(im, 4, edge=rebin.EDGE_RAISE)
+
+    # divisible shapes are fine with raise
+    res=rebin.rebin_image(im[:8,:4], 4, edge=rebin.EDGE_RAISE)
+    assert res.shape==(2,1)
+
+    with pytest.raises(ValueError):
+        rebin.rebin_image(im, 4, edge='wrap')
+    with pytest.raises(ValueError):
+        rebin.rebin_image(im, 0)
+
+def test_rebinned_shape():
+    assert rebin.get_rebinned_shape((4096,2048), 4)==(1024,512)
+    assert rebin.get_rebinned_shape((10,7), 4)==(2,1)
+    assert rebin.get_rebinned_shape((10,7), 4, edge=rebin.EDGE_PAD)==(3,2)
+    assert rebin.get_rebinned_shape((8,4), 4, edge=rebin.EDGE_PAD)==(2,1)
+
+    for edge in [rebin.EDGE_CROP, rebin.EDGE_PAD]:
+        im=_image((13,18))
+        assert rebin.rebin_image(im, 4, edge=edge).shape==\
+                rebin.get_rebinned_shape(im.shape, 4, edge=edge)
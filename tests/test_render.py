@@ -0,0 +1,100 @@
+from __future__ import print_function
+import numpy
+import pytest
+
+from eyeballer import render
+from eyeballer.masks import BIT_NAMES
+
+# a linear lut, so the gray value is the field value
+LUT=numpy.arange(256, dtype='u1')
+XMAX=255.0
+
+OVERLAY=[
+    {'bits':['BADPIX_BPM'], 'color':(255,0,0)},
+    {'bits':[2,4], 'color':(0,0,255)},
+    {'bits':['WEIGHT_FLAG'], 'color':(10,200,30)},
+]
+
+def _make_inputs(nrows=7, ncols=5, seed=8):
+    rng=numpy.random.RandomState(seed)
+    field=rng.randint(0, 256, size=(nrows,ncols)).astype('f4')
+    bpm=rng.randint(0, 8, size=field.shape).astype('i2')
+    bpm.view('u2')[rng.uniform(size=field.shape) < 0.3] |= BIT_NAMES['WEIGHT_FLAG']
+    return field, bpm
+
+def _expected_pixel(gray, bits, alpha):
+    """
+    the later matching rule wins
+    """
+    color=None
+    for rule in OVERLAY:
+        mask=0
+        for b in rule['bits']:
+            mask |= BIT_NAMES[b] if isinstance(b, str) else b
+        if bits & mask:
+            color=rule['color']
+
+    if color is None:
+        return [gray]*3
+    return [min(255, int((1-alpha)*gray + alpha*c + 0.5)) for c in color]
+
+@pytest.mark.parametrize('factor', [1, 2, 3])
+@pytest.mark.parametrize('shape', [(7,5), (7,5,3), (4,6,2)])
+def test_upsample_matches_repeat(factor, shape):
+    a=numpy.arange(numpy.prod(shape)).reshape(shape).astype('u1')
+    expected=numpy.repeat(numpy.repeat(a, factor, axis=0), factor, axis=1)
+
+    numpy.testing.assert_array_equal(render.upsample(a, factor), expected)
+
+    out=numpy.zeros(expected.shape, dtype='u1')
+    res=render.upsample(a, factor, out=out)
+    assert res is out
+    numpy.testing.assert_array_equal(out, expected)
+
+def test_upsample_bad_input():
+    a=numpy.zeros((3,4), dtype='u1')
+    with pytest.raises(ValueError):
+        render.upsample(a, 0)
+    with pytest.raises(ValueError):
+        render.upsample(a, 2, out=numpy.zeros((6,6), dtype='u1'))
+
+@pytest.mark.parametrize('factor', [1, 3])
+def test_overlay_matches_per_pixel(factor):
+    field, bpm = _make_inputs()
+    alpha=0.4
+    renderer=render.OverlayRenderer(overlay=OVERLAY, alpha=alpha, factor=factor,
+                                    lut=LUT, xmax=XMAX)
+    rgb=renderer.render(field, bpm)
+    assert rgb.shape==renderer.get_output_shape(field.shape)==(7*factor,5*factor,3)
+    assert rgb.dtype==numpy.uint8
+
+    bits=bpm.view('u2')
+    for row in range(field.shape[0]):
+        for col in range(field.shape[1]):
+            expected=_expected_pixel(int(field[row,col]), int(bits[row,col]), alpha)
+            block=rgb[row*factor:(row+1)*factor, col*factor:(col+1)*factor]
+            assert (block==expected).all(), (row, col)
+
+def test_gray_and_buffer_reuse():
+    field, bpm = _make_inputs()
+    renderer=render.OverlayRenderer(overlay=None, factor=2, lut=LUT, xmax=XMAX)
+
+    gray=renderer.render(field)
+    assert gray.shape==(14,10)
+    expected=numpy.repeat(numpy.repeat(field.astype('u1'), 2, axis=0), 2, axis=1)
+    numpy.testing.assert_array_equal(gray, expected)
+
+    # the buffer is kept for the next render of the same size
+    again=renderer.render(field[::-1].copy())
+    assert again is gray
+    numpy.testing.assert_array_equal(again, expected[::-1])
+
+def test_overlay_bad_input():
+    field, bpm = _make_inputs()
+    renderer=render.OverlayRenderer(overlay=OVERLAY, lut=LUT, xmax=XMAX)
+    with pytest.raises(ValueError):
+        renderer.render(field)
+    with pytest.raises(ValueError):
+        renderer.render(field, bpm[1:])
+    with pytest.raises(ValueError):
+        renderer.render(field, bpm, out=numpy.zeros((7,5), dtype='u1'))
@@ -0,0 +1,20 @@
+from eyeballer import schedule
+
+def test_seconds_per_byte_from_runtimes():
+    items=[{'image_file':'im%d' % i, 'output_file':'out%d' % i}
+           for i in range(4)]
+    runtimes={'out0':10.0, 'out1':20.0}
+    sizes={'im0':100, 'im1':200, 'im2':300, 'im3':None}
+
+    assert schedule.get_seconds_per_byte(items, runtimes, sizes)==0.1
+
+    costs=schedule.get_costs(items, runtimes=runtimes, sizes=sizes)
+    assert costs[:3]==[10.0, 20.0, 30.0]
+    # no runtime or size; the median of the others
+    assert costs[3]==20.0
+
+def test_pack_chunks_balanced():
+    costs=[5.0, 4.0, 3.0, 3.0, 2.0, 1.0]
+    chunks=schedule.pack_chunks(costs, 2)
+    totals=sorted([sum([costs[i] for i in c]) for c in chunks])
+    assert totals==[9.0, 9.0]
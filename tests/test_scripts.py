@@ -0,0 +1,33 @@
+from __future__ import print_function
+import os
+import ast
+
+BIN_DIR=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+
+def _load_function(script, name):
+    """
+    get a function from a bin script without running the script
+    """
+    with open(os.path.join(BIN_DIR, script)) as fobj:
+        tree=ast.parse(fobj.read())
+
+    funcs=[node for node in tree.body
+           if isinstance(node, ast.FunctionDef) and node.name==name]
+    module=ast.Module(body=funcs, type_ignores=[])
+    namespace={}
+    exec(compile(module, script, 'exec'), namespace)
+    return namespace[name]
+
+def test_master_script_arguments():
+    get_master_script=_load_function('make-eyeball-scripts-v1', 'get_master_script')
+    text=get_master_script('se009')
+
+    calls=[line.split('make-se-eyeball')[1].lstrip(')').replace(';',' ').split()
+           for line in text.split('\n') if 'make-se-eyeball' in line]
+    assert len(calls)==2
+
+    # make-se-eyeball takes the run, image, bkg and output file
+    for args in calls:
+        args=[a for a in args if not a.startswith('-') and a != 'then']
+        assert args[0]=='se009'
+        assert len(args)==4
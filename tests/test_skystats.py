@@ -0,0 +1,30 @@
+from __future__ import print_function
+import numpy
+
+from eyeballer import skystats
+
+def _field(seed=3):
+    rng=numpy.random.RandomState(seed)
+    field=rng.normal(loc=10.0, scale=2.0, size=(400,300))
+    # stars
+    field[rng.randint(0,400,size=500), rng.randint(0,300,size=500)] += 1000.0
+    return field
+
+def test_niter_zero():
+    field=_field()
+    stats=skystats.get_sky_stats(field, niter=0)
+
+    sample=skystats.get_sample(field).ravel()
+    med=numpy.median(sample)
+    mad=numpy.median(numpy.abs(sample-med))
+
+    numpy.testing.assert_allclose(stats['sky_median'], med)
+    numpy.testing.assert_allclose(stats['sky_mad'], mad)
+    assert stats['sky_nclip']==sample.size
+
+def test_clipping():
+    stats=skystats.get_sky_stats(_field())
+
+    assert stats['sky_nclip'] < stats['stats_nsample']
+    numpy.testing.assert_allclose(stats['sky_median'], 10.0, atol=0.1)
+    numpy.testing.assert_allclose(stats['sky_sigma'], 2.0, rtol=0.1)
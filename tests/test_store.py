@@ -0,0 +1,155 @@
+from __future__ import print_function
+import os
+import multiprocessing
+
+import numpy
+import pytest
+
+from eyeballer import store
+
+def _arrays(seed):
+    rng=numpy.random.RandomState(seed)
+    return {'field':rng.normal(size=(20,30)).astype('f4'),
+            'bpm_and_weight':rng.randint(0,4,size=(20,30)).astype('i2')}
+
+def _write_many(store_dir, start, n):
+    with store.StoreWriter(store_dir) as writer:
+        for i in range(start, start+n):
+            writer.write(1000+i, 1, _arrays(i), meta={'i':i})
+
+def test_merge_while_writing(tmp_path):
+    store_dir=str(tmp_path)
+
+    writer=store.StoreWriter(store_dir)
+    writer.write(1000, 1, _arrays(0))
+    writer.write(1000, 2, _arrays(1))
+
+    # the writer's shard is taken for merging; the next record must go
+    # to a new shard and survive the next merge
+    nrec, shards = store.merge_store(store_dir)
+    assert nrec==2
+    assert all(store.MERGING_TAG in s for s in shards)
+
+    writer.write(1001, 1, _arrays(2))
+    writer.write(1000, 1, _arrays(3), meta={'new':True})
+    writer.close()
+
+    nrec, shards = store.merge_store(store_dir)
+    assert nrec==3
+    assert store.find_shards(store_dir)==[]
+    assert os.listdir(store_dir)==[store.MERGED_NAME]
+
+    with store.EyeballStore(store_dir) as st:
+        assert st.get_keys()==[(1000,1),(1000,2),(1001,1)]
+        assert st.read_info(1000,1)['meta']=={'new':True}
+        numpy.testing.assert_array_equal(st.read(1000,2)['bpm_and_weight'],
+                                         _arrays(1)['bpm_and_weight'])
+
+def test_processes_share_shard(tmp_path):
+    store_dir=str(tmp_path)
+
+    procs=[multiprocessing.Process(target=_write_many, args=(store_dir, i*10, 10))
+           for i in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    assert len(store.find_shards(store_dir))==1
+    keys=store.read_shard_keys(store.find_shards(store_dir)[0])
+    assert keys.size==40
+
+    with store.EyeballStore(store_dir) as st:
+        assert len(st)==40
+
+def test_read_record_info(tmp_path):
+    store_dir=str(tmp_path)
+
+    with store.StoreWriter(store_dir) as writer:
+        for i in range(5):
+            writer.write(1000+i, 1, _arrays(i), meta={'i':i})
+    store.merge_store(store_dir)
+
+    with store.StoreWriter(store_dir) as writer:
+        writer.write(1002, 1, _arrays(9), meta={'i':'new'})
+        writer.write(2000, 3, _arrays(9), meta={'i':'shard'})
+
+    with store.EyeballStore(store_dir) as st:
+        for key in st.get_keys():
+            info=store.read_record_info(store_dir, *key)
+            assert info['meta']==st.read_info(*key)['meta']
+
+    assert store.read_record_info(store_dir, 1002, 1)['meta']=={'i':'new'}
+    assert store.read_record_info(store_dir, 1000, 2) is None
+    assert store.read_record_info(store_dir, 999, 1) is None
+    assert store.read_record_info(str(tmp_path / 'none'), 1000, 1) is None
+
+def test_read_record_info_skips_torn_record(tmp_path):
+    store_dir=str(tmp_path)
+
+    with store.StoreWriter(store_dir) as writer:
+        writer.write(1000, 1, _arrays(0), meta={'i':0})
+        writer.write(1000, 1, _arrays(1), meta={'i':1})
+        shard=writer.get_shard_file()
+
+    # corrupt the last record
+    with open(shard,'r+b') as fobj:
+        fobj.seek(-10, os.SEEK_END)
+        fobj.write(b'x'*10)
+
+    assert store.read_record_info(store_dir, 1000, 1)['meta']=={'i':0}
+
+def test_open_during_merge(tmp_path, monkeypatch):
+    store_dir=str(tmp_path)
+
+    with store.StoreWriter(store_dir) as writer:
+        writer.write(1000, 1, _arrays(0))
+        shard=writer.get_shard_file()
+
+    # a merge takes the shard just after it is listed, and has not yet
+    # written the merged container
+    find_shards=store.find_shards
+    calls=[]
+    def listed_then_taken(dir):
+        fnames=find_shards(dir)
+        if not calls:
+            os.rename(shard, shard.replace(store.STORE_EXT,
+                                           store.MERGING_TAG+store.STORE_EXT))
+        calls.append(fnames)
+        return fnames
+    monkeypatch.setattr(store, 'find_shards', listed_then_taken)
+
+    with store.EyeballStore(store_dir) as st:
+        assert st.get_keys()==[(1000,1)]
+    assert len(calls)==2
+
+    calls[:]=[]
+    with store.StoreWriter(store_dir) as writer:
+        writer.write(1000, 2, _arrays(1))
+    assert store.read_record_info(store_dir, 1000, 2) is not None
+
+def test_batch_store(tmp_path):
+    pytest.importorskip('fitsio')
+    from eyeballer import batch
+    from eyeballer import synthetic
+
+    pairs=synthetic.write_decam_inputs(str(tmp_path / 'input'), nccd=3,
+                                       nrows=128, ncols=64, seed=4)
+    items=[{'image_file':image_file,
+            'bkg_file':bkg_file,
+            'output_file':str(tmp_path / ('out%d-eyeball.fits.fz' % i))}
+           for i, (image_file, bkg_file) in enumerate(pairs)]
+
+    store_dir=str(tmp_path / 'store')
+    for nproc in [1,2]:
+        results=batch.run_batch({'rebin':4}, items, nproc=nproc,
+                                clobber=True, store_dir=store_dir)
+        assert [r['status'] for r in results]==[batch.STATUS_OK]*3
+        assert batch._worker_store is None
+
+        shards=store.find_shards(store_dir)
+        assert len(shards)==1
+        assert store.read_shard_keys(shards[0]).size==3*nproc
+
+    with store.EyeballStore(store_dir) as st:
+        assert st.get_keys()==[(229686,1),(229686,2),(229686,3)]
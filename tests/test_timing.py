@@ -0,0 +1,57 @@
+import numpy
+import pytest
+
+from eyeballer import timing
+
+def test_maxrss_per_stage():
+    if not timing.reset_maxrss():
+        pytest.skip("can't reset the peak memory here")
+
+    timer=timing.StageTimer(stages=['big','small'], verbose=False,
+                           owns_process=True)
+    with timer.stage('big'):
+        a=numpy.ones(50*1024*1024//8)
+        del a
+    with timer.stage('small'):
+        pass
+
+    big=timer.records['big']['maxrss_mb']
+    small=timer.records['small']['maxrss_mb']
+    assert small < big - 25
+
+    meta=numpy.zeros(1, dtype=timer.get_meta_dtype())
+    timer.fill_meta(meta)
+    assert meta['maxrss_per_stage'][0]==1
+
+def test_shared_process_is_cumulative():
+    timer=timing.StageTimer(stages=['big','small'], verbose=False)
+    with timer.stage('big'):
+        a=numpy.ones(50*1024*1024//8)
+        del a
+    with timer.stage('small'):
+        pass
+
+    # not reset, so later stages include the earlier peak
+    big=timer.records['big']['maxrss_mb']
+    small=timer.records['small']['maxrss_mb']
+    assert small >= big
+
+    meta=numpy.zeros(1, dtype=timer.get_meta_dtype())
+    timer.fill_meta(meta)
+    assert meta['maxrss_per_stage'][0]==0
+
+def test_prepare_stages_recorded(tmp_path):
+    pytest.importorskip('fitsio')
+    from eyeballer import cutouts, synthetic
+
+    image_file, bkg_file = synthetic.write_decam_inputs(str(tmp_path), nrows=128,
+                                                        ncols=64, seed=1)[0]
+    fitsfile=str(tmp_path / 'out-eyeball.fits.fz')
+    maker=cutouts.EyeballMaker({'rebin':4, 'pyramid':[4,16]}, image_file, bkg_file)
+    maker.write_fits(fitsfile)
+
+    # every stage timed by the maker is in the metadata
+    assert sorted(maker.timer.records)==sorted(timing.STAGES)
+    data=timing.read_timing([fitsfile])
+    for name in timing.STAGES:
+        assert data['%s_wall' % name][0] >= 0